@@ -0,0 +1,464 @@
+#------------------------------------------------------------------------------#
+# Headers
+#------------------------------------------------------------------------------#
+
+__appname__ = "skeleton-app"         #App Name (the whole operation)
+__packagename__ = "skeleton-package" #Package Name (this package)
+__modulename__ = "benchmarks"        #Module Name (this file)
+__version__ = "0.0.1"                #Version (semver)
+__date__ = "20180625-2330"
+
+__authors__ = ["Kristoffer Law"]     #Primary Authors
+__credits__ = ["Kristoffer Law"]     #Bugfix submissions, minor authors
+__copyright__ = "Kristoffer Law"
+__license__ = "Apache 2.0"
+
+__maintainer__ = "Kristoffer Law"
+__email__ = "klaw@kslaw.me"
+__status__ = "Prototype"            #Prototype, Developer, Production
+
+#------------------------------------------------------------------------------#
+# Imports
+#------------------------------------------------------------------------------#
+import argparse
+import asyncio
+import collections
+import contextlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import re
+
+import fs
+import hierarchy
+#------------------------------------------------------------------------------#
+# Constants
+#------------------------------------------------------------------------------#
+FILE_NAMES = ["report - Draft Final (year 2018) - notes.txt", "image.png",
+              "data (v 2).csv", "script.py", "README"]
+CONTINENTS = ["Africa", "Antarctica", "Asia", "Europe", "North America",
+              "Oceania", "South America"]
+TMPFS = "/dev/shm" #Generated directory trees go here when it is writable
+
+#------------------------------------------------------------------------------#
+# Functions
+#------------------------------------------------------------------------------#
+def make_tree(path, folders, files_per_folder):
+    """Creates <folders> folders, ten per level, each holding
+    <files_per_folder> empty files. Returns the number of entries."""
+    queue = collections.deque([path])
+    os.makedirs(path, exist_ok = True)
+    made = 0
+    while queue and made < folders:
+        parent = queue.popleft()
+        for i in range(min(10, folders - made)):
+            folder = os.path.join(parent, "folder {0}".format(i))
+            os.mkdir(folder)
+            for j in range(files_per_folder):
+                name = "{0} {1}".format(j, FILE_NAMES[j % len(FILE_NAMES)])
+                open(os.path.join(folder, name), "wb").close()
+                continue
+            queue.append(folder)
+            made += 1
+            continue
+        continue
+    return folders * (files_per_folder + 1)
+
+@contextlib.contextmanager
+def delayed_listing(latency):
+    """Stands in for a high latency mount: every fs stat and scandir call
+    sleeps <latency> seconds first."""
+    stat, scandir = fs._stat, fs._scandir
+    def stat_(path):
+        time.sleep(latency)
+        return stat(path)
+    def scandir_(path):
+        time.sleep(latency)
+        return scandir(path)
+    fs._stat, fs._scandir = stat_, scandir_
+    try:
+        yield None
+    finally:
+        fs._stat, fs._scandir = stat, scandir
+    return
+
+def wide_hierarchy(size = 10000):
+    """A root holding <size> sub nodes, each with one value."""
+    root = hierarchy.HierarchyDict("wide")
+    for i in range(size):
+        root.create_node("node {0}".format(i))["value"] = i
+        continue
+    return root
+
+def deep_hierarchy(size = 10000, depth = 100):
+    """<size> nodes in chains <depth> nodes deep, one value per node."""
+    root = hierarchy.HierarchyDict("deep")
+    node = root
+    for i in range(size):
+        if i % depth == 0:
+            node = root.create_node("chain {0}".format(i // depth))
+        else:
+            node = node.create_node("level {0}".format(i % depth))
+        node["value"] = i
+        continue
+    return root
+
+def geographic_hierarchy(size = 10000):
+    """Continent/country/region/city nodes, about <size> cities each holding
+    a population and coordinates, the shape of a gazetteer."""
+    root = hierarchy.HierarchyDict("world")
+    cities = max(1, size // (len(CONTINENTS) * 20 * 10))
+    for continent in CONTINENTS:
+        continent = root.create_node(continent)
+        for i in range(20):
+            country = continent.create_node("Country {0:02}".format(i))
+            for j in range(10):
+                region = country.create_node("Region {0}".format(j))
+                for k in range(cities):
+                    city = region.create_node("City {0}".format(k))
+                    city["population"] = (i + 1) * (j + 1) * (k + 1) * 1000
+                    city["coordinates"] = (i * 1.5 - 45.0, j * 3.5 - 90.0)
+                    continue
+                continue
+            continue
+        continue
+    return root
+
+def tmpfs_path():
+    """TMPFS if it is a writable directory, otherwise None (the default
+    temporary directory)."""
+    if os.path.isdir(TMPFS) and os.access(TMPFS, os.W_OK):
+        return TMPFS
+    return None
+
+def measure(function, setup = None, number = 5, ops = 1):
+    """Calls <function> <number> times, with the result of <setup> if given,
+    which is not timed. <ops> is the operations one call makes. Returns
+    ops_per_sec, then peak_bytes (tracemalloc) and the fs syscalls of one
+    more call, traced separately so tracing does not skew the timing.
+    The garbage collector is paused while timing, as timeit does."""
+    seconds = 0.0
+    for i in range(number + 1):
+        args = () if setup is None else (setup(),)
+        if i == number:
+            fs.reset_syscalls()
+            tracemalloc.start()
+            function(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            break
+        with hierarchy.gc_paused():
+            seconds += timed(function, *args)[0]
+        continue
+    return collections.OrderedDict([("ops_per_sec", number * ops / max(seconds, 1e-9)),
+                                    ("peak_bytes", peak),
+                                    ("syscalls", sum(fs.SYSCALLS.values()))])
+
+def flatten(results, prefix = ""):
+    """Nested result dicts as one dict of dotted keys."""
+    flat = collections.OrderedDict()
+    for key, value in results.items():
+        key = prefix + key
+        if isinstance(value, dict) and key.count(".") < 2:
+            flat.update(flatten(value, key + "."))
+        else:
+            flat[key] = value
+        continue
+    return flat
+
+def save_baseline(results, path):
+    """Writes {bench name: results} as JSON for compare."""
+    with open(path, "w") as f:
+        json.dump(results, f, indent = 1)
+    return None
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+def compare(results, baseline):
+    """Ratio of each numeric result to its baseline, None where the baseline
+    has no such result. Above 1 is more ops_per_sec, bytes or syscalls."""
+    ratios = collections.OrderedDict()
+    for key, value in results.items():
+        old = baseline.get(key, None)
+        if type(value) in (int, float) and type(old) in (int, float) and old:
+            ratios[key] = value / old
+        else:
+            ratios[key] = None
+        continue
+    return ratios
+
+def timed(function, *args, **kwargs):
+    """Returns (seconds, result) for one call."""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return (time.perf_counter() - start, result)
+
+def bench_snapshot(folders = 2000, files_per_folder = 50, path = None):
+    """Compares walk() against save_snapshot/load_snapshot on a generated
+    tree. load_lazy plus check (FolderStore.changed) is the startup path when
+    nothing changed, from_snapshot the one rebuilding a mutable tree. The
+    tree is aged past fs.RACY_MTIME_NS first so fingerprints are not racy.
+    Times are in seconds with a warm page cache, a cold walk is slower."""
+    base = tempfile.mkdtemp(dir = path)
+    try:
+        root_path = os.path.join(base, "root")
+        entries = make_tree(root_path, folders, files_per_folder)
+        time.sleep(fs.RACY_MTIME_NS / 10**9)
+        snapshot_path = os.path.join(base, "tree.snap")
+
+        results = collections.OrderedDict([("entries", entries)])
+        root = fs.Folder(root_path)
+        results["walk"] = timed(root.walk)[0]
+        results["save"] = timed(root.save_snapshot, snapshot_path)[0]
+        results["snapshot_bytes"] = os.path.getsize(snapshot_path)
+        results["load_lazy"], view = timed(fs.Folder.load_snapshot, snapshot_path)
+        results["check"], changed = timed(view._store.changed)
+        assert not changed, \
+               """Nothing changed since the snapshot!"""
+        results["thaw"] = timed(view.thaw)[0]
+        fs.reset_syscalls()
+        results["from_snapshot"], loaded = timed(fs.Folder.from_snapshot, snapshot_path)
+        results["from_snapshot_syscalls"] = dict(fs.SYSCALLS)
+        assert [i[0] for i in loaded.iter_walk()] == [i[0] for i in root.iter_walk()], \
+               """Snapshot tree differs from the walked tree!"""
+    finally:
+        shutil.rmtree(base)
+    return results
+
+def bench_lazy(folders = 2000, files_per_folder = 50, path = None):
+    """Compares eager and lazy (FileStub) walks of a generated tree: walk
+    time, memory held by the tree, and the cost of gather_file_exts, which
+    reads stubs without materializing them."""
+    base = tempfile.mkdtemp(dir = path)
+    try:
+        root_path = os.path.join(base, "root")
+        results = collections.OrderedDict([("entries", make_tree(root_path, folders, files_per_folder))])
+        for mode, lazy in (("eager", False), ("lazy", True)):
+            results[mode + "_walk"] = timed(fs.Folder(root_path).walk, lazy = lazy)[0]
+            tracemalloc.start()
+            root = fs.Folder(root_path)
+            root.walk(lazy = lazy)
+            results[mode + "_bytes"] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            results[mode + "_exts"] = timed(root.gather_file_exts)[0]
+            results[mode + "_values"] = timed(lambda: [i for i in root.iter_walk()])[0]
+            del root
+            continue
+    finally:
+        shutil.rmtree(base)
+    return results
+
+def bench_async(folders = 200, files_per_folder = 10, path = None, latency = 0.005, concurrency = 32):
+    """Compares walk() against async_walk on a generated tree behind
+    delayed_listing, plus the time until async_walk yields its first
+    folder, and the longest the event loop went without running a
+    heartbeat task during the walk."""
+    base = tempfile.mkdtemp(dir = path)
+    try:
+        root_path = os.path.join(base, "root")
+        results = collections.OrderedDict([("entries", make_tree(root_path, folders, files_per_folder))])
+        with delayed_listing(latency):
+            serial = fs.Folder(root_path)
+            results["walk"] = timed(serial.walk)[0]
+
+            async def walk_():
+                root = fs.Folder(root_path)
+                gaps = [0.0]
+                def heartbeat_(last):
+                    now = time.perf_counter()
+                    gaps[0] = max(gaps[0], now - last)
+                    handles.append(loop.call_later(0.001, heartbeat_, now))
+                    return None
+                loop = asyncio.get_running_loop()
+                handles = [loop.call_soon(heartbeat_, time.perf_counter())]
+                start = time.perf_counter()
+                first = None
+                async for folder in root.async_walk(concurrency = concurrency):
+                    if first is None:
+                        first = time.perf_counter() - start
+                    continue
+                handles[-1].cancel()
+                return (time.perf_counter() - start, first, gaps[0], root)
+
+            results["async_walk"], results["async_first"], results["loop_blocked"], root = asyncio.run(walk_())
+        assert [i[0] for i in root.iter_walk()] == [i[0] for i in serial.iter_walk()], \
+               """Async tree differs from the walked tree!"""
+    finally:
+        shutil.rmtree(base)
+    return results
+
+def bench_hierarchy(size = 10000, number = 5):
+    """ops/sec, peak memory and syscalls of HierarchyDict operations on wide,
+    deep and geographic trees of about <size> nodes. create_node and _ref_id
+    ops are per node (ref ids dropped before each run), recurse per full
+    walk, query (regex, also by full ref ids), search, glob and acquire
+    per call on one node's children, with the query cache cleared so every
+    call does the work."""
+    results = collections.OrderedDict()
+    for shape in (wide_hierarchy, deep_hierarchy, geographic_hierarchy):
+        name = shape.__name__.split("_")[0]
+        root = shape(size)
+        nodes = [i[2] for i in root.iter_walk() if isinstance(i[2], hierarchy.HierarchyDict)]
+        target = nodes[len(nodes) // 2]
+        parent = target.container
+
+        def ref_ids_(state):
+            for node in nodes:
+                node._ref_id
+                continue
+            return None
+        def uncached_():
+            root._invalidate_ref_ids()
+            root.clear_query_cache()
+            return None
+        query = re.compile(re.escape(parent.ref_id) + "/.*")
+        search = re.escape(parent.ref_id) + "/*"
+        glob = hierarchy._glob_escape(parent.ref_id) + "/*"
+
+        shape_results = results[name] = collections.OrderedDict([("nodes", len(nodes))])
+        shape_results["create_node"] = measure(lambda: shape(size), number = number, ops = len(nodes))
+        shape_results["_ref_id"] = measure(ref_ids_, uncached_, number, len(nodes))
+        shape_results["recurse"] = measure(lambda: root.recurse(lambda k, v, c: 1), number = number)
+        shape_results["query"] = measure(lambda i: root.query(query), uncached_, number)
+        shape_results["query_ref_ids"] = measure(lambda i: root.query(query, full_ref_ids = True), uncached_, number)
+        shape_results["search"] = measure(lambda i: root.search(search), uncached_, number)
+        shape_results["glob"] = measure(lambda i: root.glob(glob), uncached_, number)
+        shape_results["acquire"] = measure(lambda: root.acquire(target.ref_id), number = number * 100, ops = 1)
+        continue
+    return flatten(results)
+
+def bench_compact(size = 1000, leaves = 100, number = 5):
+    """Memory held by a mutable tree of <size> nodes, <leaves> values each,
+    against its compact() copy, with the reduction factor, plus ops/sec of
+    reading every value and of a full recurse on both."""
+    def build_():
+        root = hierarchy.HierarchyDict("root")
+        for i in range(size):
+            node = root.create_node("node {0}".format(i // 10)) if i % 10 == 0 else node
+            node = node.create_node("leaf node {0}".format(i))
+            for j in range(leaves):
+                node["value {0}".format(j)] = j
+                continue
+            node = node.container
+            continue
+        return root
+
+    results = collections.OrderedDict([("entries", size * (leaves + 1))])
+    tracemalloc.start()
+    root = build_()
+    results["mutable_bytes"] = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tracemalloc.start()
+    compact = root.compact()
+    results["compact_bytes"] = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    results["reduction"] = results["mutable_bytes"] / max(results["compact_bytes"], 1)
+    for name, tree in (("mutable", root), ("compact", compact)):
+        def read_(tree = tree):
+            for node in tree.values():
+                for sub_node in node.values():
+                    for value in sub_node.values():
+                        pass
+                    continue
+                continue
+            return None
+        results[name + "_read"] = measure(read_, number = number, ops = size * leaves)
+        results[name + "_recurse"] = measure(lambda: tree.recurse(lambda k, v, c: 1), number = number)
+        continue
+    return flatten(results)
+
+def bench_fs(folders = 500, files_per_folder = 20, path = None, number = 5, workers = 8, latency = 0.001):
+    """ops/sec, peak memory and syscalls of Folder.scan (the top folder),
+    walk, walk with <workers> threads and purge, and of
+    WalkClassifier.__call__ per path, on a tree generated under <path>,
+    tmpfs_path() by default. Both walks run again behind delayed_listing
+    with <latency>, where listing, not parsing, is the cost."""
+    base = tempfile.mkdtemp(dir = path or tmpfs_path())
+    try:
+        root_path = os.path.join(base, "root")
+        results = collections.OrderedDict([("entries", make_tree(root_path, folders, files_per_folder))])
+        def walked_(workers = None):
+            root = fs.Folder(root_path)
+            root.walk(workers = workers)
+            return root
+        walked = walked_()
+        assert [i[0] for i in walked_(workers).iter_walk()] == [i[0] for i in walked.iter_walk()], \
+               """Parallel walk differs from the serial walk!"""
+        paths = [i[2].path for i in walked.iter_walk() if isinstance(i[2], (fs.File, fs.Folder))]
+        hooks = [".csv", ".py", "README", re.compile(r".*\(year \d+\)"), "Draft"]
+        BenchFile = type("BenchFile", (fs.File,), {"_BenchFile__CLASS_HOOKS": hooks})
+        classifier = fs.WalkClassifier([fs.Folder], [BenchFile])
+        def classify_():
+            for path in paths:
+                classifier(path)
+                continue
+            return None
+
+        results["scan"] = measure(lambda: fs.Folder(root_path).scan(), number = number * 10)
+        results["walk"] = measure(lambda: walked_(), number = number)
+        results["walk_parallel"] = measure(lambda: walked_(workers), number = number)
+        with delayed_listing(latency):
+            results["walk_delayed"] = measure(lambda: walked_(), number = 1)
+            results["walk_parallel_delayed"] = measure(lambda: walked_(workers), number = 1)
+        results["purge"] = measure(lambda root: root.purge(["py"]), walked_, number)
+        results["classifier"] = measure(classify_, number = number, ops = len(paths))
+    finally:
+        shutil.rmtree(base)
+    return flatten(results)
+
+#------------------------------------------------------------------------------#
+# Main
+#------------------------------------------------------------------------------#
+if __name__ == "__main__":
+    BENCHES = (bench_hierarchy, bench_compact, bench_fs, bench_snapshot, bench_lazy, bench_async)
+    parser = argparse.ArgumentParser(description = "Runs the benchmarks.")
+    parser.add_argument("folders", type = int, nargs = "?")
+    parser.add_argument("files_per_folder", type = int, nargs = "?")
+    parser.add_argument("--size", type = int, help = "nodes per bench_hierarchy and bench_compact tree")
+    parser.add_argument("--leaves", type = int, help = "values per bench_compact node")
+    parser.add_argument("--only", nargs = "+", choices = [i.__name__ for i in BENCHES])
+    parser.add_argument("--baseline", help = "JSON results to compare against")
+    parser.add_argument("--save", help = "writes the results as JSON")
+    parser.add_argument("--profile", action = "store_true",
+                        help = "prints a hierarchy.Profiler report of the run")
+    options = parser.parse_args()
+
+    baseline = load_baseline(options.baseline) if options.baseline else {}
+    profiler = hierarchy.Profiler(fs.PROFILE_TARGETS)
+    if options.profile:
+        profiler.enable()
+    saved = collections.OrderedDict()
+    for bench in BENCHES:
+        if options.only and not bench.__name__ in options.only:
+            continue
+        kwargs = {k:getattr(options, k) for k in ("folders", "files_per_folder", "size", "leaves")
+                  if getattr(options, k) is not None and k in inspect.signature(bench).parameters}
+        print(bench.__name__)
+        results = saved[bench.__name__] = bench(**kwargs)
+        ratios = compare(results, baseline.get(bench.__name__, {}))
+        for key, value in results.items():
+            ratio = "" if ratios[key] is None else "x{0:.2f}".format(ratios[key])
+            if type(value) == float:
+                value = "{0:.6g}".format(value)
+            print("    {0:32} {1:>16} {2}".format(key, str(value), ratio))
+            continue
+        continue
+    profiler.disable()
+    if options.profile:
+        print("profile")
+        for name, counts in profiler.report().items():
+            print("    {0}".format(name))
+            for key, value in counts.items():
+                print("        {0:16} {1:.6g}".format(key, value))
+                continue
+            continue
+    if options.save:
+        save_baseline(saved, options.save)
+    pass
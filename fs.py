@@ -20,8 +20,19 @@ __status__ = "Prototype"            #Prototype, Developer, Production
 #------------------------------------------------------------------------------#
 # Imports
 #------------------------------------------------------------------------------#
+import asyncio
 import collections
+import concurrent.futures
+import hashlib
+import inspect
+import itertools
+import mmap
 import os
+import pickle
+import sys
+import threading
+import time
+import weakref
 
 import re
 
@@ -30,22 +41,270 @@ import helpers
 #------------------------------------------------------------------------------#
 # Constants
 #------------------------------------------------------------------------------#
+RACY_MTIME_NS = 2 * 10**9 #Folders modified this close to their listing are re-listed
+AHO_CORASICK_MIN_HOOKS = 32 #Fewer substring hooks are probed one by one with 'in'
+NAME_CACHE_SIZE = 65536 #Parsed names memoized, names repeat across folders
+CONTENT_DIGEST_SIZE = 32   #Bytes of blake2b per file content digest
+DIGEST_CHUNK_SIZE = 1 << 20 #Bytes hashed per read or mmap slice
+DIGEST_MMAP_MIN = 1 << 24   #Files this large are hashed through mmap
+DIGEST_BATCH = 64           #Files per thread pool task when hashing
+DIGEST_CACHE_SIZE = 1 << 20 #Digests a DigestCache holds before evicting
 
 #------------------------------------------------------------------------------#
 # Functions
 #------------------------------------------------------------------------------#
+def _count(syscall):
+    with _SYSCALLS_LOCK:
+        SYSCALLS[syscall] += 1
+    return None
+
+def _exists(path):
+    _count("stat")
+    return os.path.exists(path)
+
+def _isfile(path):
+    _count("stat")
+    return os.path.isfile(path)
+
+def _isdir(path):
+    _count("stat")
+    return os.path.isdir(path)
+
+def _stat(path):
+    _count("stat")
+    return os.stat(path)
+
+def _scandir(path):
+    _count("scandir")
+    return os.scandir(path)
+
+def _entry_is_file(entry):
+    """DirEntry type checks use the cached d_type, only symlinks stat."""
+    if entry.is_symlink():
+        _count("stat")
+    return entry.is_file()
+
+def _entry_is_dir(entry):
+    if entry.is_symlink():
+        _count("stat")
+    return entry.is_dir()
+
+def _accepts_entry(cls):
+    """True if <cls>(path, entry = ...) is supported, user subclasses may
+    override __init__ with the older (path, exists) signature."""
+    accepts = _ACCEPTS_ENTRY.get(cls, None)
+    if accepts is None:
+        try:
+            parameters = inspect.signature(cls.__init__).parameters
+        except (TypeError, ValueError):
+            parameters = {}
+        accepts = "entry" in parameters or any(
+            i.kind == i.VAR_KEYWORD for i in parameters.values())
+        _ACCEPTS_ENTRY[cls] = accepts
+    return accepts
+
+def _passes_entry(walk_classifier):
+    """True if <walk_classifier> takes the DirEntry as a second argument,
+    as WalkClassifier does. Older classifiers take only the path."""
+    if isinstance(walk_classifier, WalkClassifier):
+        return True
+    try:
+        accepts = _PASSES_ENTRY.get(walk_classifier, None)
+    except TypeError:
+        accepts = None
+    if accepts is None:
+        try:
+            parameters = inspect.signature(walk_classifier).parameters.values()
+        except (TypeError, ValueError):
+            parameters = []
+        positional = [i for i in parameters if i.kind in (i.POSITIONAL_ONLY, i.POSITIONAL_OR_KEYWORD)]
+        accepts = len(positional) > 1 or any(i.kind == i.VAR_POSITIONAL for i in parameters)
+        try:
+            _PASSES_ENTRY[walk_classifier] = accepts
+        except TypeError:
+            pass
+    return accepts
+
+def classify(walk_classifier, path, entry = None):
+    """Class <walk_classifier> picks for <path>, None for the default.
+    <entry> is only passed to classifiers that take it, see _passes_entry."""
+    if entry is not None and _passes_entry(walk_classifier):
+        return walk_classifier(path, entry)
+    return walk_classifier(path)
+
+def _create(cls, path, entry):
+    if _accepts_entry(cls):
+        return cls(path, entry = entry)
+    return cls(path)
+
+def _is_extension(hook):
+    """True for string hooks like ".txt", looked up by a path's own
+    extension before any substring search."""
+    return hook.startswith(os.path.extsep) and len(hook) > 1 and \
+           not os.path.extsep in hook[1:] and not os.sep in hook
+
+def _parse_name(name):
+    """FSObject._keyword_parser memoized on <name>, in an immutable form:
+    (base, keywords tuple, keyvalues pairs tuple, description, ext)."""
+    with _NAME_CACHE_LOCK:
+        parsed = NAME_CACHE.get(name, None)
+    if parsed is not None:
+        return parsed
+    base, keywords, keyvalues, description, ext = FSObject._keyword_parser(name)
+    if ext:
+        ext = sys.intern(ext)
+    parsed = (base, tuple(keywords), tuple(keyvalues.items()), description, ext)
+    with _NAME_CACHE_LOCK:
+        NAME_CACHE.put(name, parsed)
+    return parsed
+
+def _name_terms(name, fields, is_file = False):
+    """Index terms for an FSObject named <name>, taking its already parsed
+    <fields> (an instance __dict__) over a fresh parse."""
+    base, keywords, keyvalues, description, ext = _parse_name(name)
+    keywords = fields.get("key_words", keywords)
+    keyvalues = fields["key_values"].items() if "key_values" in fields else keyvalues
+    terms = [("keyword", i) for i in keywords if i]
+    terms.extend([("key_value", i) for i in keyvalues])
+    if is_file:
+        if "file_ext" in fields:
+            file_ext = fields["file_ext"]
+        else:
+            file_ext = sys.intern(ext.replace(os.path.extsep, "")) if ext else ""
+        terms.append(("file_ext", file_ext))
+    return terms
+
+def _value_digest(key, value):
+    """Folder digests see files by their size alone, their name being the
+    key, so a FileStub and its File digest alike. Sizes are None unless
+    listed with <sizes>, see Folder._list."""
+    if isinstance(value, (FSObject, FileStub)):
+        return repr(getattr(value, "size", None)).encode()
+    return hierarchy.ColumnarStore._value_digest(None, key, value)
+
+def parse_names(names):
+    """Pre-warms the parsed name cache with <names> (basenames), e.g. from
+    a listing or a previous run, so FSObjects created later parse for the
+    cost of a lookup. Returns the number of names not yet cached."""
+    parsed = 0
+    for name in names:
+        with _NAME_CACHE_LOCK:
+            cached = name in NAME_CACHE
+        if not cached:
+            _parse_name(name)
+            parsed += 1
+        continue
+    return parsed
+
+def _content_key(stat):
+    """What a file's content digest is cached under, (device, inode, size,
+    mtime_ns)."""
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+def _hash_file(path):
+    """(key, hex digest, changed) for the file at <path>, the key taken from
+    the open file and <changed> True if it changed while being read.
+    Large files are hashed through mmap, others in DIGEST_CHUNK_SIZE reads,
+    hashlib releases the GIL on both."""
+    with open(path, "rb") as file_:
+        _count("open")
+        before = os.fstat(file_.fileno())
+        hash_ = hashlib.blake2b(digest_size = CONTENT_DIGEST_SIZE)
+        if before.st_size >= DIGEST_MMAP_MIN:
+            with mmap.mmap(file_.fileno(), 0, access = mmap.ACCESS_READ) as map_:
+                for offset in range(0, len(map_), DIGEST_CHUNK_SIZE):
+                    with memoryview(map_)[offset:offset + DIGEST_CHUNK_SIZE] as chunk:
+                        hash_.update(chunk)
+                    continue
+        else:
+            chunk = file_.read(DIGEST_CHUNK_SIZE)
+            while chunk:
+                hash_.update(chunk)
+                chunk = file_.read(DIGEST_CHUNK_SIZE)
+                continue
+        after = os.fstat(file_.fileno())
+    key = _content_key(before)
+    return (key, hash_.hexdigest(), key != _content_key(after))
+
+def file_digest(path, cache = None):
+    """(hex digest, size, cached) of the contents of the file at <path>.
+    A DigestCache <cache> answers for files unchanged since they were last
+    hashed, by one stat. Files modified within RACY_MTIME_NS, or while
+    being read, are not cached, the same mtime could hide a later write."""
+    if cache is not None:
+        key = _content_key(_stat(path))
+        digest = cache.get(key)
+        if digest is not None:
+            return (digest, key[2], True)
+    key, digest, changed = _hash_file(path)
+    if cache is not None and not changed and key[3] + RACY_MTIME_NS < time.time_ns():
+        cache.put(key, digest)
+    return (digest, key[2], False)
+
+def _map_batched(function, items, workers):
+    """Yields function(item) for each of <items>, in order, computed in a
+    thread pool of <workers> in batches of DIGEST_BATCH items. At most
+    2 * <workers> batches are in flight."""
+    def batch_(items):
+        return [function(i) for i in items]
+    items = iter(items)
+    pending = collections.deque()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers = workers)
+    try:
+        while True:
+            batch = list(itertools.islice(items, DIGEST_BATCH))
+            if batch:
+                pending.append(executor.submit(batch_, batch))
+            while pending and (len(pending) >= workers * 2 or not batch):
+                yield from pending.popleft().result()
+                continue
+            if not batch:
+                break
+            continue
+    finally:
+        executor.shutdown(wait = True, cancel_futures = True)
+    return
+
+def reset_syscalls():
+    """Clears the SYSCALLS counters."""
+    SYSCALLS.clear()
+    return None
 
 #------------------------------------------------------------------------------#
 # Classes
 #------------------------------------------------------------------------------#
+DirFingerprint = collections.namedtuple("DirFingerprint", ["inode", "mtime_ns", "entries", "racy"])
+
 class FSType(object):
     FOLDERS = 1
     FILES = 2
     ALL = 3
 
+class ParsedField(object):
+    """Non data descriptor for a field parsed from an FSObject's name. The
+    first read parses the name into the instance __dict__, which then
+    shadows the descriptor, so later reads are plain attribute lookups."""
+    def __set_name__(self, owner, name):
+        self.name = name
+        return None
+
+    def __get__(self, obj, owner = None):
+        if obj is None:
+            return self
+        obj._parse()
+        return obj.__dict__[self.name]
+
 class FSObject(object):
     WINDOWS_INVALID_CHARS = re.compile(r"""[<>:"|?*]+""")
     WINDOWS_INVALID_FILE_CHARS = re.compile(r"""[/\\]+""")
+    KEY_VALUE_PATTERN = re.compile(r"""(\(\S* [^\(]*\))""")
+
+    core_name = ParsedField()
+    key_words = ParsedField()
+    key_values = ParsedField()
+    description = ParsedField()
+    ext = ParsedField()
+
     @staticmethod
     def _keyword_parser(name):
         """Locates keywords (Blah), keyvalues ((key value)), and
@@ -63,8 +322,7 @@ class FSObject(object):
             ext = os.path.extsep + name.split(os.path.extsep)[-1]
             name = name[0:name.rindex(os.path.extsep)]
 
-        pattern = r"""(\(\S* [^\(]*\))"""
-        pattern = re.compile(pattern)
+        pattern = FSObject.KEY_VALUE_PATTERN
         
         if not '-' in name:
             base = name.strip()
@@ -94,7 +352,9 @@ class FSObject(object):
 
         return (base,keywords,keyvalues,description,ext)
         
-    def __init__(self, path, exists = True):
+    def __init__(self, path, exists = True, entry = None):
+        """<entry> is the os.DirEntry <path> was listed from, if any, it
+        already proves existence so no stat is made."""
         assert type(path) in [str], \
                """<path> must be string!"""
         assert not FSObject.WINDOWS_INVALID_CHARS.match(path), \
@@ -103,33 +363,212 @@ class FSObject(object):
         assert not FSObject.WINDOWS_INVALID_FILE_CHARS.match(basename), \
                """Invalid characters detected in <path> (filename)!"""
         
-        if exists:
-            assert os.path.exists(path), \
+        if entry is not None:
+            assert exists, \
+                   """<entry> was listed, <path> exists!"""
+        elif exists:
+            assert _exists(path), \
                    """<path> not found!"""
         else:
-            assert not os.path.exists(path), \
+            assert not _exists(path), \
                    """<path> exists!"""
 
         self.path = path
         self.full_name = basename
-        self.folder = os.path.dirname(path)
-        self.subclass_hooks = {}
+        self.folder = sys.intern(os.path.dirname(path))
+
+        return None
+
+    def index_terms(self):
+        """(attribute, term) pairs for hierarchy.AttributeIndex, "keyword"
+        and "key_value" (a (key, value) pair)."""
+        return _name_terms(self.full_name, self.__dict__)
+
+    def _parse(self):
+        """Sets the fields parsed from the name, core_name, key_words,
+        key_values, description and ext, on first access. Fields already
+        set are kept."""
+        base, keywords, keyvalues, description, ext = _parse_name(self.full_name)
+        fields = self.__dict__
+        fields.setdefault("core_name", base)
+        if not "key_words" in fields:
+            fields["key_words"] = list(keywords)
+        if not "key_values" in fields:
+            fields["key_values"] = collections.OrderedDict(keyvalues)
+        fields.setdefault("description", description)
+        fields.setdefault("ext", ext)
+        return None
 
-        metadata = FSObject._keyword_parser(self.full_name)
-        self.core_name = metadata[0]
-        self.key_words = metadata[1]
-        self.key_values = metadata[2]
-        self.description = metadata[3]
-        self.ext = metadata[4]
+    @property
+    def subclass_hooks(self):
+        """Allocated on first access, most objects never use it."""
+        if not "_subclass_hooks" in self.__dict__:
+            self._subclass_hooks = {}
+        return self._subclass_hooks
 
+    @subclass_hooks.setter
+    def subclass_hooks(self, subclass_hooks):
+        self._subclass_hooks = subclass_hooks
         return None
 
     def exists(self):
-        if os.path.exists(self.path):
+        if _exists(self.path):
             return True
         return False
 
+class AhoCorasick(object):
+    """Finds which of many substrings occur in a text in one pass over it.
+    Each word carries a rank, first(text) returns the lowest ranked word
+    found. The failure links are folded into one transition dict per state,
+    so each character costs a single lookup."""
+    def __init__(self, words):
+        self.goto = [{}]
+        self.best = [None]
+        for word, rank in words:
+            state = 0
+            for char in word:
+                next_state = self.goto[state].get(char, None)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.best.append(None)
+                state = next_state
+                continue
+            if self.best[state] is None or rank < self.best[state]:
+                self.best[state] = rank
+            continue
+
+        #Breadth first, so a state's failure target is complete before it
+        fail = [0] * len(self.goto)
+        self.delta = [None] * len(self.goto)
+        self.delta[0] = self.goto[0]
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            self.delta[state] = dict(self.delta[fail[state]], **self.goto[state])
+            for char, next_state in self.goto[state].items():
+                fail[next_state] = self.delta[fail[state]].get(char, 0) if state else 0
+                inherited = self.best[fail[next_state]]
+                if inherited is not None and (self.best[next_state] is None or inherited < self.best[next_state]):
+                    self.best[next_state] = inherited
+                queue.append(next_state)
+                continue
+            continue
+        self.lowest = min([i for i in self.best if i is not None], default = None)
+        return None
+
+    def first(self, text):
+        delta = self.delta
+        best = self.best
+        lowest = self.lowest
+        found = None
+        state = 0
+        for char in text:
+            state = delta[state].get(char, 0)
+            rank = best[state]
+            if rank is not None and (found is None or rank < found):
+                found = rank
+                if rank == lowest:
+                    break
+            continue
+        return found
+
+class CompiledHooks(object):
+    """An ordered (hook, cls) table compiled for dispatch. Hooks are
+    callables (called with the path), objects with .match (matched against
+    the path) or strings (found anywhere in the path), the first hook in
+    table order that accepts a path wins. String hooks are resolved through
+    an extension dict and, when there are many, an AhoCorasick matcher,
+    re.Pattern hooks through one combined alternation and callables only
+    while they could still beat the best hit so far."""
+    def __init__(self, hooks):
+        self.hooks = list(hooks)
+        self.suffixes = {}
+        self.literals = []
+        self.literal_matcher = None
+        self.patterns = []
+        self.combined = None
+        self.combined_floor = None
+        self.combined_ranks = {}
+        self.others = []
+
+        for rank, (hook, cls) in enumerate(self.hooks):
+            if hasattr(hook, "__call__"):
+                self.others.append((rank, hook))
+            elif isinstance(hook, re.Pattern):
+                self.patterns.append((rank, hook))
+            elif hasattr(hook, "match"):
+                self.others.append((rank, hook))
+            elif type(hook) == str:
+                self.literals.append((rank, hook))
+                if _is_extension(hook):
+                    self.suffixes.setdefault(hook, rank)
+            continue
+
+        if len(self.literals) >= AHO_CORASICK_MIN_HOOKS:
+            self.literal_matcher = AhoCorasick([(i[1], i[0]) for i in self.literals])
+        self.combined = hierarchy._combine_regexes(self.patterns)
+        self.combined_floor = self.patterns[0][0] if self.patterns else None
+        if self.combined is not None:
+            self.combined_ranks = {v:int(k[2:]) for k, v in self.combined.groupindex.items()
+                                   if k.startswith("_q") and k[2:].isdigit()}
+            self.patterns = []
+        return None
+
+    def __len__(self):
+        return len(self.hooks)
+
+    def rank(self, path):
+        """Index of the first hook accepting <path>, None if none does."""
+        best = len(self.hooks)
+        if self.suffixes:
+            dot = path.rfind(os.path.extsep)
+            if dot > path.rfind(os.sep):
+                best = self.suffixes.get(path[dot:], best)
+        if self.literal_matcher is not None and best > AHO_CORASICK_MIN_HOOKS:
+            rank = self.literal_matcher.first(path)
+            if rank is not None and rank < best:
+                best = rank
+        else:
+            #At most <best> hooks rank ahead of the best hit so far
+            for rank, hook in self.literals:
+                if rank >= best:
+                    break
+                if hook in path:
+                    best = rank
+                    break
+                continue
+        if self.combined is not None and best > self.combined_floor:
+            match = self.combined.match(path)
+            if match is not None:
+                rank = self.combined_ranks[match.lastindex]
+                if rank < best:
+                    best = rank
+        for rank, hook in self.patterns:
+            if rank >= best:
+                break
+            if hook.match(path):
+                best = rank
+                break
+            continue
+        for rank, hook in self.others:
+            if rank >= best:
+                break
+            if hook(path) if hasattr(hook, "__call__") else hook.match(path):
+                best = rank
+                break
+            continue
+        if best == len(self.hooks):
+            return None
+        return best
+
+    pass
+
 class WalkClassifier(object):
+    """Picks the FSObject subclass for each walked path from the
+    __CLASS_HOOKS of <folder_classes> and <file_classes>, see
+    CompiledHooks. Per hook hit counts are kept in <hits>."""
     def __init__(self, folder_classes, file_classes):
         CLASS_HOOK_TOKEN = "_{0}__CLASS_HOOKS"
 
@@ -152,59 +591,155 @@ class WalkClassifier(object):
             cls_hooks = {k:cls for k in cls_hooks}
             self.file_hooks.update(cls_hooks)
             continue
-        
+
+        self.hits = collections.Counter()
+        self._hits_lock = threading.Lock()
+        self.compile()
         return None
-    
-    def __call__(self, path):
-        if os.path.isfile(path):
-            for hook, cls in self.file_hooks.items():
-                if hasattr(hook, "__call__"):
-                    if hook(path):
-                        return cls
-                    pass
-                if hasattr(hook, "match"):
-                    if hook.match(path):
-                        return cls
-                    pass
-                if hook in path:
-                    return cls
-                continue
-        if os.path.isdir(path):
-            for hook, cls in self.folder_hooks.items():
-                if hasattr(hook, "__call__"):
-                    if hook(path):
-                        return cls
-                    pass
-                if hasattr(hook, "match"):
-                    if hook.match(path):
-                        return cls
-                    pass
-                if hook in path:
-                    return cls
-                continue
+
+    def __getstate__(self):
+        """Pickles without the hits lock, FileStubs hold the classifier."""
+        state = dict(vars(self))
+        del state["_hits_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._hits_lock = threading.Lock()
+        return None
+
+    def compile(self):
+        """(Re)builds the dispatch tables, needed after changing
+        <folder_hooks> or <file_hooks>."""
+        self.compiled_folder_hooks = CompiledHooks(self.folder_hooks.items())
+        self.compiled_file_hooks = CompiledHooks(self.file_hooks.items())
         return None
-        
+
+    def _classify(self, path, is_file, is_dir):
+        if is_file:
+            compiled = self.compiled_file_hooks
+        elif is_dir:
+            compiled = self.compiled_folder_hooks
+        else:
+            return None
+        if len(compiled) < 1:
+            return None
+        rank = compiled.rank(path)
+        if rank is None:
+            return None
+        hook, cls = compiled.hooks[rank]
+        with self._hits_lock:
+            self.hits[hook] += 1
+        return cls
+    
+    def __call__(self, path, entry = None):
+        """<entry> is the os.DirEntry for <path>, if given its cached type is
+        used instead of stat calls."""
+        if entry is not None:
+            is_file = _entry_is_file(entry)
+            is_dir = not is_file and _entry_is_dir(entry)
+        else:
+            is_file = _isfile(path)
+            is_dir = not is_file and _isdir(path)
+        return self._classify(path, is_file, is_dir)
+
+    def classify_many(self, paths):
+        """Classifies each of <paths>, which may be path strings or
+        os.DirEntry objects (whose cached types save the stat calls).
+        Returns the classes, None where no hook matched, in order."""
+        results = []
+        for path in paths:
+            if isinstance(path, os.DirEntry):
+                is_file = _entry_is_file(path)
+                is_dir = not is_file and _entry_is_dir(path)
+                path = path.path
+            else:
+                is_file = _isfile(path)
+                is_dir = not is_file and _isdir(path)
+            results.append(self._classify(path, is_file, is_dir))
+            continue
+        return results
+
 
 class File(FSObject):
-    def __init__(self, path, exists = True):
+    file_name = ParsedField()
+    file_ext = ParsedField()
+    size = None #Bytes, set when listed with sizes, see Folder._list
+
+    def __init__(self, path, exists = True, entry = None):
         cls = self.__class__
-        FSObject.__init__(self, path, exists)
+        FSObject.__init__(self, path, exists, entry)
+        return None
 
-        self.file_name = self.core_name
-        if self.ext:
-            self.file_ext = self.ext.replace(os.path.extsep, "")
-        else:
-            self.file_ext = ""
-            
+    def index_terms(self):
+        """FSObject.index_terms plus "file_ext"."""
+        return _name_terms(self.full_name, self.__dict__, True)
+
+    def content_digest(self, cache = None):
+        """Hex digest of the file's contents, see file_digest."""
+        return file_digest(self.path, cache)[0]
+
+    def _parse(self):
+        FSObject._parse(self)
+        fields = self.__dict__
+        fields.setdefault("file_name", self.core_name)
+        if not "file_ext" in fields:
+            if self.ext:
+                fields["file_ext"] = sys.intern(self.ext.replace(os.path.extsep, ""))
+            else:
+                fields["file_ext"] = ""
         return None
 
     def __repr__(self):
         return "<{0} {1}/>".format(self.__class__.__name__, self.core_name)
 
+class FileStub(object):
+    """Stand in for a File listed in lazy mode, holding the name and the
+    walk_classifier to resolve it with. Its dirent type is known to be a
+    regular file, so it answers the os.DirEntry type checks without a stat.
+    Folder swaps it for the real, classified File on first read."""
+    __slots__ = ("full_name", "walk_classifier", "size")
+
+    def __init__(self, full_name, walk_classifier = None, size = None):
+        self.full_name = full_name
+        self.walk_classifier = walk_classifier
+        self.size = size
+        return None
+
+    def __repr__(self):
+        return "<{0} {1}/>".format(self.__class__.__name__, self.full_name)
+
+    def is_file(self, follow_symlinks = True):
+        return True
+
+    def is_dir(self, follow_symlinks = True):
+        return False
+
+    def is_symlink(self):
+        return False
+
+    def index_terms(self):
+        """File.index_terms, from the name alone."""
+        return _name_terms(self.full_name, {}, True)
+
+    @property
+    def file_ext(self):
+        """File.file_ext, from the name alone."""
+        ext = _parse_name(self.full_name)[4]
+        if not ext:
+            return ""
+        return sys.intern(ext.replace(os.path.extsep, ""))
+
 class Folder(FSObject, hierarchy.HierarchyDict):
-    def __init__(self, path, exists = True):
-        FSObject.__init__(self, path, exists)
+    _stubs = 0 #FileStubs held, see _materialize
+    rollups = (hierarchy.Rollup("files", lambda key, value: 1),
+               hierarchy.Rollup("size", lambda key, value: value.size),
+               hierarchy.Rollup("unsized", lambda key, value: int(value.size is None)))
+
+    def __init__(self, path, exists = True, entry = None):
+        FSObject.__init__(self, path, exists, entry)
         hierarchy.HierarchyDict.__init__(self, self.full_name)
+        self.fingerprint = None
         
         return None
 
@@ -214,6 +749,133 @@ class Folder(FSObject, hierarchy.HierarchyDict):
         return_ = return_.replace("contents", "files")
         return return_
 
+    #LAZY FILES
+    @classmethod
+    def _resolve_value(cls, state, key, value):
+        """The File FileStub <value> stands in for, created but not stored."""
+        if type(value) is not FileStub:
+            return value
+        path = os.path.join(state["path"], key)
+        file_cls = None
+        if value.walk_classifier:
+            file_cls = classify(value.walk_classifier, path, value)
+        obj = _create(file_cls or File, path, value)
+        if value.size is not None:
+            obj.size = value.size
+        return obj
+
+    def _materialize(self, key, stub):
+        """Replaces FileStub <stub> under <key> with its File."""
+        obj = self._resolve_value(vars(self), key, stub)
+        collections.OrderedDict.__setitem__(self, key, obj)
+        self._stubs -= 1
+        root = self._root
+        if root._path_index is not None:
+            entries = root._path_index.get(self.get_content_ref_id(key).lower(), [])
+            for i, entry in enumerate(entries):
+                if entry[-1] is stub:
+                    entries[i] = (entry[0], obj)
+                continue
+        return obj
+
+    def _materialize_all(self):
+        for key, value in list(collections.OrderedDict.items(self)):
+            if type(value) is FileStub:
+                self._materialize(key, value)
+            continue
+        return None
+
+    def __getitem__(self, key):
+        value = collections.OrderedDict.__getitem__(self, key)
+        if type(value) is FileStub:
+            return self._materialize(key, value)
+        return value
+
+    def __setitem__(self, key, item):
+        if self._stubs and type(collections.OrderedDict.get(self, key)) is FileStub:
+            self._stubs -= 1
+        if type(item) is FileStub:
+            self._stubs += 1
+        hierarchy.HierarchyDict.__setitem__(self, key, item)
+        return None
+
+    def __delitem__(self, key):
+        if self._stubs and type(collections.OrderedDict.get(self, key)) is FileStub:
+            self._stubs -= 1
+        hierarchy.HierarchyDict.__delitem__(self, key)
+        return None
+
+    def clear(self):
+        hierarchy.HierarchyDict.clear(self)
+        self._stubs = 0
+        return None
+
+    def get(self, key, default = None):
+        if key in self:
+            return self[key]
+        return default
+
+    def values(self):
+        if self._stubs:
+            self._materialize_all()
+        return collections.OrderedDict.values(self)
+
+    def items(self):
+        if self._stubs:
+            self._materialize_all()
+        return collections.OrderedDict.items(self)
+
+    def _nodes(self):
+        return tuple([i for i in collections.OrderedDict.values(self) if isinstance(i, Folder)])
+
+    nodes = property(_nodes, hierarchy.HierarchyDict.nodes.fset,
+                     doc = """Sub folders, read without materializing files.""")
+
+    def iter_folders(self):
+        """Yields this folder and every folder beneath it, pre-order,
+        leaving FileStubs alone."""
+        stack = [self]
+        while stack:
+            folder = stack.pop()
+            yield folder
+            stack.extend(reversed(folder._nodes()))
+            continue
+        return
+
+    @property
+    def file_count(self):
+        """Files beneath this folder, kept current as the tree changes."""
+        return self.rollup("files")
+
+    @property
+    def total_size(self):
+        """Bytes in the files beneath this folder, kept current as the tree
+        changes. None if any of them was listed without <sizes> (see
+        _list), rather than a total missing those files."""
+        if self.rollup("unsized"):
+            return None
+        return self.rollup("size")
+
+    def _value_digest(self, key, value):
+        return _value_digest(key, value)
+
+    def _copy_state(self):
+        """FSObject fields, fingerprint and FileStub count."""
+        return vars(self)
+
+    def iter_files(self):
+        """Yields (ref_id, key, file, folder) for every file beneath this
+        folder, FileStubs as they are."""
+        for folder in self.iter_folders():
+            ref_id = folder.ref_id
+            for key, value in list(collections.OrderedDict.items(folder)):
+                if isinstance(value, Folder):
+                    continue
+                yield (hierarchy.KEY_SPLIT.join([ref_id, key]), key, value, folder)
+                continue
+            continue
+        return
+
     def create(self):
         assert not os.path.exists(self.path), \
                """Folder instance already exists!"""
@@ -233,73 +895,684 @@ class Folder(FSObject, hierarchy.HierarchyDict):
         sub_folder.create()
         return sub_folder
         
-    def scan(self, walk_classifier = None):
-        """Scans only top folder, only loading files, not folders."""
+    def _list(self, walk_classifier = None, lazy = False, sizes = False):
+        """Lists the folder once with os.scandir, the cached DirEntry types
+        replace per entry stat calls. Returns the new, unattached objects in
+        listing order, touching no shared state so it may run in a thread.
+        If <lazy>, files are listed as FileStubs, classified and created on
+        first read. If <sizes>, each file is stat'ed once for its size,
+        which the "size" rollup (total_size) sums.
+        The folder's DirFingerprint is taken before listing, so a change made
+        during the listing shows up as a changed fingerprint later."""
+        objs = []
+        stat = _stat(self.path)
+        listed_ns = time.time_ns()
+        with _scandir(self.path) as entries:
+            for entry in entries:
+                is_file = _entry_is_file(entry)
+                if not is_file and not _entry_is_dir(entry):
+                    continue
+                size = None
+                if is_file and sizes:
+                    _count("stat")
+                    size = entry.stat().st_size
+                if is_file and lazy:
+                    objs.append(FileStub(sys.intern(entry.name), walk_classifier, size))
+                    continue
+                cls = None
+                if walk_classifier:
+                    cls = classify(walk_classifier, entry.path, entry)
+                if cls is None:
+                    cls = File if is_file else Folder
+                obj = _create(cls, entry.path, entry)
+                if size is not None:
+                    obj.size = size
+                objs.append(obj)
+                continue
+        racy = stat.st_mtime_ns + RACY_MTIME_NS >= listed_ns
+        self.fingerprint = DirFingerprint(stat.st_ino, stat.st_mtime_ns, len(objs), racy)
+        return objs
+
+    def _attach(self, objs):
+        """Adds listed objects, returns the sub folders among them."""
+        subfolders = []
+        for obj in objs:
+            self[obj.full_name] = obj
+            if isinstance(obj, Folder):
+                subfolders.append(obj)
+            continue
+        return subfolders
+
+    def _scan(self, walk_classifier = None, lazy = False, sizes = False):
+        return self._attach(self._list(walk_classifier, lazy, sizes))
+
+    def scan(self, walk_classifier = None, lazy = False, sizes = False):
+        """Scans only top folder, only loading files, not folders.
+        <lazy> stores files as FileStubs until read, <sizes> stats files
+        for their size, see _list."""
         assert self.exists(), \
                "Must exist before scanning!"
         
-        for obj in os.listdir(self.path):
-            path = os.path.join(self.path, obj)
-            if os.path.isfile(path):
-                if walk_classifier:
-                    cls = walk_classifier(path)
-                    if cls is None: cls = File
-                else:
-                    cls = File
-                file_ = cls(path)
-                self[file_.full_name] = file_
+        self._scan(walk_classifier, lazy, sizes)
+        return None
+
+    def walk(self, walk_classifier = None, workers = None, max_depth = None, cancel = None, lazy = False, sizes = False):
+        """Scans this folder and every sub folder. Only the top folder is
+        checked for existence, sub folders come from its listing.
+        <workers> lists that many directories at a time in a thread pool,
+        the resulting tree is identical to the serial walk's.
+        <max_depth> stops scanning past that many levels below this folder.
+        <cancel> is a threading.Event, once set no further folders are
+        scanned and the walk returns.
+        <lazy> stores files as FileStubs until read, <sizes> stats files
+        for their size, see _list."""
+        assert self.exists(), \
+               """Must exist before walking!"""
+        assert workers is None or workers > 0, \
+               """<workers> must be positive!"""
+        
+        if workers:
+            self._walk_parallel(walk_classifier, workers, max_depth, cancel, lazy, sizes)
+            return None
+
+        stack = [(self, 0)]
+        while stack:
+            if cancel is not None and cancel.is_set():
+                break
+            folder, depth = stack.pop()
+            subfolders = folder._scan(walk_classifier, lazy, sizes)
+            if max_depth is not None and depth >= max_depth:
                 continue
-            if os.path.isdir(path):
-                if walk_classifier:
-                    cls = walk_classifier(path)
-                    if cls is None: cls = Folder
-                else:
-                    cls = Folder
-                folder = cls(path)
-                self[folder.full_name] = folder
+            stack.extend([(i, depth + 1) for i in reversed(subfolders)])
+            continue
+        
+        return None
+
+    def _walk_parallel(self, walk_classifier, workers, max_depth, cancel, lazy = False, sizes = False):
+        """Listings run in the pool, results are attached to the tree on
+        this thread only, so the tree itself needs no locking. At most
+        2 * <workers> listings are in flight. Folders whose listing was
+        never attached, on cancel or error, are left unscanned."""
+        waiting = collections.deque([(self, 0)])
+        pending = {}
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers = workers)
+        try:
+            while waiting or pending:
+                if cancel is not None and cancel.is_set():
+                    break
+                while waiting and len(pending) < workers * 2:
+                    folder, depth = waiting.popleft()
+                    future = executor.submit(folder._list, walk_classifier, lazy, sizes)
+                    pending[future] = (folder, depth)
+                    continue
+                done, not_done = concurrent.futures.wait(
+                    pending, timeout = 0.1,
+                    return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    folder, depth = pending.pop(future)
+                    subfolders = folder._attach(future.result())
+                    if max_depth is not None and depth >= max_depth:
+                        continue
+                    waiting.extend([(i, depth + 1) for i in subfolders])
+                    continue
+                continue
+        finally:
+            executor.shutdown(wait = True, cancel_futures = True)
+            for folder, depth in pending.values():
+                folder.fingerprint = None #Listed, maybe, but not attached
                 continue
         return None
 
-    def walk(self, walk_classifier = None):
+    async def async_scan(self, walk_classifier = None, lazy = False, sizes = False, executor = None):
+        """scan() with the listing run off the event loop, in <executor>, the
+        loop's default executor if None."""
+        assert self.exists(), \
+               "Must exist before scanning!"
+        
+        loop = asyncio.get_running_loop()
+        objs = await loop.run_in_executor(executor, self._list, walk_classifier, lazy, sizes)
+        self._attach(objs)
+        return None
+
+    async def async_walk(self, walk_classifier = None, concurrency = 16, max_depth = None, lazy = False, sizes = False):
+        """walk() for asyncio, as an async generator yielding each Folder
+        once its listing is attached, this folder first, so consumers can
+        start before the walk ends. At most <concurrency> listings run at
+        a time in a thread pool of that size, the tree is only touched on
+        the event loop's thread. Cancelling the consuming task, or leaving
+        the loop early, stops the walk, listings already running finish
+        in the background and their folders are left unscanned."""
         assert self.exists(), \
                """Must exist before walking!"""
+        assert concurrency > 0, \
+               """<concurrency> must be positive!"""
         
-        self.scan(walk_classifier)
-        subfolders = [i for i in self.values() if isinstance(i, Folder)]
-        for subfolder in subfolders:
-            subfolder.walk(walk_classifier)
+        waiting = collections.deque([(self, 0)])
+        pending = {}
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers = concurrency)
+        try:
+            while waiting or pending:
+                while waiting and len(pending) < concurrency:
+                    folder, depth = waiting.popleft()
+                    future = executor.submit(folder._list, walk_classifier, lazy, sizes)
+                    pending[asyncio.wrap_future(future)] = (future, folder, depth)
+                    continue
+                done, not_done = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+                for awaitable in done:
+                    future, folder, depth = pending.pop(awaitable)
+                    subfolders = folder._attach(awaitable.result())
+                    if max_depth is None or depth < max_depth:
+                        waiting.extend([(i, depth + 1) for i in subfolders])
+                    yield folder
+                    continue
+                continue
+        finally:
+            for awaitable, (future, folder, depth) in pending.items():
+                awaitable.cancel()
+                future.add_done_callback(lambda future, folder = folder: setattr(folder, "fingerprint", None))
+                continue
+            executor.shutdown(wait = False, cancel_futures = True)
+        return
+
+    def _changed(self):
+        """True if the folder differs from its fingerprint on disk, or the
+        in memory folder no longer holds what was listed, or is gone."""
+        fingerprint = self.fingerprint
+        if fingerprint.racy or fingerprint.entries != len(self):
+            return True
+        try:
+            stat = _stat(self.path)
+        except OSError:
+            return True
+        return (stat.st_ino, stat.st_mtime_ns) != fingerprint[:2]
+
+    def refresh(self, walk_classifier = None, lazy = False, sizes = False):
+        """Brings a walked tree up to date with the filesystem. Every walked
+        folder is stat'ed, only those whose fingerprint changed are listed
+        again. New entries are added and missing ones removed through
+        __setitem__/__delitem__, unchanged File and Folder objects are kept.
+        New sub folders are walked. Folders never scanned are left alone.
+        Returns {"added": [...], "removed": [...], "modified": [...]} ref_ids,
+        modified being the folders that were listed again. <lazy> lists new
+        files as FileStubs, existing ones are not materialized. <sizes>
+        stats new files for their size, existing ones keep theirs."""
+        assert self.exists(), \
+               """Must exist before refreshing!"""
+        assert self.fingerprint is not None, \
+               """Must be scanned before refreshing!"""
         
-        return None
+        summary = collections.OrderedDict([("added", []), ("removed", []), ("modified", [])])
+        stack = [self]
+        while stack:
+            folder = stack.pop()
+            if folder._changed():
+                if not folder._relist(walk_classifier, summary, lazy, sizes):
+                    continue #Gone from disk, its container's relist drops it
+                summary["modified"].append(folder.ref_id)
+            subfolders = [i for i in folder._nodes() if i.fingerprint is not None]
+            stack.extend(reversed(subfolders))
+            continue
+        return summary
+
+    def _relist(self, walk_classifier, summary, lazy = False, sizes = False):
+        """Lists the folder again and applies the difference, False if it
+        can no longer be listed."""
+        try:
+            objs = self._list(walk_classifier, lazy, sizes)
+        except OSError:
+            return False
+        listed = collections.OrderedDict([(i.full_name, i) for i in objs])
+        for key, value in list(collections.OrderedDict.items(self)):
+            new = listed.get(key, None)
+            if new is not None and isinstance(new, Folder) == isinstance(value, Folder):
+                continue
+            summary["removed"].append(self.get_content_ref_id(key))
+            del self[key]
+            continue
+        for key, value in listed.items():
+            if key in self:
+                continue
+            self[key] = value
+            if isinstance(value, Folder):
+                value.walk(walk_classifier, lazy = lazy, sizes = sizes)
+                for folder in value.iter_folders():
+                    summary["added"].append(folder.ref_id)
+                    summary["added"].extend([folder.get_content_ref_id(k) for k, v in
+                                             collections.OrderedDict.items(folder)
+                                             if not isinstance(v, Folder)])
+                    continue
+            else:
+                summary["added"].append(self.get_content_ref_id(key))
+            continue
+        return True
+
+    @classmethod
+    def _columnar_store(cls):
+        return FolderStore
+
+    @classmethod
+    def from_snapshot(cls, path, walk_classifier = None):
+        """Rebuilds a walked tree from a snapshot written by save_snapshot
+        without listing anything, then refreshes it against the stored
+        fingerprints, so only folders changed since the snapshot are
+        listed again."""
+        folder = cls.load_snapshot(path).thaw()
+        folder.refresh(walk_classifier)
+        return folder
 
     def gather_file_exts(self):
-        """Gathers all file extensions present in sub folders into a list."""
-        def gather_exts_(key, value, container):
-            if not isinstance(value, File):
-                return None
-            return value.file_ext
-        results = self.recurse(gather_exts_)
-        results = list(set(results.values()))
+        """Gathers all file extensions present in sub folders into a list.
+        With an attribute index on the whole tree this reads its
+        "file_ext" terms only."""
+        index = self._root._attribute_index
+        if index is not None and self._root is self:
+            return list(index.postings.get("file_ext", {}))
+        results = set()
+        for ref_id, key, value, container in self.iter_files():
+            if isinstance(value, (File, FileStub)):
+                results.add(value.file_ext)
+            continue
+        results = list(results)
         return results
 
     def purge(self, file_types):
         """Purges all files from sub folders if not file.file_ext in <file_types>"""
         assert type(file_types) == list, \
                "<file_types> must be list!"
-        def purge_(key, value, container):
-            if not isinstance(value, File):
-                return None
+        results = collections.OrderedDict()
+        index = self._root._attribute_index
+        if index is not None:
+            #Only the postings of extensions not kept are visited
+            prefix = self.ref_id + hierarchy.KEY_SPLIT
+            for file_ext, postings in list(index.postings.get("file_ext", {}).items()):
+                if file_ext in file_types:
+                    continue
+                for ref_id, (container, key) in list(postings.items()):
+                    if self._root is self or ref_id.startswith(prefix):
+                        del container[key]
+                        results[ref_id] = True
+                    continue
+                continue
+            return results
+        for ref_id, key, value, container in self.iter_files():
+            if not isinstance(value, (File, FileStub)):
+                continue
             if not value.file_ext in file_types:
-                container.pop(key)
-                return True
-            return None
-        results = self.recurse(purge_)
+                del container[key]
+                results[ref_id] = True
+            continue
         return results
+
+    #CONTENT DIGESTS
+    def _file_paths(self):
+        """(ref_id, path, size) for every file beneath this folder, the size
+        None unless listed with <sizes>. FileStubs are left as they are."""
+        return [(ref_id, os.path.join(folder.path, key), getattr(value, "size", None))
+                for ref_id, key, value, folder in self.iter_files()]
+
+    def _digest_files(self, files, workers, cache):
+        """Hashes (ref_id, path, size) <files> in a thread pool, returns the
+        fingerprint_contents summary for them."""
+        def digest_(path):
+            try:
+                return file_digest(path, cache)
+            except OSError:
+                return None
+        start = time.perf_counter()
+        summary = collections.OrderedDict([("digests", collections.OrderedDict()), ("errors", []),
+                                           ("files", 0), ("bytes", 0), ("bytes_read", 0), ("cached", 0)])
+        results = _map_batched(digest_, [i[1] for i in files], workers)
+        for (ref_id, path, size), result in zip(files, results):
+            if result is None:
+                summary["errors"].append(ref_id)
+                continue
+            digest, size, cached = result
+            summary["digests"][ref_id] = digest
+            summary["files"] += 1
+            summary["bytes"] += size
+            if cached:
+                summary["cached"] += 1
+            else:
+                summary["bytes_read"] += size
+            continue
+        seconds = time.perf_counter() - start
+        summary["seconds"] = seconds
+        summary["mb_per_s"] = summary["bytes_read"] / 10**6 / seconds if seconds else 0.0
+        summary["hit_rate"] = summary["cached"] / summary["files"] if summary["files"] else 0.0
+        if cache is not None and cache.path is not None and cache.dirty:
+            cache.save()
+        return summary
+
+    def fingerprint_contents(self, workers = 8, cache = None):
+        """Content digests of every file beneath this folder, hashed in a
+        thread pool of <workers>. With a DigestCache <cache> unchanged files
+        are not read, a cache with a path is saved afterwards. Returns
+        {"digests": {ref_id: hex digest}, "errors": [unreadable ref_ids],
+        "files", "bytes", "bytes_read", "cached", "seconds", "mb_per_s",
+        "hit_rate"}, mb_per_s being the hashing throughput over bytes
+        actually read."""
+        assert workers > 0, \
+               """<workers> must be positive!"""
+        return self._digest_files(self._file_paths(), workers, cache)
+
+    def find_duplicates(self, workers = 8, cache = None):
+        """Groups of ref_ids of files beneath this folder with identical
+        contents, the groups wasting the most bytes first. Files are
+        grouped by size first, so only sizes shared by several files are
+        hashed, sizes not listed with <sizes> are stat'ed in the pool."""
+        assert workers > 0, \
+               """<workers> must be positive!"""
+        def size_(path):
+            try:
+                return _stat(path).st_size
+            except OSError:
+                return None
+        files = self._file_paths()
+        unknown = [i for i in files if i[2] is None]
+        sizes = dict(zip([i[0] for i in unknown], _map_batched(size_, [i[1] for i in unknown], workers)))
+        by_size = collections.defaultdict(list)
+        for ref_id, path, size in files:
+            size = sizes.get(ref_id, size)
+            if size is not None:
+                by_size[size].append((ref_id, path, size))
+            continue
+        candidates = [i for group in by_size.values() if len(group) > 1 for i in group]
+        summary = self._digest_files(candidates, workers, cache)
+        by_digest = collections.defaultdict(list)
+        sizes = {i[0]: i[2] for i in candidates}
+        for ref_id, digest in summary["digests"].items():
+            by_digest[digest].append(ref_id)
+            continue
+        groups = [i for i in by_digest.values() if len(i) > 1]
+        groups.sort(key = lambda i: sizes[i[0]] * (len(i) - 1), reverse = True)
+        return groups
+
+class DigestCache(object):
+    """Persistent file content digests keyed by (device, inode, size,
+    mtime_ns), so a file unchanged since it was hashed is never read
+    again. Thread safe. Loaded from <path> if it exists, save() writes it
+    back atomically. At most <maxsize> digests are kept, least recently
+    used evicted first, and a file's entry is dropped as soon as the file
+    is seen with another size or mtime. The file is unpickled, only load
+    trusted caches."""
+    def __init__(self, path = None, maxsize = DIGEST_CACHE_SIZE):
+        self.path = path
+        self.maxsize = maxsize
+        self.digests = collections.OrderedDict()
+        self.files = {} #(device, inode): the key its digest is cached under
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.dirty = False
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path, "rb") as file_:
+                digests = pickle.load(file_)
+            for key, digest in digests.items():
+                self._put(key, digest)
+                continue
+            self.evictions = 0
+        return None
+
+    def __len__(self):
+        return len(self.digests)
+
+    def __repr__(self):
+        return "<{0} {1} digests, hits:{2} misses:{3}/>".format(
+            self.__class__.__name__, len(self), self.hits, self.misses)
+
+    def _evict(self, key):
+        del self.digests[key]
+        if self.files.get(key[:2], None) == key:
+            del self.files[key[:2]]
+        self.evictions += 1
+        self.dirty = True
+        return None
+
+    def _put(self, key, digest):
+        stale = self.files.get(key[:2], None)
+        if stale is not None and stale != key:
+            self._evict(stale)
+        self.digests[key] = digest
+        self.digests.move_to_end(key)
+        self.files[key[:2]] = key
+        while len(self.digests) > self.maxsize:
+            self._evict(next(iter(self.digests)))
+            continue
+        return None
+
+    def get(self, key):
+        with self._lock:
+            digest = self.digests.get(key, None)
+            if digest is None:
+                self.misses += 1
+                stale = self.files.get(key[:2], None)
+                if stale is not None:
+                    self._evict(stale)
+            else:
+                self.digests.move_to_end(key)
+                self.hits += 1
+        return digest
+
+    def put(self, key, digest):
+        with self._lock:
+            self._put(key, digest)
+            self.dirty = True
+        return None
+
+    def clear(self):
+        with self._lock:
+            self.digests = collections.OrderedDict()
+            self.files = {}
+            self.dirty = True
+        return None
+
+    def save(self, path = None):
+        """Writes the cache to <path>, its own path if None."""
+        path = path or self.path
+        with self._lock:
+            data = pickle.dumps(self.digests, pickle.HIGHEST_PROTOCOL)
+            self.dirty = False
+        temp_path = "{0}.tmp{1}".format(path, os.getpid())
+        with open(temp_path, "wb") as file_:
+            file_.write(data)
+        os.replace(temp_path, path)
+        return None
+
+    pass
+
+class FolderStore(hierarchy.ColumnarStore):
+    """ColumnarStore for Folder trees. FSObjects keep their parsed fields
+    (core_name, key_words, key_values, ext...) and Folders their
+    fingerprint, so a snapshot restores them with no stat calls and no name
+    parsing. Paths are not stored, they follow from the keys. FileStubs
+    are stored as (name, size, classifier id), each walk_classifier once."""
+    DERIVED_FIELDS = ("path", "folder", "full_name")
+    INTERNED_FIELDS = ("ext", "file_ext")
+    STUB_SCHEMA = -2 #Schema id of FileStub records
+
+    def __init__(self):
+        hierarchy.ColumnarStore.__init__(self)
+        self.info["base"] = ""
+        self.info["schemas"] = []
+        self.info["classifiers"] = []
+        self._schema_ids = {}
+        self._classifier_ids = {}
+        self._resolved = {}
+        return None
+
+    @classmethod
+    def from_hierarchy(cls, root):
+        store = super(FolderStore, cls).from_hierarchy(root)
+        if isinstance(root, FSObject):
+            store.info["base"] = root.folder
+        return store
+
+    def _state(self, obj):
+        return {k:v for k, v in vars(obj).items() if not k in self.DERIVED_FIELDS}
+
+    def _restore(self, obj, entry):
+        keys = self.entry_path(entry)
+        obj.path = os.path.join(self.info["base"], *keys)
+        obj.full_name = keys[-1]
+        obj.folder = sys.intern(os.path.dirname(obj.path))
+        for field in self.INTERNED_FIELDS:
+            value = obj.__dict__.get(field, None)
+            if type(value) == str:
+                obj.__dict__[field] = sys.intern(value)
+            continue
+        return obj
+
+    def _value_digest(self, key, value):
+        return _value_digest(key, value)
+
+    def _read_value(self, entry):
+        """FileStubs are stored as they are, views read them as the File
+        Folder would resolve them to, created once per entry."""
+        value = self.values[entry]
+        if type(value) is not FileStub:
+            return value
+        resolved = self._resolved.get(entry, None)
+        if resolved is None:
+            keys = self.entry_path(entry)
+            state = {"path": os.path.join(self.info["base"], *keys[:-1])}
+            resolved = Folder._resolve_value(state, keys[-1], value)
+            self._resolved[entry] = resolved
+        return resolved
+
+    def changed(self):
+        """Ref_ids of the stored folders changed on disk since they were
+        listed, by one stat per folder against its stored fingerprint, the
+        check Folder.refresh makes. Lets a mapped snapshot be used as is
+        when this is empty."""
+        changed = []
+        for node_id in range(len(self.node_first)):
+            state = self.node_states.get(node_id, None)
+            fingerprint = state[1].get("fingerprint", None) if state else None
+            if fingerprint is None:
+                continue
+            keys = self.entry_path(self.node_entries[node_id])
+            try:
+                stat = _stat(os.path.join(self.info["base"], *keys))
+            except OSError:
+                stat = None
+            if fingerprint.racy or stat is None or \
+               (stat.st_ino, stat.st_mtime_ns) != fingerprint[:2]:
+                changed.append(hierarchy.KEY_SPLIT.join(keys))
+            continue
+        return changed
+
+    def _encode_node(self, node):
+        if not isinstance(node, FSObject):
+            return None
+        return (node.__class__, self._state(node))
+
+    def _classifier_id(self, walk_classifier):
+        if walk_classifier is None:
+            return None
+        classifier_id = self._classifier_ids.get(id(walk_classifier), None)
+        if classifier_id is None:
+            classifier_id = len(self.info["classifiers"])
+            self.info["classifiers"].append(walk_classifier)
+            self._classifier_ids[id(walk_classifier)] = classifier_id
+        return classifier_id
+
+    def _encode_value(self, entry, value):
+        """FSObjects are pickled as (schema id, field values), the class and
+        field names are stored once per schema. FileStubs keep only the id
+        of their walk_classifier, stored once in info."""
+        if type(value) is FileStub:
+            record = (value.full_name, value.size, self._classifier_id(value.walk_classifier))
+            return pickle.dumps((self.STUB_SCHEMA, record), pickle.HIGHEST_PROTOCOL)
+        if not isinstance(value, FSObject):
+            return pickle.dumps((-1, value), pickle.HIGHEST_PROTOCOL)
+        state = self._state(value)
+        schema = (value.__class__, tuple(state))
+        schema_id = self._schema_ids.get(schema, None)
+        if schema_id is None:
+            schema_id = len(self.info["schemas"])
+            self.info["schemas"].append(schema)
+            self._schema_ids[schema] = schema_id
+        return pickle.dumps((schema_id, tuple(state.values())), pickle.HIGHEST_PROTOCOL)
+
+    def _decode(self, data):
+        """Returns the value, or an FSObject still missing its path."""
+        schema_id, values = pickle.loads(data)
+        if schema_id == self.STUB_SCHEMA:
+            full_name, size, classifier_id = values
+            walk_classifier = None
+            if classifier_id is not None:
+                walk_classifier = self.info["classifiers"][classifier_id]
+            return FileStub(sys.intern(full_name), walk_classifier, size)
+        if schema_id < 0:
+            return values
+        cls, fields = self.info["schemas"][schema_id]
+        obj = cls.__new__(cls)
+        obj.__dict__.update(zip(fields, values))
+        return obj
+
+    def _decode_value(self, entry, data):
+        value = self._decode(data)
+        if isinstance(value, FSObject):
+            self._restore(value, entry)
+        return value
+
+    def _thaw_value(self, entry, key, container):
+        """Mapped records are decoded here directly, with the path taken
+        from the already thawed container."""
+        if not isinstance(self.values, hierarchy.MappedBlobs):
+            return self.values[entry]
+        value = self._decode(self.values.raw(entry))
+        if isinstance(value, FSObject) and isinstance(container, FSObject):
+            value.path = container.path + os.sep + key
+            value.full_name = key
+            value.folder = container.path
+            for field in self.INTERNED_FIELDS:
+                field_value = value.__dict__.get(field, None)
+                if type(field_value) == str:
+                    value.__dict__[field] = sys.intern(field_value)
+                continue
+        elif isinstance(value, FSObject):
+            self._restore(value, entry)
+        return value
+
+    def _thaw_node(self, node_id, container):
+        state = self.node_states.get(node_id, None)
+        if state is None:
+            return hierarchy.ColumnarStore._thaw_node(self, node_id, container)
+        entry = self.node_entries[node_id]
+        cls, state = state
+        node = cls._bulk_node(self.strings[self.keys[entry]], container)
+        node._metadata = dict(self.metadata.get(node_id, None) or {}) or None
+        node.__dict__.update(state)
+        if isinstance(container, FSObject):
+            node.path = container.path + os.sep + node._id_
+            node.full_name = node._id_
+            node.folder = container.path
+            return node
+        return self._restore(node, entry)
+
+    pass
         
         
     
 #------------------------------------------------------------------------------#
 # Globals
 #------------------------------------------------------------------------------#
+SYSCALLS = collections.Counter() #stat/scandir/open calls made by this module
+_SYSCALLS_LOCK = threading.Lock()
+_ACCEPTS_ENTRY = {}
+_PASSES_ENTRY = weakref.WeakKeyDictionary() #walk_classifier: takes an entry, see _passes_entry
+NAME_CACHE = hierarchy.LRUCache(NAME_CACHE_SIZE) #basename: parsed name, see _parse_name
+_NAME_CACHE_LOCK = threading.Lock()
+PROFILE_TARGETS = hierarchy.PROFILE_TARGETS + [(Folder, i, "operation", None) for i in
+                                               ("scan", "walk", "refresh", "purge")]
+PROFILE_TARGETS += [(WalkClassifier, "__call__", "operation", None),
+                    (WalkClassifier, "classify_many", "operation", None),
+                    (Folder, "_list", "counter", "listed"),
+                    (Folder, "iter_files", "counter", "visited"),
+                    (CompiledHooks, "rank", "counter", "regex"),
+                    (sys.modules[__name__], "_count", "syscall", None)] #stat, scandir, open
 
 #------------------------------------------------------------------------------#
 # Main
@@ -0,0 +1,378 @@
+#------------------------------------------------------------------------------#
+# Headers
+#------------------------------------------------------------------------------#
+
+__appname__ = "skeleton-app"         #App Name (the whole operation)
+__packagename__ = "skeleton-package" #Package Name (this package)
+__modulename__ = "fswatch"           #Module Name (this file)
+__version__ = "0.0.1"                #Version (semver)
+__date__ = "20180625-2330"
+
+__authors__ = ["Kristoffer Law"]     #Primary Authors
+__credits__ = ["Kristoffer Law"]     #Bugfix submissions, minor authors
+__copyright__ = "Kristoffer Law"
+__license__ = "Apache 2.0"
+
+__maintainer__ = "Kristoffer Law"
+__email__ = "klaw@kslaw.me"
+__status__ = "Prototype"            #Prototype, Developer, Production
+
+#------------------------------------------------------------------------------#
+# Imports
+#------------------------------------------------------------------------------#
+import collections
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+
+import fs
+import hierarchy
+#------------------------------------------------------------------------------#
+# Constants
+#------------------------------------------------------------------------------#
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+EVENT_HEADER = struct.Struct("iIII") #wd, mask, cookie, len
+#------------------------------------------------------------------------------#
+# Functions
+#------------------------------------------------------------------------------#
+def _libc():
+    path = ctypes.util.find_library("c")
+    libc = ctypes.CDLL(path, use_errno = True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+def parse_events(buffer):
+    """Splits a buffer read from an inotify descriptor into
+    (wd, mask, cookie, name) tuples."""
+    events = []
+    offset = 0
+    while offset + EVENT_HEADER.size <= len(buffer):
+        wd, mask, cookie, length = EVENT_HEADER.unpack_from(buffer, offset)
+        offset += EVENT_HEADER.size
+        name = buffer[offset:offset + length].rstrip(b"\0")
+        offset += length
+        events.append((wd, mask, cookie, os.fsdecode(name)))
+        continue
+    return events
+
+#------------------------------------------------------------------------------#
+# Classes
+#------------------------------------------------------------------------------#
+class Inotify(object):
+    """Minimal ctypes binding to the Linux inotify API, no extra services."""
+    def __init__(self):
+        self.libc = _libc()
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        return None
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask = WATCH_MASK):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def rm_watch(self, wd):
+        return self.libc.inotify_rm_watch(self.fd, wd) == 0
+
+    def read(self, buffer_size = 65536):
+        """Reads pending events without blocking, [] if there are none."""
+        try:
+            return parse_events(os.read(self.fd, buffer_size))
+        except BlockingIOError:
+            return []
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        return None
+
+class FolderWatcher(object):
+    """Keeps a walked fs.Folder tree live by subscribing to inotify on every
+    directory in it. Events are read in batches and coalesced per
+    (folder, name), then applied by checking what is on disk now, so
+    create/delete/move sequences collapse into their net effect.
+    Pending (folder, name) pairs are bounded by <max_pending>, past that a
+    folder's events are dropped and the folder is refreshed instead. A kernel
+    queue overflow refreshes the whole tree. Both refreshes go through
+    fs.Folder.refresh, so only folders whose fingerprint changed are listed."""
+    def __init__(self, root, walk_classifier = None, max_pending = 65536, buffer_size = 65536):
+        assert isinstance(root, fs.Folder), \
+               """<root> must be Folder!"""
+        assert root.fingerprint is not None, \
+               """<root> must be walked before watching!"""
+
+        self.root = root
+        self.walk_classifier = walk_classifier
+        self.max_pending = max_pending
+        self.buffer_size = buffer_size
+        self.inotify = Inotify()
+        self.folders = {}
+        self.watches = {}
+        self.paths = {}
+        self.pending = collections.OrderedDict()
+        self.dirty = collections.OrderedDict()
+        self.counters = collections.Counter()
+
+        for folder in root.iter_folders():
+            if folder.fingerprint is not None:
+                self._watch(folder)
+            continue
+        self._refresh(root)
+        return None
+
+    def fileno(self):
+        return self.inotify.fileno()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def close(self):
+        self.inotify.close()
+        self.folders.clear()
+        self.watches.clear()
+        self.paths.clear()
+        return None
+
+    def _watch(self, folder):
+        try:
+            wd = self.inotify.add_watch(folder.path)
+        except OSError as error:
+            if error.errno == errno.ENOSPC:
+                self.counters["watch_limit"] += 1
+                return None
+            if error.errno in (errno.ENOENT, errno.ENOTDIR):
+                return None
+            raise
+        self.folders[wd] = folder
+        self.watches[id(folder)] = wd
+        self.paths[folder.path] = wd
+        return wd
+
+    def _forget(self, folder, wd):
+        self.watches.pop(id(folder), None)
+        if self.folders.get(wd, None) is folder:
+            del self.folders[wd]
+        if self.paths.get(folder.path, None) == wd:
+            del self.paths[folder.path]
+        return None
+
+    def _unwatch(self, node):
+        for folder in node.iter_folders():
+            wd = self.watches.get(id(folder), None)
+            if wd is not None and self.folders.get(wd, None) is folder:
+                self.inotify.rm_watch(wd)
+            if wd is not None:
+                self._forget(folder, wd)
+            continue
+        return None
+
+    def _path(self, ref_id):
+        """Path of the entry at <ref_id> in the watched tree."""
+        keys = ref_id.split(hierarchy.KEY_SPLIT)[len(self.root.ref_id.split(hierarchy.KEY_SPLIT)):]
+        return os.path.join(self.root.path, *keys)
+
+    def _existing(self, folder):
+        """<folder>, or its nearest container still on disk, None if none is."""
+        while folder is not None and not os.path.isdir(folder.path):
+            folder = folder.container
+            continue
+        return folder
+
+    def _add_folder(self, folder, summary):
+        """Watches then scans each new folder, so entries created while it
+        is scanned still raise an event."""
+        stack = [folder]
+        while stack:
+            folder = stack.pop()
+            self._watch(folder)
+            objs = folder._list(self.walk_classifier)
+            summary["added"].extend([folder.get_content_ref_id(i.full_name) for i in objs])
+            stack.extend(reversed(folder._attach(objs)))
+            continue
+        return None
+
+    def _refresh(self, folder):
+        """Refreshes <folder>'s subtree and brings the watches in line, only
+        the removed subtrees are unwatched."""
+        self.counters["rescans"] += 1
+        summary = folder.refresh(self.walk_classifier)
+        for ref_id in summary["removed"]:
+            wd = self.paths.get(self._path(ref_id), None)
+            if wd is not None:
+                self._unwatch(self.folders[wd])
+            continue
+        for sub_folder in folder.iter_folders():
+            if not id(sub_folder) in self.watches and sub_folder.fingerprint is not None:
+                self._watch(sub_folder)
+            continue
+        return summary
+
+    def _queue(self, events):
+        for wd, mask, cookie, name in events:
+            self.counters["events"] += 1
+            if mask & IN_Q_OVERFLOW:
+                self.counters["overflows"] += 1
+                self.dirty[id(self.root)] = self.root
+                continue
+            folder = self.folders.get(wd, None)
+            if mask & IN_IGNORED:
+                if folder is not None:
+                    self._forget(folder, wd)
+                continue
+            if folder is None or not name:
+                continue
+            if id(folder) in self.dirty:
+                self.counters["dropped"] += 1
+                continue
+            if len(self.pending) >= self.max_pending:
+                self.counters["dropped"] += 1
+                self.dirty[id(folder)] = folder
+                continue
+            self.pending[(id(folder), name)] = (folder, name)
+            continue
+        return None
+
+    def _apply(self, folder, name, summary):
+        if folder._root is not self.root:
+            return None
+        ref_id = folder.get_content_ref_id(name)
+        current = folder.get(name, None)
+        path = os.path.join(folder.path, name)
+        try:
+            is_dir = os.path.isdir(path)
+            on_disk = is_dir or os.path.isfile(path)
+        except OSError:
+            on_disk = False
+
+        if current is not None:
+            if on_disk and isinstance(current, fs.Folder) == is_dir:
+                return None
+            if isinstance(current, fs.Folder):
+                self._unwatch(current)
+            del folder[name]
+            summary["removed"].append(ref_id)
+        if not on_disk:
+            return None
+
+        cls = None
+        if self.walk_classifier:
+            cls = fs.classify(self.walk_classifier, path)
+        if cls is None:
+            cls = fs.Folder if is_dir else fs.File
+        try:
+            obj = cls(path)
+        except AssertionError:
+            return None
+        folder[name] = obj
+        summary["added"].append(ref_id)
+        if isinstance(obj, fs.Folder):
+            self._add_folder(obj, summary)
+        return None
+
+    def poll(self, timeout = 0):
+        """Waits up to <timeout> seconds (None blocks) for events, reads every
+        batch available, then applies the coalesced changes. Returns
+        {"added": [...], "removed": [...], "modified": [...]} ref_ids as
+        Folder.refresh does, modified being the folders listed again.
+        A dirty folder gone from disk is refreshed through its nearest
+        container still there. Queued work is dropped even if applying it
+        raises, so one error can't wedge the watcher."""
+        summary = collections.OrderedDict([("added", []), ("removed", []), ("modified", [])])
+        readable = select.select([self.inotify], [], [], timeout)[0]
+        while readable:
+            events = self.inotify.read(self.buffer_size)
+            if not events:
+                break
+            self.counters["batches"] += 1
+            self._queue(events)
+            continue
+
+        try:
+            if id(self.root) in self.dirty:
+                self.dirty = collections.OrderedDict([(id(self.root), self.root)])
+                self.pending.clear()
+            targets = collections.OrderedDict()
+            for folder in self.dirty.values():
+                if folder._root is not self.root:
+                    continue
+                folder = self._existing(folder)
+                if folder is not None:
+                    targets[id(folder)] = folder
+                continue
+            for folder in targets.values():
+                if folder._root is not self.root:
+                    continue
+                changes = self._refresh(folder)
+                for key, value in changes.items():
+                    summary[key].extend(value)
+                    continue
+                continue
+
+            pending = self.pending
+            self.pending = collections.OrderedDict()
+            for folder, name in pending.values():
+                if id(folder) in self.dirty:
+                    continue
+                self._apply(folder, name, summary)
+                self.counters["applied"] += 1
+                continue
+        finally:
+            self.dirty.clear()
+            self.pending.clear()
+        return summary
+
+    def run(self, stop, interval = 0.5, callback = None):
+        """Polls until threading.Event <stop> is set, passing each non empty
+        summary to <callback>."""
+        while not stop.is_set():
+            summary = self.poll(interval)
+            if callback is not None and any(summary.values()):
+                callback(summary)
+            continue
+        return None
+
+    pass
+#------------------------------------------------------------------------------#
+# Globals
+#------------------------------------------------------------------------------#
+
+#------------------------------------------------------------------------------#
+# Main
+#------------------------------------------------------------------------------#
+if __name__ == "__main__":
+    pass
@@ -20,19 +20,206 @@ __status__ = "Prototype"            #Prototype, Developer, Production
 #------------------------------------------------------------------------------#
 # Imports
 #------------------------------------------------------------------------------#
+import array
 import copy
 import collections
+import collections.abc
+import concurrent.futures
+import contextlib
+import functools
+import gc
+import hashlib
+import inspect
+import mmap
+import os
+import pickle
+import struct
+import sys
+import threading
+import time
+import types
+import weakref
 
 import re
 #------------------------------------------------------------------------------#
 # Constants
 #------------------------------------------------------------------------------#
 KEY_SPLIT = '/'
+GLOB_ANY = "**"
+SNAPSHOT_MAGIC = b"HDSNAP01"
+SNAPSHOT_HEADER = struct.Struct("<8sII") #magic, version, section count
+SNAPSHOT_SECTION = struct.Struct("<QQ")  #offset, length
+SNAPSHOT_VERSION = 2
+DIGEST_SIZE = 16 #Bytes of blake2b per node and entry digest
+MERGE_POLICIES = ("ours", "theirs", "mirror")
+RECURSE_CHUNKS_PER_WORKER = 4 #Tasks per worker a parallel recurse aims for
+RECURSE_MIN_CHUNK = 1024      #Fewest entries worth shipping to a worker
+KEY_INDEX_MIN = 64 #Compact nodes with this many children get a key index
+PROFILE_KINDS = ("operation", "counter", "stats", "syscall") #See Profiler
 #------------------------------------------------------------------------------#
 # Classes
 #------------------------------------------------------------------------------#
+class GlobPattern(object):
+    """Compiles a glob over KEY_SPLIT separated ref ids into per segment
+    matchers. '*', '?' and '[...]' match within a single segment, a segment of
+    '**' matches any number of whole segments, including none.
+    States are sets of segment positions consumed so far."""
+    def __init__(self, pattern, ignore_case = True):
+        assert type(pattern) == str, \
+               """<pattern> must be string!"""
+        
+        self.pattern = pattern
+        self.ignore_case = ignore_case
+        self.segments = []
+        self.matchers = []
+        flags = re.IGNORECASE if ignore_case else 0
+
+        for segment in pattern.split(KEY_SPLIT):
+            if segment == GLOB_ANY and self.segments[-1:] == [GLOB_ANY]:
+                continue
+            self.segments.append(segment)
+            if segment == GLOB_ANY or not _is_glob_segment(segment):
+                self.matchers.append(None)
+            else:
+                regex = "{0}\\Z".format(_glob_segment_regex(segment))
+                self.matchers.append(re.compile(regex, flags))
+            continue
+
+        self.regex = re.compile(_glob_regex(self.segments) + "\\Z", flags)
+        return None
+
+    def _closure(self, states):
+        states = set(states)
+        for state in sorted(states):
+            while state < len(self.segments) and self.segments[state] == GLOB_ANY:
+                state += 1
+                states.add(state)
+                continue
+            continue
+        return frozenset(states)
+
+    def start(self):
+        return self._closure([0])
+
+    def step(self, states, segment):
+        """Advances <states> over one ref id <segment>."""
+        next_states = []
+        for state in states:
+            if state >= len(self.segments):
+                continue
+            pattern = self.segments[state]
+            if pattern == GLOB_ANY:
+                next_states.append(state)
+                continue
+            matcher = self.matchers[state]
+            if matcher is None:
+                if self.ignore_case:
+                    matched = pattern.lower() == segment.lower()
+                else:
+                    matched = pattern == segment
+            else:
+                matched = matcher.match(segment) is not None
+            if matched:
+                next_states.append(state + 1)
+            continue
+        return self._closure(next_states)
+
+    def accepts(self, states):
+        return len(self.segments) in states
+
+    def saturated(self, states):
+        """True if only a trailing '**' is left, so every deeper ref id is
+        accepted and stepping can stop."""
+        if self.segments[-1:] != [GLOB_ANY]:
+            return False
+        return all(i >= len(self.segments) - 1 for i in states)
+
+    def exhausted(self, states):
+        """True if no child segment can match from <states>."""
+        return all(i >= len(self.segments) for i in states)
+
+    def literal(self, states):
+        """Returns the single literal segment every live state waits on, or
+        None if any state needs a wildcard test."""
+        literals = set()
+        for state in states:
+            if state >= len(self.segments):
+                continue
+            if self.segments[state] == GLOB_ANY or self.matchers[state] is not None:
+                return None
+            literals.add(self.segments[state])
+            continue
+        if len(literals) != 1:
+            return None
+        return literals.pop()
+
+class LRUCache(object):
+    """Bounded least recently used mapping counting hits, misses (including
+    stale entries rejected by a validator) and evictions."""
+    def __init__(self, maxsize = 256):
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        return None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        """Membership alone, neither counted nor refreshing <key>."""
+        return key in self._entries
+
+    def get(self, key, default = None, validate = None):
+        entry = self._entries.get(key, None)
+        if entry is None or (validate is not None and not validate(entry)):
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, value):
+        if self.maxsize < 1:
+            return None
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last = False)
+            self.evictions += 1
+            continue
+        return None
+
+    def clear(self):
+        self._entries.clear()
+        return None
+
+    def stats(self):
+        return collections.OrderedDict([("hits", self.hits),
+                                        ("misses", self.misses),
+                                        ("evictions", self.evictions),
+                                        ("size", len(self._entries)),
+                                        ("maxsize", self.maxsize)])
+
+class NodeMarker(object):
+    """Stands in for a node value in from_items/to_items streams."""
+    def __repr__(self):
+        return "NODE"
+
+    def __reduce__(self):
+        return "NODE"
+
 class HierarchyDict(collections.OrderedDict, object):
+    #OrderedDict already provides a lazily created __dict__ for subclasses
+    __slots__ = ("_HierarchyDict__id_", "_id_", "_container", "_path_index",
+                 "_attribute_index", "_ref_id_cache", "_query_cache",
+                 "_generation", "_metadata", "_aggregates", "_digest",
+                 "_frozen_views")
     empty_is_falsy = False #Breaks stuff if changed    
+    use_path_index = True  #acquire falls back to a lookup per segment if False
+    query_cache_size = 256 #Cached query results per root, 0 disables
+    rollups = ()           #Rollup aggregates kept by nodes of this class
     
     def __init__(self, id_, container = None, **kwargs):
         assert type(id_) == str or hasattr(id_, "name"), \
@@ -42,10 +229,18 @@ class HierarchyDict(collections.OrderedDict, object):
         
         self.__id_ = id_
         self._container = None
+        self._path_index = None
+        self._attribute_index = None
+        self._ref_id_cache = None
+        self._query_cache = None
+        self._generation = 0
+        self._aggregates = None
+        self._digest = None
+        self._frozen_views = None
         self.metadata = kwargs
 
         if type(id_) == str:
-            self._id_ = id_
+            self._id_ = sys.intern(id_)
         else:
             self._id_ = id_.name
 
@@ -64,26 +259,124 @@ class HierarchyDict(collections.OrderedDict, object):
 
     @_id.setter
     def _id(self, id_):
-        self.__id_ = id_
-        self._id_ = id_
+        with _FREEZE_LOCK:
+            root = self._touch()
+            if root._path_index is not None:
+                root._unindex_subtree(self)
+            if root._attribute_index is not None:
+                root._attribute_index.remove_subtree(self)
+            if type(id_) == str:
+                id_ = sys.intern(id_)
+            self.__id_ = id_
+            self._id_ = id_
+            self._invalidate_ref_ids()
+            if root._path_index is not None:
+                root._index_subtree(self)
+            if root._attribute_index is not None:
+                root._attribute_index.add_subtree(self)
         return None
     
+    @property
+    def metadata(self):
+        """Allocated on first access, nodes created without kwargs hold None."""
+        if self._metadata is None:
+            self._metadata = {}
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, metadata):
+        self._metadata = metadata or None
+        return None
+
     @property
     def _ref_id(self):
-        
-        _ref_id = ""
-            
-        if self._container is None:
-            _ref_id = self._id_
-        else:
-            _ref_id = KEY_SPLIT.join([self._container._ref_id, self._id_])
+        """Cached, built iteratively from the nearest cached ancestor."""
+        _ref_id = self._ref_id_cache
+        if _ref_id is not None:
+            return _ref_id
+
+        uncached = []
+        node = self
+        while node is not None and node._ref_id_cache is None:
+            uncached.append(node)
+            node = node._container
+
+        prefix = None if node is None else node._ref_id_cache
+        for node in reversed(uncached):
+            if prefix is None:
+                prefix = node._id_
+            else:
+                prefix = KEY_SPLIT.join([prefix, node._id_])
+            node._ref_id_cache = prefix
+            continue
             
-        return _ref_id
+        return prefix
+
+    def _invalidate_ref_ids(self):
+        """Drops cached ref ids for this node and its subtree. A node is only
+        cached if its container is, so uncached nodes end the descent."""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node._ref_id_cache is None:
+                continue
+            node._ref_id_cache = None
+            stack.extend(node.nodes)
+        return None
 
     @property
     def ref_id(self):
         return self._ref_id
 
+    @property
+    def _root(self):
+        root = self
+        while root._container is not None:
+            root = root._container
+        return root
+
+    @property
+    def generation(self):
+        """Bumped whenever this node or anything beneath it changes."""
+        return self._generation
+
+    def _touch(self):
+        """Bumps the generation of this node and its containers, returns the
+        root. Frozen views still sharing any of them are frozen first.
+        Mutators call it holding _FREEZE_LOCK until their change is made."""
+        node = self
+        node._generation += 1
+        shared = node._frozen_views is not None
+        while node._container is not None:
+            node = node._container
+            node._generation += 1
+            shared = shared or node._frozen_views is not None
+            continue
+        if shared:
+            self._unshare()
+        return node
+
+    def _unshare(self):
+        """Freezes the views sharing this node or its containers, root
+        first, so each freeze hands a view to the next node down."""
+        chain = []
+        node = self
+        while node is not None:
+            chain.append(node)
+            node = node._container
+            continue
+        with _FREEZE_LOCK:
+            for node in reversed(chain):
+                views = node._frozen_views
+                node._frozen_views = None
+                for view in views or ():
+                    view = view()
+                    if view is not None and view._source is node:
+                        view._freeze()
+                    continue
+                continue
+        return None
+
     @property
     def container(self):
         return self._container
@@ -130,133 +423,1249 @@ class HierarchyDict(collections.OrderedDict, object):
         return True
     
     def __bool__(self):
-        return __nonzero__(self)
+        return self.__nonzero__()
 
     def __copy__(self):
-        #TODO
-        copy_ = HierarchyDict(self._id_, self._container, **self.metadata)
-        for node in self.nodes:
-            continue
-        return copy_
+        """Copies this node and every node beneath it, values are shared.
+        The copy has no container and no indexes."""
+        return _copy_tree(self, None)
 
-    def __deepcopy__(self):
-        #TODO
-        return None
+    def __deepcopy__(self, memo = None):
+        """Copies this node, every node beneath it and every value."""
+        if memo is None:
+            memo = {}
+        return _copy_tree(self, memo)
 
     def __setitem__(self, key, item):
-        if isinstance(item, HierarchyDict):
-            if key != item._id_:
-                raise Exception("Key must match <item>._id_")
-            item._container = self
-        super(HierarchyDict, self).__setitem__(key, item)
+        with _FREEZE_LOCK:
+            root = self._touch()
+            indexed = root._path_index is not None
+            attributes = root._attribute_index
+            exists = key in self
+            previous = collections.OrderedDict.get(self, key) if exists else None
+            if indexed and exists:
+                root._unindex_item(self, key, previous)
+            if attributes is not None and exists:
+                attributes.remove_item(self, key, previous)
+            replaced = ()
+            if self._aggregates is not None and exists:
+                replaced = self._rollup_contributions(key, previous)
+            if isinstance(previous, HierarchyDict) and previous is not item:
+                #Detached as __delitem__ does, or its writes still reach this tree
+                previous._container = None
+                previous._invalidate_ref_ids()
+            if type(key) == str:
+                key = sys.intern(key)
+            if isinstance(item, HierarchyDict):
+                if key != item._id_:
+                    raise Exception("Key must match <item>._id_")
+                if item._container is not self:
+                    item._invalidate_ref_ids()
+                item._container = self
+                item._path_index = None
+                item._attribute_index = None
+                item._query_cache = None
+            super(HierarchyDict, self).__setitem__(key, item)
+            if indexed:
+                root._index_item(self, key, item)
+            if attributes is not None:
+                attributes.add_item(self, key, item)
+            if self._aggregates is not None:
+                added = self._rollup_contributions(key, item)
+                for rollup, contribution in replaced:
+                    rollup.removed(self, contribution)
+                    continue
+                for rollup, contribution in added:
+                    rollup.added(self, contribution)
+                    continue
         return None
 
     def __delitem__(self, key):
-        item = self.get(key)
-        if isinstance(item, HierarchyDict):
-            item._container = None
-        super(HierarchyDict, self).__delitem__(key)
+        with _FREEZE_LOCK:
+            item = collections.OrderedDict.get(self, key)
+            root = self._touch()
+            if root._path_index is not None and key in self:
+                root._unindex_item(self, key, item)
+            if root._attribute_index is not None and key in self:
+                root._attribute_index.remove_item(self, key, item)
+            removed = ()
+            if self._aggregates is not None and key in self:
+                removed = self._rollup_contributions(key, item)
+            if isinstance(item, HierarchyDict):
+                item._container = None
+                item._invalidate_ref_ids()
+            super(HierarchyDict, self).__delitem__(key)
+            for rollup, contribution in removed:
+                rollup.removed(self, contribution)
+                continue
         return None
 
     def __repr__(self):
         cls = self.__class__
-        nodes = [i for i in self.values() if isinstance(i, HierarchyDict)]
-        values = [i for i in self.values() if not isinstance(i, HierarchyDict)]
-        return "<{0} {1} nodes:{2} contents:{3}/>".format(cls.__name__, self._ref_id, len(nodes), len(values))
+        nodes = len(self.nodes)
+        return "<{0} {1} nodes:{2} contents:{3}/>".format(cls.__name__, self._ref_id, nodes, len(self) - nodes)
 
     #OVERRIDE METHODS
     def clear(self):
-        for node in self.values():
-            node.container = None
-        super(HierarchyDict, self).clear()
+        with _FREEZE_LOCK:
+            root = self._touch()
+            removed = []
+            for key, item in list(self._raw_items()):
+                if self._aggregates is not None:
+                    removed.extend(self._rollup_contributions(key, item))
+                if root._path_index is not None:
+                    root._unindex_item(self, key, item)
+                if root._attribute_index is not None:
+                    root._attribute_index.remove_item(self, key, item)
+                if isinstance(item, HierarchyDict):
+                    item._container = None
+                    item._invalidate_ref_ids()
+                continue
+            super(HierarchyDict, self).clear()
+            for rollup, contribution in removed:
+                rollup.removed(self, contribution)
+                continue
         return None
 
+    def pop(self, key, *default):
+        """Routes through __delitem__, OrderedDict.pop bypasses it."""
+        if key not in self:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        item = self[key]
+        del self[key]
+        return item
+
+    def popitem(self, last = True):
+        """Routes through __delitem__, OrderedDict.popitem bypasses it."""
+        if len(self) < 1:
+            raise KeyError("dictionary is empty")
+        key = next(reversed(self.keys())) if last else next(iter(self.keys()))
+        return (key, self.pop(key))
+
     def copy(self):
         return self.__copy__()
 
+    #COPYING
+    def __reduce__(self):
+        """Pickles this node and everything beneath it as a detached
+        hierarchy, flat, so deep trees don't hit the recursion limit.
+        Containers above it, indexes and caches are left out."""
+        return (_unpickle_tree, (_tree_records(self),))
+
+    def _copy_class(self):
+        """Class of this node's copies."""
+        return self.__class__
+
+    def _copy_state(self):
+        """Instance attributes a copy carries over, None for none. Nodes keep
+        their own state in slots, subclasses with attributes return them."""
+        return None
+
+    @classmethod
+    def _resolve_value(cls, state, key, value):
+        """<value> stored under <key> as reads return it, for a node of this
+        class with _copy_state() <state>. Lets views resolve what the live
+        node resolves on read, see fs.FileStub."""
+        return value
+
+    def freeze(self):
+        """Returns a read only, point in time FrozenHierarchyDict of this
+        node in O(1). It shares this tree's storage until a node is about to
+        change, see FrozenHierarchyDict."""
+        with _FREEZE_LOCK:
+            return FrozenHierarchyDict(self)
+
+    #PATH INDEX
+    def _iter_subtree_entries(self, node):
+        """Yields (ref_id, value) for <node> and everything beneath it, as
+        stored, so indexing resolves nothing (see fs.FileStub)."""
+        for ref_id, key, value, container in node._iter_raw_walk():
+            yield (ref_id, value)
+        return
+
+    def _read_indexed(self, ref_id, value):
+        """Reads the stored <value> of a path index entry through its
+        container, so a subclass resolves it as it does on read."""
+        if isinstance(value, HierarchyDict) or not KEY_SPLIT in ref_id:
+            return value
+        container_ref_id, key = ref_id.rsplit(KEY_SPLIT, 1)
+        for entry in self._path_index.get(container_ref_id.lower(), []):
+            container = entry[-1]
+            if entry[0] == container_ref_id and isinstance(container, HierarchyDict) and \
+               collections.OrderedDict.get(container, key) is value:
+                return container[key]
+            continue
+        return value
+
+    def _index_add(self, ref_id, value):
+        entries = self._path_index.setdefault(ref_id.lower(), [])
+        entries.append((ref_id, value))
+        return None
+
+    def _index_remove(self, ref_id, value):
+        folded = ref_id.lower()
+        entries = self._path_index.get(folded, [])
+        for i, entry in enumerate(entries):
+            if entry[0] == ref_id and entry[-1] is value:
+                del entries[i]
+                break
+            continue
+        if not entries:
+            self._path_index.pop(folded, None)
+        return None
+
+    def _index_subtree(self, node):
+        for ref_id, value in self._iter_subtree_entries(node):
+            self._index_add(ref_id, value)
+        return None
+
+    def _unindex_subtree(self, node):
+        for ref_id, value in self._iter_subtree_entries(node):
+            self._index_remove(ref_id, value)
+        return None
+
+    def _index_item(self, container, key, item):
+        if isinstance(item, HierarchyDict):
+            self._index_subtree(item)
+        else:
+            self._index_add(container.get_content_ref_id(key), item)
+        return None
+
+    def _unindex_item(self, container, key, item):
+        if isinstance(item, HierarchyDict) and item._container is container:
+            self._unindex_subtree(item)
+        else:
+            self._index_remove(container.get_content_ref_id(key), item)
+        return None
+
+    def build_path_index(self):
+        """(Re)builds the ref_id index held by the root of the hierarchy."""
+        root = self._root
+        root._path_index = {}
+        root._index_subtree(root)
+        return root._path_index
+
+    def drop_path_index(self):
+        """Discards the ref_id index, it is rebuilt on the next acquire."""
+        self._root._path_index = None
+        return None
+
+    def check_path_index(self):
+        """Verifies the ref_id index against a full scan of the hierarchy.
+        Returns True if consistent or if no index has been built."""
+        root = self._root
+        if root._path_index is None:
+            return True
+        expected = {}
+        for ref_id, value in root._iter_subtree_entries(root):
+            expected.setdefault(ref_id.lower(), []).append((ref_id, id(value)))
+            continue
+        actual = {}
+        for folded, entries in root._path_index.items():
+            actual[folded] = [(i[0], id(i[-1])) for i in entries]
+            continue
+        if set(expected) != set(actual):
+            return False
+        for folded, entries in expected.items():
+            if sorted(entries) != sorted(actual[folded]):
+                return False
+            continue
+        return True
+
+    #ATTRIBUTE INDEX
+    def _raw_items(self):
+        """Stored (key, value) pairs, without any resolving a subclass does
+        on read."""
+        return collections.OrderedDict.items(self)
+
+    def _iter_raw_walk(self):
+        """iter_walk over stored values, for index maintenance."""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            ref_id = node._ref_id
+            yield (ref_id, node._id_, node, node._container)
+            nodes = []
+            for key, value in list(node._raw_items()):
+                if isinstance(value, HierarchyDict):
+                    nodes.append(value)
+                    continue
+                yield (KEY_SPLIT.join([ref_id, key]), key, value, node)
+                continue
+            stack.extend(reversed(nodes))
+            continue
+        return
+
+    def build_attribute_index(self):
+        """(Re)builds the AttributeIndex held by the root of the hierarchy,
+        kept up to date on insert and remove from then on."""
+        root = self._root
+        root._attribute_index = AttributeIndex()
+        root._attribute_index.add_subtree(root)
+        return root._attribute_index
+
+    def drop_attribute_index(self):
+        self._root._attribute_index = None
+        return None
+
+    def check_attribute_index(self):
+        """Verifies the AttributeIndex against a fresh build. Returns True if
+        consistent or if no index has been built."""
+        root = self._root
+        if root._attribute_index is None:
+            return True
+        expected = AttributeIndex()
+        expected.add_subtree(root)
+        return expected.terms == root._attribute_index.terms and \
+               expected.postings == root._attribute_index.postings
+
+    def update_metadata(self, **kwargs):
+        """Updates metadata, keeping the AttributeIndex current. Changing
+        .metadata in place bypasses the index."""
+        attributes = self._root._attribute_index
+        if attributes is not None:
+            attributes.remove(self._ref_id)
+        self.metadata.update(kwargs)
+        if attributes is not None:
+            attributes.add(self._ref_id, self, None, self)
+        return None
+
+    def find(self, **terms):
+        """Returns {ref_id: value} for the entries under this node holding
+        every given term, by intersecting the root's AttributeIndex postings
+        (built on first use). Each keyword names an attribute, its value is
+        a term or a list of terms, e.g. find(metadata = ("owner", "me")) or
+        for fs.Folder find(file_ext = "txt", keyword = ["Draft", "Final"])."""
+        root = self._root
+        if root._attribute_index is None:
+            root.build_attribute_index()
+        prefix = None if root is self else self._ref_id
+        return root._attribute_index.find(terms, prefix)
+
+    #ROLLUPS
+    @classmethod
+    def register_rollup(cls, rollup):
+        """Adds <rollup> to the aggregates kept by <cls> nodes."""
+        assert isinstance(rollup, Rollup), \
+               """<rollup> must be Rollup!"""
+        assert not rollup.name in [i.name for i in cls.rollups], \
+               """<rollup> name already registered!"""
+        cls.rollups = tuple(cls.rollups) + (rollup,)
+        return None
+
+    def _rollup_compute(self, rollup):
+        """Computes <rollup> bottom up for the nodes of this subtree still
+        missing it, returns this node's total."""
+        name = rollup.name
+        stack = [(self, False)]
+        while stack:
+            node, ready = stack.pop()
+            aggregates = node._aggregates
+            if aggregates is not None and name in aggregates:
+                continue
+            if not ready:
+                stack.append((node, True))
+                stack.extend([(v, False) for k, v in node._raw_items() if isinstance(v, HierarchyDict)])
+                continue
+            if aggregates is None:
+                node._aggregates = aggregates = {}
+            aggregates[name] = rollup.total(node)
+            continue
+        return self._aggregates[name]
+
+    def _rollup_contributions(self, key, item):
+        """(rollup, contribution) of <item> under <key> for each rollup
+        this node keeps up to date."""
+        results = []
+        for rollup in self.rollups:
+            if not rollup.name in self._aggregates:
+                continue
+            if isinstance(item, HierarchyDict):
+                item._rollup_compute(rollup)
+            results.append((rollup, rollup.contribution(key, item)))
+            continue
+        return results
+
+    def rollup(self, name):
+        """Total of the rollup called <name> over this subtree. The first
+        read computes it, later inserts and removals keep it current along
+        the container chain, so reads are O(1)."""
+        for rollup in self.rollups:
+            if rollup.name == name:
+                return self._rollup_compute(rollup)
+            continue
+        raise KeyError(name)
+
+    #MERKLE HASHING
+    def _value_digest(self, key, value):
+        """Bytes standing for a value in digests, see
+        ColumnarStore._value_digest. Subclasses may narrow this to the
+        fields that matter, their ColumnarStore should match."""
+        return ColumnarStore._value_digest(None, key, value)
+
+    def _entry_digest(self, key, value):
+        """Digest of one (key, value) pair, sub nodes by their digest()."""
+        if isinstance(value, HierarchyDict):
+            data = b"N" + value.digest()
+        else:
+            data = b"V" + self._value_digest(key, value)
+        key = repr(key).encode("utf-8", "surrogatepass")
+        return hashlib.blake2b(key + b"\0" + data, digest_size = DIGEST_SIZE).digest()
+
+    def digest(self):
+        """Structural hash of this subtree over its keys, values and sub
+        node digests, independent of key order and of this node's own id.
+        Computed on first call and cached with the node's generation, so
+        after a change only the nodes on its container chain are hashed
+        again. Values changed in place are not seen until set again."""
+        stack = [(self, False)]
+        while stack:
+            node, ready = stack.pop()
+            cached = node._digest
+            if cached is not None and cached[0] == node._generation:
+                continue
+            items = list(node._raw_items())
+            if not ready:
+                stack.append((node, True))
+                stack.extend([(v, False) for k, v in items if isinstance(v, HierarchyDict)])
+                continue
+            entries = sorted([node._entry_digest(k, v) for k, v in items])
+            digest = hashlib.blake2b(b"".join(entries), digest_size = DIGEST_SIZE).digest()
+            node._digest = (node._generation, digest)
+            continue
+        return self._digest[1]
+
+    def _diff_entries(self, other):
+        """Yields (change, ours, theirs, key, value, other_value) for each
+        entry that differs, change being "added", "removed" or "changed".
+        Only pairs of sub nodes whose digests differ are descended into."""
+        stack = [(self, other)]
+        while stack:
+            ours, theirs = stack.pop()
+            if ours.digest() == theirs.digest():
+                continue
+            ours_items = collections.OrderedDict(ours._raw_items())
+            theirs_items = collections.OrderedDict(theirs._raw_items())
+            nodes = []
+            for key, value in ours_items.items():
+                if not key in theirs_items:
+                    yield ("removed", ours, theirs, key, value, None)
+                    continue
+                other_value = theirs_items[key]
+                if isinstance(value, HierarchyDict) and isinstance(other_value, HierarchyDict):
+                    nodes.append((value, other_value))
+                    continue
+                if isinstance(value, HierarchyDict) or isinstance(other_value, HierarchyDict) or \
+                   ours._entry_digest(key, value) != theirs._entry_digest(key, other_value):
+                    yield ("changed", ours, theirs, key, value, other_value)
+                continue
+            for key, other_value in theirs_items.items():
+                if not key in ours_items:
+                    yield ("added", ours, theirs, key, None, other_value)
+                continue
+            stack.extend(reversed(nodes))
+            continue
+        return
+
+    def diff(self, other):
+        """Streams ("added" | "removed" | "changed", ref_id) from this
+        hierarchy to <other>, e.g. yesterday's snapshot to today's walk.
+        Subtrees with equal digests are skipped whole, so the cost follows
+        the number of changes. Added and removed sub nodes are streamed with
+        everything beneath them, a value replaced by a node (or the reverse)
+        as removed then added. Removed and changed ref_ids are this
+        hierarchy's, added ones <other>'s."""
+        assert isinstance(other, HierarchyDict), \
+               """<other> must be HierarchyDict or subclass!"""
+        for change, ours, theirs, key, value, other_value in self._diff_entries(other):
+            if change == "changed" and not isinstance(value, HierarchyDict) and \
+               not isinstance(other_value, HierarchyDict):
+                yield ("changed", ours.get_content_ref_id(key))
+                continue
+            if change != "added":
+                for ref_id in _subtree_ref_ids(ours, key, value):
+                    yield ("removed", ref_id)
+                    continue
+            if change != "removed":
+                for ref_id in _subtree_ref_ids(theirs, key, other_value):
+                    yield ("added", ref_id)
+                    continue
+            continue
+        return
+
+    def merge(self, other, policy = "theirs"):
+        """Brings <other>'s entries into this hierarchy, going by diff().
+        Entries only in <other> are added. Conflicting values follow
+        <policy>: "ours" keeps this hierarchy's, "theirs" takes <other>'s,
+        "mirror" takes <other>'s and also removes entries <other> lacks. A
+        callable policy(ref_id, ours, theirs) returns the value to keep.
+        Sub nodes are copied in, <other> is left as is. Returns
+        {"added": [...], "removed": [...], "changed": [...]} ref_ids of this
+        hierarchy, one per entry set or deleted."""
+        assert isinstance(other, HierarchyDict), \
+               """<other> must be HierarchyDict or subclass!"""
+        assert policy in MERGE_POLICIES or hasattr(policy, "__call__"), \
+               """<policy> must be "ours", "theirs", "mirror" or have __call__ attribute!"""
+        
+        summary = collections.OrderedDict([("added", []), ("removed", []), ("changed", [])])
+        for change, ours, theirs, key, value, other_value in list(self._diff_entries(other)):
+            ref_id = ours.get_content_ref_id(key)
+            if change == "added":
+                ours[key] = _detached(other_value)
+                summary["added"].append(ref_id)
+                continue
+            if change == "removed":
+                if policy == "mirror":
+                    del ours[key]
+                    summary["removed"].append(ref_id)
+                continue
+            if policy == "ours":
+                continue
+            if policy in MERGE_POLICIES:
+                kept = other_value
+            else:
+                kept = policy(ref_id, value, other_value)
+            if kept is value:
+                continue
+            ours[key] = _detached(kept)
+            summary["changed"].append(ref_id)
+            continue
+        return summary
+
     #CORE METHODS
-    def _recurse(self, function, _accumulator = collections.OrderedDict()):
-        """Recursive function that accumulates result values from a given function
-        for all child nodes and values. <function> takes 3 arguments, (key, value, and container)
-        <_accumulator> is passed recursively.
-        WARNING: Should not be called directly. <_accumulator> is a mutable default value, use
-        self.recurse instead."""
-
-        _accumulator[self._ref_id] = function(self._ref_id, self, self.container)
+    def iter_walk(self, prune = None, max_depth = None):
+        """Lazily walks the hierarchy with an explicit stack, yielding
+        (ref_id, key, value, container) in the same pre-order as _recurse:
+        a node (keyed by its ref_id), its contents, then its sub nodes.
+        <prune> is called with each node, returning True skips that node and
+        its subtree. <max_depth> stops descending past that many levels below
+        this node. Children are read once the node itself has been consumed."""
+        assert prune is None or hasattr(prune, "__call__"), \
+               "<prune> must have __call__ attribute!"
         
-        values = [i for i in self.items() if not isinstance(i[-1], HierarchyDict)]
-        nodes = [i for i in self.values() if isinstance(i, HierarchyDict)]
+        stack = [(self, 0)]
+        while stack:
+            node, depth = stack.pop()
+            if prune is not None and prune(node):
+                continue
+            ref_id = node._ref_id
+            yield (ref_id, ref_id, node, node._container)
 
-        for value in values:
-            key = KEY_SPLIT.join([self._ref_id, value[0]])
-            _accumulator[key] = function(value[0], value[-1], self)
+            nodes = []
+            for key, value in list(node.items()):
+                if isinstance(value, HierarchyDict):
+                    nodes.append(value)
+                    continue
+                yield (KEY_SPLIT.join([ref_id, key]), key, value, node)
+                continue
 
-        for node in nodes:
-            node._recurse(function, _accumulator)
+            if max_depth is not None and depth >= max_depth:
+                continue
+            for sub_node in reversed(nodes):
+                stack.append((sub_node, depth + 1))
+                continue
+        return
 
+    def _recurse(self, function, _accumulator = None):
+        """Accumulates result values from a given function for all child nodes
+        and values. <function> takes 3 arguments, (key, value, and container).
+        Kept for compatibility, use self.recurse or self.iter_recurse instead."""
+        if _accumulator is None:
+            _accumulator = collections.OrderedDict()
+        for ref_id, key, value, container in self.iter_walk():
+            _accumulator[ref_id] = function(key, value, container)
+            continue
         return _accumulator
 
-    def recurse(self, function, compress = True):
-        """Inverts and optionally compresses results from _recurse."""
+    def iter_recurse(self, function, compress = True, prune = None, max_depth = None):
+        """Streams (ref_id, result) pairs of <function> over the hierarchy,
+        skipping None results if <compress>."""
         assert hasattr(function, "__call__"), \
                "<function> must have __call__ attribute!"
+
+        for ref_id, key, value, container in self.iter_walk(prune, max_depth):
+            result = function(key, value, container)
+            if compress and result is None:
+                continue
+            yield (ref_id, result)
+        return
+
+    def recurse(self, function, compress = True, prune = None, max_depth = None, workers = None, executor = None):
+        """Collects results from iter_recurse in a single pass.
+        With <workers> or an <executor> (any concurrent.futures.Executor,
+        left running) the walk is split into balanced chunks run in a
+        process pool, see _iter_recurse_parallel. Results come back in the
+        order of the serial walk."""
+        assert workers is None or workers > 0, \
+               """<workers> must be positive!"""
         
-        results = self._recurse(function, _accumulator = collections.OrderedDict())
-        
-        if not compress:
+        if workers is None and executor is None:
+            results = collections.OrderedDict(
+                self.iter_recurse(function, compress, prune, max_depth))
             return results
-        items = results.items()
-        for item in items:
-            if item[-1] is None:
-                results.pop(item[0])
-            continue
+        workers = workers or getattr(executor, "_max_workers", None) or os.cpu_count() or 1
+        results = collections.OrderedDict(self._iter_recurse_parallel(
+            function, compress, prune, max_depth, workers, executor))
         return results
 
-    def query(self, query):
-        """Scans hierarchy by regex query."""
+    def _subtree_sizes(self):
+        """{id(node): entries beneath it plus one} for this node and every
+        node beneath it."""
+        sizes = {}
+        stack = [(self, False)]
+        while stack:
+            node, ready = stack.pop()
+            items = node._raw_items()
+            if not ready:
+                stack.append((node, True))
+                stack.extend([(v, False) for k, v in items if isinstance(v, HierarchyDict)])
+                continue
+            sizes[id(node)] = 1 + sum([sizes[id(v)] if isinstance(v, HierarchyDict) else 1
+                                       for k, v in items])
+            continue
+        return sizes
+
+    def _recurse_units(self, prune, max_depth, chunk, sizes):
+        """Splits iter_walk into units, in its order: ("subtree", node,
+        max_depth) for subtrees of at most <chunk> entries, and for each
+        node above them ("node", node) then ("values", node, items) slices
+        of its values."""
+        stack = [(self, 0)]
+        while stack:
+            node, depth = stack.pop()
+            remaining = None if max_depth is None else max_depth - depth
+            if sizes[id(node)] <= chunk:
+                yield ("subtree", node, remaining)
+                continue
+            if prune is not None and prune(node):
+                continue
+            yield ("node", node)
+            items = list(node._raw_items())
+            values = [i for i in items if not isinstance(i[1], HierarchyDict)]
+            for i in range(0, len(values), chunk):
+                yield ("values", node, values[i:i + chunk])
+                continue
+            if remaining is not None and remaining <= 0:
+                continue
+            stack.extend([(v, depth + 1) for k, v in reversed(items) if isinstance(v, HierarchyDict)])
+            continue
+        return
+
+    def _recurse_tasks(self, prune, max_depth, chunk, sizes):
+        """Groups _recurse_units into tasks of about <chunk> entries, each a
+        list of (container chain, subtree, values, max_depth) parts for
+        _recurse_task. A node above the chunks is yielded as is."""
+        task = []
+        task_size = 0
+        for unit in self._recurse_units(prune, max_depth, chunk, sizes):
+            kind, node = unit[:2]
+            if kind == "node":
+                if task:
+                    yield task
+                    task = []
+                    task_size = 0
+                yield node
+                continue
+            chain = [_node_record(i) for i in _container_chain(node)]
+            if kind == "subtree":
+                task.append((chain[:-1], node, None, unit[2]))
+                task_size += sizes[id(node)]
+            else:
+                task.append((chain, None, unit[2], None))
+                task_size += len(unit[2])
+            if task_size >= chunk:
+                yield task
+                task = []
+                task_size = 0
+            continue
+        if task:
+            yield task
+        return
+
+    def _iter_recurse_parallel(self, function, compress, prune, max_depth, workers, executor):
+        """Streams recurse results from tasks run in <executor>, a process
+        pool of <workers> if None. Each subtree is pickled on its own under
+        stand ins for its containers, carrying their ids, metadata and
+        state, so ref_ids and (key, value, container) match the serial walk
+        except that containers only hold what was shipped. Calls for the
+        nodes above the chunks run here. <function>, <prune> and results
+        must pickle, a lambda won't. At most 2 * <workers> tasks are in
+        flight."""
+        sizes = self._subtree_sizes()
+        chunk = max(RECURSE_MIN_CHUNK, sizes[id(self)] // (workers * RECURSE_CHUNKS_PER_WORKER))
+        own_executor = executor is None
+        if own_executor:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers = workers)
+        pending = collections.deque()
+        try:
+            for task in self._recurse_tasks(prune, max_depth, chunk, sizes):
+                if isinstance(task, HierarchyDict):
+                    result = function(task._ref_id, task, task._container)
+                    pending.append([] if compress and result is None else [(task._ref_id, result)])
+                else:
+                    pending.append(executor.submit(_recurse_task, function, compress, prune, task))
+                while len(pending) > workers * 2:
+                    results = pending.popleft()
+                    yield from results if type(results) == list else results.result()
+                    continue
+                continue
+            while pending:
+                results = pending.popleft()
+                yield from results if type(results) == list else results.result()
+                continue
+        finally:
+            if own_executor:
+                executor.shutdown(wait = True, cancel_futures = True)
+        return
+
+    def _children_named(self, name, ignore_case = False):
+        """Returns (key, value) children keyed <name>, in order. Case
+        insensitive lookups resolve through the root ref_id index if one
+        is built, otherwise against this node's own children."""
+        if not ignore_case or name.lower() == name.upper():
+            if name in self:
+                return [(name, self[name])]
+            return []
+        root = self._root
+        if not self.use_path_index or root._path_index is None:
+            folded = name.lower()
+            return [(k, self[k]) for k, v in list(self._raw_items()) if k.lower() == folded]
+
+        ref_id = self.get_content_ref_id(name)
+        start = len(ref_id) - len(name)
+        found = set()
+        for entry in root._path_index.get(ref_id.lower(), []):
+            key = entry[0][start:]
+            if collections.OrderedDict.get(self, key, None) is entry[-1]:
+                found.add(key)
+            continue
+        if len(found) > 1:
+            return [(k, self[k]) for k, v in list(self._raw_items()) if k in found]
+        return [(i, self[i]) for i in found]
+
+    def _query_starts(self, query):
+        """Plans a regex query from its literal ref id prefix. Returns
+        (node, skip_node) pairs to walk, a literal prefix resolves straight
+        to the nodes beneath it by lookup."""
+        prefix = _regex_literal_prefix(query)
+        ignore_case = bool(query.flags & re.IGNORECASE)
+        own = self._ref_id.split(KEY_SPLIT)
+
+        for segment, own_segment in zip(prefix, own):
+            if ignore_case:
+                segment, own_segment = segment.lower(), own_segment.lower()
+            if segment != own_segment:
+                return []
+            continue
+        if len(prefix) <= len(own):
+            return [(self, False)]
+
+        nodes = [self]
+        for segment in prefix[len(own):]:
+            children = []
+            for node in nodes:
+                children.extend([i[-1] for i in node._children_named(segment, ignore_case)
+                                 if isinstance(i[-1], HierarchyDict)])
+                continue
+            nodes = children
+            continue
+        return [(node, True) for node in nodes]
+
+    def iter_query(self, query, full_ref_ids = False, _stats = None):
+        """Streams (ref_id, value) pairs matching regex <query>, nodes by
+        their ref id and contents by their key, as recurse passes them.
+        With <full_ref_ids> contents are matched by their full ref id too,
+        then only the subtrees beneath a literal leading ref id prefix are
+        walked."""
         assert hasattr(query, "match"), \
                "<query> must be regex!"
-        def query_(key, value, container):
-            if query.match(key):
-                return value
-            return None
-        results = self.recurse(query_)
+
+        if not full_ref_ids:
+            for ref_id, key, value, container in self.iter_walk():
+                if _stats is not None:
+                    _stats["visited"] += 1
+                if query.match(key):
+                    yield (ref_id, value)
+                continue
+            return
+        for start, skip_start in self._query_starts(query):
+            for ref_id, key, value, container in start.iter_walk():
+                if skip_start and value is start:
+                    continue
+                if _stats is not None:
+                    _stats["visited"] += 1
+                if query.match(ref_id):
+                    yield (ref_id, value)
+                continue
+            continue
+        return
+
+    def query(self, query, full_ref_ids = False):
+        """Scans hierarchy by regex query, see iter_query."""
+        assert hasattr(query, "match"), \
+               "<query> must be regex!"
+        key = ("query", query.pattern, query.flags, full_ref_ids)
+        results = self._cached(key, lambda: collections.OrderedDict(self.iter_query(query, full_ref_ids)))
+        return collections.OrderedDict(results)
+
+    def _acquire_indexed(self, query, ignore_case):
+        root = self._root
+        if root._path_index is None:
+            root.build_path_index()
+        entries = root._path_index.get(query.lower(), [])
+        if not ignore_case:
+            entries = [i for i in entries if i[0] == query]
+        if root is not self:
+            prefix = self._ref_id
+            entries = [i for i in entries
+                       if i[0] == prefix or i[0].startswith(prefix + KEY_SPLIT)]
+        return [root._read_indexed(i[0], i[-1]) for i in entries]
+
+    def _acquire_walked(self, query, ignore_case):
+        """Resolves ref id <query> one segment at a time through
+        _children_named, for nodes without a path index."""
+        segments = query.split(KEY_SPLIT)
+        own = self._ref_id.split(KEY_SPLIT)
+        if len(segments) < len(own):
+            return []
+        for segment, own_segment in zip(segments, own):
+            if ignore_case:
+                segment, own_segment = segment.lower(), own_segment.lower()
+            if segment != own_segment:
+                return []
+            continue
+        results = [self]
+        for segment in segments[len(own):]:
+            results = [i[-1] for node in results if isinstance(node, HierarchyDict)
+                       for i in node._children_named(segment, ignore_case)]
+            continue
         return results
 
-    def acquire(self, query):
+    def acquire(self, query, ignore_case = True):
         """Aquires specified key indiciated by <query>.
         Key must match in entirety."""
         assert type(query) == str, \
                "<query> must be string!"
 
-        _query = query
-        query = "^{0}$".format(query)
-        query = re.compile(query, re.IGNORECASE)
-
-        results = self.query(query)
+        if self.use_path_index:
+            results = self._acquire_indexed(query, ignore_case)
+        else:
+            results = self._acquire_walked(query, ignore_case)
             
         if len(results) == 1:
-            return results.values()[0]
+            return results[0]
         elif results:
-            return results.values()
+            return results
         else:
             return None
 
+    def iter_glob(self, query, _stats = None):
+        """Streams (ref_id, value) pairs for ref ids matching glob <query>.
+        Only children whose segment can still match are descended, literal
+        segments are resolved by lookup. See GlobPattern for wildcards."""
+        assert type(query) == str or isinstance(query, GlobPattern), \
+               "<query> must be string or GlobPattern!"
+        if type(query) == str:
+            query = _compile_glob(query)
+
+        states = query.start()
+        for segment in self._ref_id.split(KEY_SPLIT):
+            states = query.step(states, segment)
+            if not states:
+                return
+            continue
+        if _stats is not None:
+            _stats["visited"] += 1
+
+        stack = [(self, states)]
+        while stack:
+            node, states = stack.pop()
+            if query.accepts(states):
+                yield (node._ref_id, node)
+            if query.exhausted(states):
+                continue
+
+            literal = query.literal(states)
+            if literal is None:
+                items = list(node.items())
+            else:
+                items = node._children_named(literal, query.ignore_case)
+
+            ref_id = node._ref_id
+            nodes = []
+            for key, value in items:
+                if _stats is not None:
+                    _stats["visited"] += 1
+                sub_states = query.step(states, key)
+                if not sub_states:
+                    continue
+                if isinstance(value, HierarchyDict):
+                    nodes.append((value, sub_states))
+                elif query.accepts(sub_states):
+                    yield (KEY_SPLIT.join([ref_id, key]), value)
+                continue
+            stack.extend(reversed(nodes))
+            continue
+        return
+
+    def glob(self, query):
+        """Finds the ref ids matching glob <query> in full. Wildcards are '*'
+        for any characters within a segment, '**' for any number of
+        segments."""
+        if isinstance(query, GlobPattern):
+            key = ("glob", query.pattern, query.ignore_case)
+        else:
+            key = ("glob", query, True)
+        results = self._cached(key, lambda: collections.OrderedDict(self.iter_glob(query)))
+        
+        return collections.OrderedDict(results)
+
     def search(self, query):
         """Searches the hierarchy for keys matching <query>.
-        Wildcards are '*' for any character."""
+        Wildcards are '*' for any character. Matched as query matches, from
+        the start of a node's ref id or a content's key, see glob for whole
+        ref id patterns pruned per segment."""
         assert type(query) == str, \
                "<query> must be string!"
         
-        _query = query
         query = query.replace('*', ".*")
-        query = re.compile(query, flags = re.IGNORECASE)
-        
-        results = self.query(query)
+        query = _compile_regex(query, re.IGNORECASE)
         
+        return self.query(query)
+
+    def iter_batch(self, queries):
+        """Answers many glob (string) and regex <queries> in one traversal.
+        Streams (ref_id, value, matched), <matched> being the tuple of
+        queries whose pattern matches ref_id.
+        Each query is pruned on its leading segments, up to its first '**'
+        for globs or its literal ref id prefix for regexes, and is carried
+        down for free once only '**' is left. Entries are tested through a
+        single combined alternation of all queries, only the alternatives
+        after the first one matching are tested again."""
+        queries = list(queries)
+        plans = []
+        regexes = []
+        for query in queries:
+            if type(query) == str:
+                query = _compile_glob(query)
+            if isinstance(query, GlobPattern):
+                segments = query.segments
+                if GLOB_ANY in segments:
+                    segments = segments[:segments.index(GLOB_ANY) + 1]
+                plans.append(GlobPattern(KEY_SPLIT.join(segments), query.ignore_case))
+                regexes.append(query.regex)
+                continue
+            assert hasattr(query, "match"), \
+                   "<queries> must be strings, GlobPatterns or regexes!"
+            prefix = [_glob_escape(i) for i in _regex_literal_prefix(query)]
+            pattern = KEY_SPLIT.join(prefix + [GLOB_ANY])
+            plans.append(GlobPattern(pattern, bool(query.flags & re.IGNORECASE)))
+            regexes.append(query)
+            continue
+        combined = _combine_regexes(list(enumerate(regexes)))
+
+        def matched_(ref_id, states, saturated):
+            live = set(saturated)
+            live.update([i[0] for i in states])
+            start = -1
+            if combined is not None:
+                match = combined.match(ref_id)
+                if match is None:
+                    return ()
+                start = int(match.lastgroup[2:])
+                live.discard(start)
+                matched = [start]
+            else:
+                matched = []
+            matched.extend([i for i in live if i > start and regexes[i].match(ref_id)])
+            return tuple([queries[i] for i in sorted(matched)])
+
+        def partition_(states):
+            """Splits live states into those needing a wildcard test and those
+            waiting on a literal segment, keyed by that segment."""
+            wild = []
+            exact = collections.defaultdict(list)
+            folded = collections.defaultdict(list)
+            for i, s in states:
+                plan = plans[i]
+                if plan.exhausted(s):
+                    continue
+                literal = plan.literal(s)
+                if literal is None:
+                    wild.append((i, s))
+                elif plan.ignore_case:
+                    folded[literal.lower()].append((i, s))
+                else:
+                    exact[literal].append((i, s))
+                continue
+            return (wild, exact, folded)
+
+        def step_(partition, saturated, key):
+            wild, exact, folded = partition
+            candidates = wild + exact.get(key, []) + folded.get(key.lower(), [])
+            next_states = []
+            next_saturated = saturated
+            for i, s in candidates:
+                s = plans[i].step(s, key)
+                if not s:
+                    continue
+                if plans[i].saturated(s):
+                    next_saturated = next_saturated | frozenset([i])
+                    continue
+                next_states.append((i, s))
+                continue
+            return (next_states, next_saturated)
+
+        states = []
+        saturated = frozenset()
+        for i, plan in enumerate(plans):
+            if plan.saturated(plan.start()):
+                saturated = saturated | frozenset([i])
+            else:
+                states.append((i, plan.start()))
+            continue
+        for segment in self._ref_id.split(KEY_SPLIT):
+            states, saturated = step_(partition_(states), saturated, segment)
+            continue
+
+        stack = [(self, states, saturated)]
+        while stack:
+            node, states, saturated = stack.pop()
+            if not states and not saturated:
+                continue
+            ref_id = node._ref_id
+            matched = matched_(ref_id, states, saturated)
+            if matched:
+                yield (ref_id, node, matched)
+
+            partition = partition_(states)
+            wild, exact, folded = partition
+            items = None
+            if not wild and not saturated:
+                keys = [i for i in exact if i in node]
+                for literal in folded:
+                    keys.extend([i[0] for i in node._children_named(literal, True)])
+                    continue
+                if len(keys) < 2:
+                    items = [(i, node[i]) for i in keys]
+            if items is None:
+                items = list(node.items())
+
+            nodes = []
+            for key, value in items:
+                sub_states, sub_saturated = step_(partition, saturated, key)
+                if not sub_states and not sub_saturated:
+                    continue
+                if isinstance(value, HierarchyDict):
+                    nodes.append((value, sub_states, sub_saturated))
+                    continue
+                content_ref_id = KEY_SPLIT.join([ref_id, key])
+                matched = matched_(content_ref_id, sub_states, sub_saturated)
+                if matched:
+                    yield (content_ref_id, value, matched)
+                continue
+            stack.extend(reversed(nodes))
+            continue
+        return
+
+    def batch(self, queries):
+        """Evaluates many glob (string) and regex <queries> in one traversal,
+        returning {query: {ref_id: value}} in the order of <queries>.
+        Regexes are matched against full ref ids, as query(full_ref_ids = True)
+        matches them."""
+        queries = list(queries)
+        results = collections.OrderedDict([(i, collections.OrderedDict()) for i in queries])
+        for ref_id, value, matched in self.iter_batch(queries):
+            for query in matched:
+                results[query][ref_id] = value
+                continue
+            continue
         return results
+
+    def explain(self, query):
+        """Reports how many entries a glob (string) or regex <query> visits
+        against the number a full scan of this node visits. Regexes are
+        planned as query(full_ref_ids = True) plans them."""
+        stats = collections.OrderedDict([("visited", 0), ("matched", 0)])
+        if type(query) == str or isinstance(query, GlobPattern):
+            results = self.iter_glob(query, _stats = stats)
+        else:
+            results = self.iter_query(query, full_ref_ids = True, _stats = stats)
+        for result in results:
+            stats["matched"] += 1
+            continue
+        stats["total"] = sum(1 for i in self.iter_walk())
+        stats["pruned"] = stats["total"] - stats["visited"]
+        return stats
         
 
+    #QUERY CACHE
+    def _cached(self, key, compute):
+        """Returns the result of <compute> for this node, reusing a cached
+        result while neither this subtree's generation nor ref_id changed."""
+        if self.query_cache_size < 1:
+            return compute()
+        root = self._root
+        if root._query_cache is None:
+            root._query_cache = LRUCache(self.query_cache_size)
+
+        ref_id = self._ref_id
+        generation = self._generation
+        def validate_(entry):
+            return entry[0] is self and entry[1] == generation and entry[2] == ref_id
+        key = (key, id(self))
+        entry = root._query_cache.get(key, validate = validate_)
+        if entry is not None:
+            return entry[-1]
+        results = compute()
+        root._query_cache.put(key, (self, generation, ref_id, results))
+        return results
+
+    def clear_query_cache(self):
+        """Drops cached query results for the whole hierarchy."""
+        self._root._query_cache = None
+        return None
+
+    def cache_stats(self):
+        """Hit, miss and eviction counts of this hierarchy's result cache and
+        of the shared compiled pattern cache."""
+        root = self._root
+        results = root._query_cache
+        if results is None:
+            results = LRUCache(self.query_cache_size)
+        return collections.OrderedDict([("results", results.stats()),
+                                        ("patterns", PATTERN_CACHE.stats())])
+
+    #BULK CONSTRUCTION
+    @classmethod
+    def _bulk_node(cls, id_, container):
+        """Creates a node without the constructor's validation, for bulk
+        building only. The node is attached to <container> directly."""
+        node = cls.__new__(cls)
+        collections.OrderedDict.__init__(node)
+        node._HierarchyDict__id_ = id_
+        node._id_ = id_
+        node._container = container
+        node._path_index = None
+        node._attribute_index = None
+        node._query_cache = None
+        node._generation = 0
+        node._metadata = None
+        node._aggregates = None
+        node._digest = None
+        node._frozen_views = None
+        if container is None:
+            node._ref_id_cache = id_
+        else:
+            node._ref_id_cache = KEY_SPLIT.join([container._ref_id_cache, id_])
+            collections.OrderedDict.__setitem__(container, id_, node)
+        return node
+
+    @classmethod
+    def from_items(cls, items):
+        """Builds a whole hierarchy in one streaming pass over (ref_id, value)
+        pairs such as ("A/B/C/leaf", value). Intermediate nodes are created
+        and shared as needed, a value of NODE creates (or keeps) a node.
+        Every ref_id must start with the same root id."""
+        get = collections.OrderedDict.get
+        set_ = collections.OrderedDict.__setitem__
+        root = None
+        last_prefix = None
+        last_node = None
+        for ref_id, value in items:
+            if value is NODE:
+                prefix, key = ref_id, None
+            else:
+                prefix, split, key = ref_id.rpartition(KEY_SPLIT)
+                if not split:
+                    raise ValueError("{0} can't hold a value, it is the root!".format(ref_id))
+
+            if prefix == last_prefix:
+                node = last_node
+            else:
+                segments = prefix.split(KEY_SPLIT)
+                if root is None:
+                    root = cls._bulk_node(sys.intern(segments[0]), None)
+                elif segments[0] != root._id_:
+                    raise ValueError("{0} is not under root {1}!".format(ref_id, root._id_))
+                node = root
+                for segment in segments[1:]:
+                    sub_node = get(node, segment, None)
+                    if sub_node is None:
+                        sub_node = cls._bulk_node(sys.intern(segment), node)
+                    elif not isinstance(sub_node, HierarchyDict):
+                        raise ValueError("{0} is a value, not a node!".format(sub_node))
+                    node = sub_node
+                    continue
+                last_prefix = prefix
+                last_node = node
+
+            if key is None:
+                continue
+            if isinstance(get(node, key, None), HierarchyDict):
+                raise ValueError("{0} is a node, not a value!".format(ref_id))
+            set_(node, sys.intern(key), value)
+            continue
+        return root
+
+    @classmethod
+    def from_paths(cls, paths):
+        """Builds a hierarchy of nodes from ref_ids such as "A/B/C"."""
+        return cls.from_items(((i, NODE) for i in paths))
+
+    def to_items(self):
+        """Streams (ref_id, value) pairs that from_items rebuilds this
+        hierarchy from, depth first in key order. Nodes without children are
+        streamed as (ref_id, NODE)."""
+        stack = [(self._ref_id, iter(list(self.items())))]
+        if len(self) < 1:
+            yield (self._ref_id, NODE)
+        while stack:
+            ref_id, items = stack[-1]
+            for key, value in items:
+                sub_ref_id = KEY_SPLIT.join([ref_id, key])
+                if not isinstance(value, HierarchyDict):
+                    yield (sub_ref_id, value)
+                    continue
+                if len(value) < 1:
+                    yield (sub_ref_id, NODE)
+                    continue
+                stack.append((sub_ref_id, iter(list(value.items()))))
+                break
+            else:
+                stack.pop()
+            continue
+        return
+
+    #COMPACT STORAGE
+    @classmethod
+    def _columnar_store(cls):
+        """The ColumnarStore class used for compact() and snapshots."""
+        return ColumnarStore
+
+    def compact(self):
+        """Returns a read only, array backed copy of this hierarchy. See
+        ColumnarStore and CompactHierarchyDict."""
+        store = self._columnar_store().from_hierarchy(self)
+        return store.view(0)
+
+    #SNAPSHOTS
+    def save_snapshot(self, path):
+        """Writes this hierarchy to a binary snapshot file at <path>, see
+        ColumnarStore.save."""
+        self._columnar_store().from_hierarchy(self).save(path)
+        return None
+
+    @classmethod
+    def load_snapshot(cls, path):
+        """Maps a snapshot written by save_snapshot, returning a read only
+        CompactHierarchyDict of its root. Nodes and values are decoded on
+        first access, thaw() it for a mutable tree. Snapshots are unpickled,
+        only load trusted files."""
+        return cls._columnar_store().load(path).view(0)
+
     #CONVENIENCE METHODS
     def get_content_ref_id(self, key):
         """Convienence method for getting ref_id from inside recursive function for contents."""
@@ -278,13 +1687,1404 @@ class HierarchyDict(collections.OrderedDict, object):
         return None
     
     pass
+
+class Profiler(object):
+    """Records calls, time, nodes visited, regex evaluations and syscalls
+    per public operation while enabled. <targets> is a list of
+    (owner, attribute, kind, counter), PROFILE_TARGETS by default,
+    fs.PROFILE_TARGETS adds the fs operations. Kinds are:
+    "operation", a public method or property timed per call,
+    "counter", each call (or item a generator yields) adds one to <counter>,
+    "stats", the "visited" a generator counts in its _stats adds to <counter>,
+    "syscall", each call adds one to the counter its first argument names.
+    Counts go to "total" and to every operation running in the calling
+    thread, so an operation's counts include those of the operations it
+    calls, counts from pool threads only reach "total".
+    Enabling swaps the targets for wrappers and disabling puts the
+    originals back, a disabled profiler costs nothing."""
+    def __init__(self, targets = None):
+        if targets is None:
+            targets = PROFILE_TARGETS
+        for owner, attribute, kind, counter in targets:
+            assert attribute in vars(owner), \
+                   """<targets> must name attributes defined by their owner!"""
+            assert kind in PROFILE_KINDS, \
+                   """<targets> kinds must be in PROFILE_KINDS!"""
+            continue
+
+        self.targets = list(targets)
+        self.stats = collections.OrderedDict()
+        self.enabled = False
+        self._originals = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        return None
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+        return False
+
+    def enable(self):
+        """Wraps the targets, one profiler may be enabled at a time."""
+        global _PROFILER
+        with _PROFILER_LOCK:
+            assert _PROFILER is None, \
+                   """Another Profiler is already enabled!"""
+            for owner, attribute, kind, counter in self.targets:
+                original = vars(owner)[attribute]
+                self._originals.append((owner, attribute, original))
+                setattr(owner, attribute, self._wrap(owner, attribute, kind, counter, original))
+                continue
+            _PROFILER = self
+            self.enabled = True
+        return None
+
+    def disable(self):
+        global _PROFILER
+        with _PROFILER_LOCK:
+            if _PROFILER is not self:
+                return None
+            for owner, attribute, original in reversed(self._originals):
+                setattr(owner, attribute, original)
+                continue
+            self._originals = []
+            _PROFILER = None
+            self.enabled = False
+        return None
+
+    def reset(self):
+        with self._lock:
+            self.stats.clear()
+        return None
+
+    def _stack(self):
+        """Names of the operations running in this thread."""
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _entry(self, name):
+        entry = self.stats.get(name, None)
+        if entry is None:
+            entry = self.stats[name] = collections.Counter()
+        return entry
+
+    def record(self, counter, amount = 1):
+        """Adds <amount> to <counter> of "total" and of the running operations."""
+        names = set(self._stack())
+        with self._lock:
+            self._entry("total")[counter] += amount
+            for name in names:
+                self._entry(name)[counter] += amount
+                continue
+        return None
+
+    def _finish(self, name, seconds):
+        with self._lock:
+            entry = self._entry(name)
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+        return None
+
+    def _wrap(self, owner, attribute, kind, counter, original):
+        function = original.fget if isinstance(original, property) else original
+        name = "{0}.{1}".format(owner.__name__, attribute)
+        if kind == "operation":
+            def wrapper_(*args, **kwargs):
+                stack = self._stack()
+                stack.append(name)
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    stack.pop()
+                    self._finish(name, time.perf_counter() - start)
+        elif kind == "counter" and inspect.isgeneratorfunction(function):
+            def wrapper_(*args, **kwargs):
+                for item in function(*args, **kwargs):
+                    self.record(counter)
+                    yield item
+                    continue
+                return
+        elif kind == "counter":
+            def wrapper_(*args, **kwargs):
+                self.record(counter)
+                return function(*args, **kwargs)
+        elif kind == "stats":
+            def wrapper_(*args, **kwargs):
+                stats = kwargs.get("_stats", None)
+                if stats is None:
+                    stats = kwargs["_stats"] = collections.Counter()
+                before = stats["visited"]
+                try:
+                    yield from function(*args, **kwargs)
+                finally:
+                    self.record(counter, stats["visited"] - before)
+                return
+        else:
+            def wrapper_(syscall, *args, **kwargs):
+                self.record(syscall)
+                return function(syscall, *args, **kwargs)
+        functools.update_wrapper(wrapper_, function)
+        if isinstance(original, property):
+            return property(wrapper_, original.fset, original.fdel, original.__doc__)
+        return wrapper_
+
+    def report(self):
+        """Counts per operation, "total" first then the operations by time
+        spent, with the mean microseconds per call added."""
+        with self._lock:
+            stats = [(k, collections.Counter(v)) for k, v in self.stats.items()]
+        stats.sort(key = lambda i: (i[0] != "total", -i[1]["seconds"]))
+        results = collections.OrderedDict()
+        for name, entry in stats:
+            if entry["calls"]:
+                entry["us_per_call"] = 10**6 * entry["seconds"] / entry["calls"]
+            results[name] = collections.OrderedDict(sorted(entry.items()))
+            continue
+        return results
+
+    pass
+
+class Rollup(object):
+    """A subtree aggregate, kept by nodes of classes listing it in their
+    rollups. <leaf>(key, value) is a value's contribution, None for none.
+    A "sum" rollup adds contributions, a "max" rollup keeps the largest,
+    with sub nodes contributing their own total plus <step> (leaf 1 and
+    step 1 give the depth of the deepest entry, see MAX_DEPTH). Removing
+    the largest entry of a "max" rollup recomputes only the nodes on the
+    container chain, from their direct children. Values changed in place
+    are not seen until set again."""
+    def __init__(self, name, leaf, kind = "sum", step = 0):
+        assert kind in ["sum", "max"], \
+               """<kind> must be "sum" or "max"!"""
+        self.name = name
+        self.leaf = leaf
+        self.kind = kind
+        self.step = step
+        return None
+
+    def __repr__(self):
+        return "<{0} {1} {2}/>".format(self.__class__.__name__, self.name, self.kind)
+
+    def contribution(self, key, value):
+        if not isinstance(value, HierarchyDict):
+            return self.leaf(key, value)
+        total = value._aggregates[self.name]
+        if self.kind == "sum":
+            return total
+        if total is None:
+            return self.step or None
+        return total + self.step
+
+    def total(self, node):
+        contributions = [self.contribution(k, v) for k, v in node._raw_items()]
+        contributions = [i for i in contributions if i is not None]
+        if self.kind == "sum":
+            return sum(contributions)
+        return max(contributions, default = None)
+
+    def added(self, node, contribution):
+        """Folds <contribution>, just added under <node>, into <node> and
+        its containers."""
+        name = self.name
+        while contribution is not None and node is not None:
+            aggregates = node._aggregates
+            if aggregates is None or not name in aggregates:
+                break
+            if self.kind == "sum":
+                aggregates[name] += contribution
+            else:
+                total = aggregates[name]
+                if total is not None and contribution <= total:
+                    break
+                aggregates[name] = contribution
+                contribution += self.step
+            node = node._container
+            continue
+        return None
+
+    def removed(self, node, contribution):
+        """Takes <contribution>, just removed from under <node>, out of
+        <node> and its containers."""
+        name = self.name
+        while contribution is not None and node is not None:
+            aggregates = node._aggregates
+            if aggregates is None or not name in aggregates:
+                break
+            if self.kind == "sum":
+                aggregates[name] -= contribution
+            else:
+                total = aggregates[name]
+                if total is not None and contribution < total:
+                    break
+                new_total = self.total(node)
+                if new_total == total:
+                    break
+                aggregates[name] = new_total
+                contribution = None
+                if total is not None:
+                    contribution = total + self.step
+            node = node._container
+            continue
+        return None
+
+class AttributeIndex(object):
+    """Inverted index of a hierarchy, attribute: term: {ref_id: location}.
+    Terms come from each value's index_terms() method, if it has one, and
+    from each node's hashable metadata as ("metadata", (key, value)).
+    A location is (container, key) for values and (node, None) for nodes,
+    so values are read through their container when found."""
+    def __init__(self):
+        self.postings = {}
+        self.terms = {}
+        return None
+
+    @staticmethod
+    def _terms(value):
+        terms = []
+        index_terms = getattr(value, "index_terms", None)
+        if index_terms is not None:
+            terms.extend(index_terms())
+        if isinstance(value, HierarchyDict) and value._metadata:
+            for item in value._metadata.items():
+                try:
+                    hash(item)
+                except TypeError:
+                    continue
+                terms.append(("metadata", item))
+                continue
+        return terms
+
+    def add(self, ref_id, container, key, value):
+        terms = list(dict.fromkeys(self._terms(value))) #A name may repeat a keyword
+        if not terms:
+            return None
+        location = (value, None) if key is None else (container, key)
+        for attribute, term in terms:
+            self.postings.setdefault(attribute, {}).setdefault(term, {})[ref_id] = location
+            continue
+        self.terms[ref_id] = terms
+        return None
+
+    def remove(self, ref_id):
+        for attribute, term in self.terms.pop(ref_id, ()):
+            terms = self.postings[attribute]
+            postings = terms[term]
+            postings.pop(ref_id, None)
+            if not postings:
+                del terms[term]
+            if not terms:
+                del self.postings[attribute]
+            continue
+        return None
+
+    def add_subtree(self, node):
+        for ref_id, key, value, container in node._iter_raw_walk():
+            self.add(ref_id, container, None if value is node or \
+                     isinstance(value, HierarchyDict) else key, value)
+            continue
+        return None
+
+    def remove_subtree(self, node):
+        for ref_id, key, value, container in node._iter_raw_walk():
+            self.remove(ref_id)
+            continue
+        return None
+
+    def add_item(self, container, key, item):
+        if isinstance(item, HierarchyDict):
+            self.add_subtree(item)
+        else:
+            self.add(container.get_content_ref_id(key), container, key, item)
+        return None
+
+    def remove_item(self, container, key, item):
+        if isinstance(item, HierarchyDict) and item._container is container:
+            self.remove_subtree(item)
+        else:
+            self.remove(container.get_content_ref_id(key))
+        return None
+
+    def find(self, terms, prefix = None):
+        """See HierarchyDict.find, <prefix> limits results to that ref_id
+        and beneath."""
+        lists = []
+        for attribute, wanted in terms.items():
+            if not isinstance(wanted, list):
+                wanted = [wanted]
+            for term in wanted:
+                postings = self.postings.get(attribute, {}).get(term, None)
+                if not postings:
+                    return collections.OrderedDict()
+                lists.append(postings)
+                continue
+            continue
+        results = collections.OrderedDict()
+        if not lists:
+            return results
+        lists.sort(key = len)
+        for ref_id, (container, key) in lists[0].items():
+            if prefix is not None and ref_id != prefix and \
+               not ref_id.startswith(prefix + KEY_SPLIT):
+                continue
+            if not all(ref_id in i for i in lists[1:]):
+                continue
+            results[ref_id] = container if key is None else container[key]
+            continue
+        return results
+
+class ColumnarStore(object):
+    """Array backed storage for a whole frozen hierarchy. Entries are laid
+    out breadth first so the children of a node are contiguous. Per entry it
+    keeps the container's entry index, the key's id in a shared string table
+    and the value, which is the node id for sub nodes."""
+    def __init__(self):
+        self.strings = []
+        self.string_ids = {}
+        self.parents = array.array('i')
+        self.keys = array.array('i')
+        self.values = []
+        self.is_node = bytearray()
+        self.node_entries = array.array('i')
+        self.node_first = array.array('i')
+        self.node_counts = array.array('i')
+        self.metadata = {}
+        self.node_states = {}
+        self.info = {}
+        self.key_order = None
+        self._views = {}
+        self._key_indexes = {}
+        self._folded_indexes = {}
+        return None
+
+    def __len__(self):
+        return len(self.values)
+
+    def _string_id(self, string):
+        string_id = self.string_ids.get(string, None)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(string)
+            self.string_ids[string] = string_id
+        return string_id
+
+    def _append(self, parent, key, value, is_node):
+        self.parents.append(parent)
+        self.keys.append(self._string_id(key))
+        self.values.append(value)
+        self.is_node.append(1 if is_node else 0)
+        return len(self.values) - 1
+
+    @classmethod
+    def from_hierarchy(cls, root):
+        """Lays <root> and everything beneath it out breadth first, values
+        as stored, without any resolving a subclass does on read."""
+        assert isinstance(root, HierarchyDict), \
+               """<root> must be HierarchyDict or subclass!"""
+        store = cls()
+        queue = collections.deque([root])
+        store.node_entries.append(store._append(-1, root._id_, 0, True))
+        while queue:
+            node = queue.popleft()
+            node_id = len(store.node_first)
+            parent = store.node_entries[node_id]
+            if node._metadata:
+                store.metadata[node_id] = node._metadata
+            state = store._encode_node(node)
+            if state is not None:
+                store.node_states[node_id] = state
+            store.node_first.append(len(store.values))
+            store.node_counts.append(len(node))
+            for key, value in list(node._raw_items()):
+                if isinstance(value, HierarchyDict):
+                    sub_id = len(store.node_entries)
+                    store.node_entries.append(store._append(parent, key, sub_id, True))
+                    queue.append(value)
+                    continue
+                store._append(parent, key, value, False)
+                continue
+            continue
+        return store
+
+    def view(self, node_id):
+        """Returns the CompactHierarchyDict for <node_id>, creating it and any
+        missing container views on first access."""
+        view = self._views.get(node_id, None)
+        if view is not None:
+            return view
+        chain = []
+        while view is None:
+            chain.append(node_id)
+            parent = self.parents[self.node_entries[node_id]]
+            if parent < 0:
+                break
+            node_id = self.values[parent]
+            view = self._views.get(node_id, None)
+            continue
+        for node_id in reversed(chain):
+            view = CompactHierarchyDict(self, node_id, view)
+            self._views[node_id] = view
+            continue
+        return view
+
+    def find_entry(self, node_id, key):
+        """The entry of <key> among the children of <node_id>, None if it
+        has none. Nodes of KEY_INDEX_MIN or more children are looked up
+        through a {string id: entry} index built on first use, mapped
+        snapshots by bisecting their stored key order."""
+        first = self.node_first[node_id]
+        stop = first + self.node_counts[node_id]
+        if self.key_order is not None:
+            low = self._bisect_key(first, stop, (key.lower(), key))
+            if low < stop and self.strings[self.keys[self.key_order[low]]] == key:
+                return self.key_order[low]
+            return None
+        string_id = self.string_ids.get(key, None)
+        if string_id is None:
+            return None
+        if stop - first < KEY_INDEX_MIN:
+            try:
+                return self.keys.index(string_id, first, stop)
+            except ValueError:
+                return None
+        index = self._key_indexes.get(node_id, None)
+        if index is None:
+            index = {self.keys[i]:i for i in range(stop - 1, first - 1, -1)}
+            self._key_indexes[node_id] = index
+        return index.get(string_id, None)
+
+    def find_folded(self, node_id, key):
+        """Entries of the children of <node_id> whose key equals <key>
+        ignoring case, in order. Indexed as find_entry is."""
+        first = self.node_first[node_id]
+        stop = first + self.node_counts[node_id]
+        folded = key.lower()
+        if self.key_order is not None:
+            entries = []
+            low = self._bisect_key(first, stop, (folded,))
+            while low < stop and self.strings[self.keys[self.key_order[low]]].lower() == folded:
+                entries.append(self.key_order[low])
+                low += 1
+                continue
+            return sorted(entries)
+        if stop - first < KEY_INDEX_MIN:
+            return [i for i in range(first, stop) if self.strings[self.keys[i]].lower() == folded]
+        index = self._folded_indexes.get(node_id, None)
+        if index is None:
+            index = {}
+            for entry in range(first, stop):
+                index.setdefault(self.strings[self.keys[entry]].lower(), []).append(entry)
+                continue
+            self._folded_indexes[node_id] = index
+        return index.get(folded, [])
+
+    def _bisect_key(self, low, high, key):
+        """First position in key_order[low:high] whose (folded key, key) is
+        not below <key>."""
+        while low < high:
+            middle = (low + high) // 2
+            string = self.strings[self.keys[self.key_order[middle]]]
+            if (string.lower(), string) < key:
+                low = middle + 1
+            else:
+                high = middle
+            continue
+        return low
+
+    def _key_order(self):
+        """Entry indexes with each node's children range sorted by folded
+        key then key, the order mapped snapshots are bisected in."""
+        def key_(entry):
+            string = self.strings[self.keys[entry]]
+            return (string.lower(), string)
+        key_order = array.array('i', range(len(self)))
+        for node_id in range(len(self.node_first)):
+            first = self.node_first[node_id]
+            stop = first + self.node_counts[node_id]
+            key_order[first:stop] = array.array('i', sorted(range(first, stop), key = key_))
+            continue
+        return key_order
+
+    def entry_path(self, entry):
+        """The keys from the root entry down to <entry>."""
+        keys = []
+        while entry >= 0:
+            keys.append(self.strings[self.keys[entry]])
+            entry = self.parents[entry]
+            continue
+        keys.reverse()
+        return keys
+
+    #SUBCLASS HOOKS
+    def _encode_node(self, node):
+        """Extra per node state kept by from_hierarchy, None for none."""
+        return None
+
+    def _encode_value(self, entry, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def _decode_value(self, entry, data):
+        return pickle.loads(data)
+
+    def _read_value(self, entry):
+        """The value views read for <entry>."""
+        return self.values[entry]
+
+    def _value_digest(self, key, value):
+        """HierarchyDict._value_digest for values read back from the store,
+        a value's pickle, or its repr if it can't be pickled."""
+        try:
+            return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return repr(value).encode("utf-8", "surrogatepass")
+
+    def _thaw_node(self, node_id, container):
+        """Creates the mutable node for <node_id>, attached to <container>."""
+        key = self.strings[self.keys[self.node_entries[node_id]]]
+        node = HierarchyDict._bulk_node(key, container)
+        node._metadata = dict(self.metadata.get(node_id, None) or {}) or None
+        return node
+
+    def _thaw_value(self, entry, key, container):
+        """The value for <entry> in a thawed tree, under <container>."""
+        return self.values[entry]
+
+    def thaw(self, node_id = 0):
+        """Returns a mutable copy of <node_id> and its subtree, straight from
+        the columns without creating views."""
+        set_ = collections.OrderedDict.__setitem__
+        strings = self.strings
+        keys = self.keys
+        is_node = self.is_node
+        values = self.values
+        with gc_paused():
+            root = self._thaw_node(node_id, None)
+            stack = [(node_id, root)]
+            while stack:
+                node_id, node = stack.pop()
+                first = self.node_first[node_id]
+                for entry in range(first, first + self.node_counts[node_id]):
+                    if is_node[entry]:
+                        sub_id = values[entry]
+                        stack.append((sub_id, self._thaw_node(sub_id, node)))
+                        continue
+                    key = strings[keys[entry]]
+                    set_(node, key, self._thaw_value(entry, key, node))
+                    continue
+                continue
+        return root
+
+    #SNAPSHOTS
+    def save(self, path):
+        """Writes the store to <path> as sections of native arrays and
+        length prefixed blobs, see load. Leaf values go through
+        _encode_value, node metadata and states are pickled. The file is
+        written aside and renamed into place."""
+        entries = len(self)
+        refs = array.array('i', [-1]) * entries
+        value_records = [b""] * entries
+        with gc_paused():
+            for entry in range(entries):
+                if self.is_node[entry]:
+                    refs[entry] = self.values[entry]
+                else:
+                    value_records[entry] = self._encode_value(entry, self.values[entry])
+                continue
+        nodes = len(self.node_first)
+        metadata = [b""] * nodes
+        for node_id, value in self.metadata.items():
+            metadata[node_id] = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            continue
+        states = [b""] * nodes
+        for node_id, value in self.node_states.items():
+            states[node_id] = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            continue
+        info = dict(self.info, byteorder = sys.byteorder)
+
+        sections = [pickle.dumps(info, pickle.HIGHEST_PROTOCOL)]
+        sections.extend(_blob_sections([i.encode("utf-8", "surrogateescape") for i in self.strings]))
+        sections.extend([self.parents, self.keys, bytes(self.is_node), refs])
+        sections.extend(_blob_sections(value_records))
+        sections.extend([self.node_entries, self.node_first, self.node_counts])
+        sections.extend(_blob_sections(metadata))
+        sections.extend(_blob_sections(states))
+        sections.append(self._key_order())
+
+        offset = SNAPSHOT_HEADER.size + SNAPSHOT_SECTION.size * len(sections)
+        table = []
+        for section in sections:
+            offset += -offset % 8
+            table.append(SNAPSHOT_SECTION.pack(offset, len(memoryview(section).cast('B'))))
+            offset += len(memoryview(section).cast('B'))
+            continue
+
+        temp_path = "{0}.tmp{1}".format(path, os.getpid())
+        with open(temp_path, "wb") as handle:
+            handle.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(sections)))
+            handle.write(b"".join(table))
+            for section in sections:
+                handle.write(b"\0" * (-handle.tell() % 8))
+                handle.write(section)
+                continue
+        os.replace(temp_path, path)
+        return None
+
+    @classmethod
+    def load(cls, path):
+        """Maps a snapshot written by save. The arrays are used in place
+        through memoryviews, strings, values, metadata and node states are
+        decoded one at a time on first access."""
+        store = cls()
+        with open(path, "rb") as handle:
+            store._mmap = mmap.mmap(handle.fileno(), 0, access = mmap.ACCESS_READ)
+        buffer = memoryview(store._mmap)
+        magic, version, count = SNAPSHOT_HEADER.unpack_from(buffer, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError("{0} is not a version {1} snapshot!".format(path, SNAPSHOT_VERSION))
+        sections = []
+        for i in range(count):
+            offset, length = SNAPSHOT_SECTION.unpack_from(buffer, SNAPSHOT_HEADER.size + SNAPSHOT_SECTION.size * i)
+            sections.append(buffer[offset:offset + length])
+            continue
+        sections.reverse()
+
+        store.info = pickle.loads(sections.pop())
+        if store.info.pop("byteorder") != sys.byteorder:
+            raise ValueError("{0} was written on a {1} endian machine!".format(path, sys.byteorder))
+        store.strings = MappedBlobs(sections.pop().cast('Q'), sections.pop(), store._decode_string)
+        store.string_ids = None
+        store.parents = sections.pop().cast('i')
+        store.keys = sections.pop().cast('i')
+        store.is_node = sections.pop()
+        refs = sections.pop().cast('i')
+        store.values = MappedBlobs(sections.pop().cast('Q'), sections.pop(),
+                                   lambda entry, data: refs[entry] if store.is_node[entry] else store._decode_value(entry, data))
+        store.node_entries = sections.pop().cast('i')
+        store.node_first = sections.pop().cast('i')
+        store.node_counts = sections.pop().cast('i')
+        store.metadata = MappedBlobs(sections.pop().cast('Q'), sections.pop(), _decode_record)
+        store.node_states = MappedBlobs(sections.pop().cast('Q'), sections.pop(), _decode_record)
+        store.key_order = sections.pop().cast('i')
+        return store
+
+    @staticmethod
+    def _decode_string(string_id, data):
+        return sys.intern(str(data, "utf-8", "surrogateescape"))
+
+class MappedBlobs(object):
+    """Read only sequence over length delimited records in a mapped
+    snapshot, each decoded by <decode>(index, bytes) on first access."""
+    def __init__(self, offsets, blob, decode):
+        self.offsets = offsets
+        self.blob = blob
+        self.decode = decode
+        self._decoded = {}
+        return None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        try:
+            return self._decoded[index]
+        except KeyError:
+            pass
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        value = self.decode(index, self.raw(index))
+        self._decoded[index] = value
+        return value
+
+    def raw(self, index):
+        """The undecoded record, bypassing the decoded cache."""
+        return self.blob[self.offsets[index]:self.offsets[index + 1]].tobytes()
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+            continue
+        return
+
+    def get(self, index, default = None):
+        """For the metadata and node state sections, empty records are None."""
+        value = self[index]
+        if value is None:
+            return default
+        return value
+
+class CompactHierarchyDict(HierarchyDict):
+    """Read only view of one node of a ColumnarStore, with the HierarchyDict
+    mapping, traversal and query API. Use thaw() to get a mutable copy."""
+    __slots__ = ("_store", "_node_id")
+    use_path_index = False
+
+    def __init__(self, store, node_id, container = None):
+        collections.OrderedDict.__init__(self)
+        entry = store.node_entries[node_id]
+        self._store = store
+        self._node_id = node_id
+        self._HierarchyDict__id_ = store.strings[store.keys[entry]]
+        self._id_ = self._HierarchyDict__id_
+        self._container = container
+        self._path_index = None
+        self._attribute_index = None
+        self._ref_id_cache = None
+        self._query_cache = None
+        self._generation = 0
+        self._metadata = store.metadata.get(node_id, None)
+        self._aggregates = None
+        self._digest = None
+        self._frozen_views = None
+        return None
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("{0} is read only, thaw() it first!".format(self.__class__.__name__))
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = move_to_end = _read_only
+
+    @property
+    def _id(self):
+        return self._id_
+
+    @property
+    def container(self):
+        return self._container
+
+    @property
+    def metadata(self):
+        if self._metadata is None:
+            return EMPTY_METADATA
+        return types.MappingProxyType(self._metadata)
+
+    def _entries(self):
+        first = self._store.node_first[self._node_id]
+        return range(first, first + self._store.node_counts[self._node_id])
+
+    def _value(self, entry):
+        store = self._store
+        if store.is_node[entry]:
+            return store.view(store.values[entry])
+        return store._read_value(entry)
+
+    def _find(self, key):
+        if type(key) != str:
+            return None
+        return self._store.find_entry(self._node_id, key)
+
+    def __len__(self):
+        return self._store.node_counts[self._node_id]
+
+    def __iter__(self):
+        store = self._store
+        for entry in self._entries():
+            yield store.strings[store.keys[entry]]
+        return
+
+    def __reversed__(self):
+        return reversed(list(self))
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __getitem__(self, key):
+        entry = self._find(key)
+        if entry is None:
+            raise KeyError(key)
+        return self._value(entry)
+
+    def __eq__(self, other):
+        if not isinstance(other, collections.abc.Mapping):
+            return NotImplemented
+        return list(self.items()) == list(other.items())
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def get(self, key, default = None):
+        entry = self._find(key)
+        if entry is None:
+            return default
+        return self._value(entry)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self._value(i) for i in self._entries()]
+
+    def items(self):
+        store = self._store
+        return [(store.strings[store.keys[i]], self._value(i)) for i in self._entries()]
+
+    _raw_items = items
+
+    def _value_digest(self, key, value):
+        return self._store._value_digest(key, value)
+
+    def _children_named(self, name, ignore_case = False):
+        if not ignore_case:
+            entry = self._find(name)
+            if entry is None:
+                return []
+            return [(name, self._value(entry))]
+        store = self._store
+        return [(store.strings[store.keys[i]], self._value(i))
+                for i in store.find_folded(self._node_id, name)]
+
+    def compact(self):
+        return self
+
+    def freeze(self):
+        return self
+
+    def thaw(self):
+        """Returns a mutable copy of this node and its subtree, see
+        ColumnarStore.thaw."""
+        return self._store.thaw(self._node_id)
+
+    def __copy__(self):
+        return self.thaw()
+
+    def __deepcopy__(self, memo = None):
+        return copy.deepcopy(self.thaw(), memo)
+
+    def __reduce__(self):
+        return self.thaw().__reduce__()
+
+    pass
+
+class FrozenHierarchyDict(HierarchyDict):
+    """Read only, point in time view of a live node from freeze(), with the
+    HierarchyDict mapping, traversal and query API. The view reads its live
+    node's storage until the live side is about to change that node or one
+    above it. The live side then copies the node's entries into the view,
+    its sub nodes as views of their own, so only nodes on changed paths are
+    ever copied. Values are shared and stored as the live node holds them,
+    reads resolve them as the live node's class does (_resolve_value).
+    Mutators hold _FREEZE_LOCK from freezing views through their change,
+    so one thread may keep writing the live tree while others read views.
+    Use thaw() for a mutable copy."""
+    __slots__ = ("_source", "_views", "_node_class", "_state", "_resolved")
+    use_path_index = False
+
+    def __init__(self, source, container = None):
+        collections.OrderedDict.__init__(self)
+        self._source = source
+        self._views = {}
+        self._resolved = {}
+        self._node_class = source._copy_class()
+        self._state = source._copy_state()
+        if self._state:
+            self._state = dict(self._state)
+        self._HierarchyDict__id_ = source._id_
+        self._id_ = source._id_
+        self._container = container
+        self._path_index = None
+        self._attribute_index = None
+        self._ref_id_cache = None
+        self._query_cache = None
+        self._generation = 0
+        self._metadata = dict(source._metadata) if source._metadata else None
+        self._aggregates = None
+        self._digest = None
+        self._frozen_views = None
+        if source._frozen_views is None:
+            source._frozen_views = []
+        source._frozen_views.append(weakref.ref(self))
+        return None
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("{0} is read only, thaw() it first!".format(self.__class__.__name__))
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = move_to_end = _read_only
+
+    def _shared_value(self, key, value):
+        """<value> from the live node, a sub node as its (cached) view."""
+        if not isinstance(value, HierarchyDict):
+            return value
+        view = self._views.get(key, None)
+        if view is None:
+            view = FrozenHierarchyDict(value, self)
+            self._views[key] = view
+        return view
+
+    def _freeze(self):
+        """Copies the live node's entries in, called by the live side
+        under _FREEZE_LOCK just before the node changes."""
+        set_ = collections.OrderedDict.__setitem__
+        for key, value in list(self._source._raw_items()):
+            set_(self, key, self._shared_value(key, value))
+            continue
+        self._source = None
+        return None
+
+    def _read(self, key, value):
+        """Stored <value> as reads return it, resolved once per key."""
+        if isinstance(value, HierarchyDict):
+            return value
+        resolved = self._resolved.get(key, None)
+        if resolved is not None and resolved[0] is value:
+            return resolved[1]
+        read = self._node_class._resolve_value(self._state, key, value)
+        if read is not value:
+            self._resolved[key] = (value, read)
+        return read
+
+    def _items(self, raw = False):
+        """(key, value) pairs, values resolved unless <raw>."""
+        items = None
+        source = self._source
+        if source is not None:
+            with _FREEZE_LOCK:
+                if self._source is source:
+                    items = [(k, self._shared_value(k, v)) for k, v in source._raw_items()]
+        if items is None:
+            items = list(collections.OrderedDict.items(self))
+        if raw:
+            return items
+        return [(k, self._read(k, v)) for k, v in items]
+
+    def _lookup(self, key):
+        """(True, value) for <key>, (False, None) if it is missing."""
+        source = self._source
+        if source is not None:
+            with _FREEZE_LOCK:
+                if self._source is source:
+                    if not collections.OrderedDict.__contains__(source, key):
+                        return (False, None)
+                    value = self._shared_value(key, collections.OrderedDict.__getitem__(source, key))
+                    return (True, self._read(key, value))
+        if not collections.OrderedDict.__contains__(self, key):
+            return (False, None)
+        return (True, self._read(key, collections.OrderedDict.__getitem__(self, key)))
+
+    @property
+    def _id(self):
+        return self._id_
+
+    @property
+    def container(self):
+        return self._container
+
+    @property
+    def metadata(self):
+        if self._metadata is None:
+            return EMPTY_METADATA
+        return types.MappingProxyType(self._metadata)
+
+    def __len__(self):
+        source = self._source
+        if source is not None:
+            length = collections.OrderedDict.__len__(source)
+            if self._source is source:
+                return length
+        return collections.OrderedDict.__len__(self)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __reversed__(self):
+        return reversed(self.keys())
+
+    def __contains__(self, key):
+        return self._lookup(key)[0]
+
+    def __getitem__(self, key):
+        found, value = self._lookup(key)
+        if not found:
+            raise KeyError(key)
+        return value
+
+    def __eq__(self, other):
+        if not isinstance(other, collections.abc.Mapping):
+            return NotImplemented
+        return list(self.items()) == list(other.items())
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def get(self, key, default = None):
+        found, value = self._lookup(key)
+        if not found:
+            return default
+        return value
+
+    def keys(self):
+        return [i[0] for i in self._items()]
+
+    def values(self):
+        return [i[1] for i in self._items()]
+
+    def items(self):
+        return self._items()
+
+    def _raw_items(self):
+        return self._items(True)
+
+    def _children_named(self, name, ignore_case = False):
+        if not ignore_case:
+            found, value = self._lookup(name)
+            if not found:
+                return []
+            return [(name, value)]
+        return [i for i in self.items() if i[0].lower() == name.lower()]
+
+    def _value_digest(self, key, value):
+        """Digests values as the live node's class does, so a view and its
+        live tree compare equal until one changes."""
+        return self._node_class._value_digest(self, key, value)
+
+    def _copy_class(self):
+        return self._node_class
+
+    def _copy_state(self):
+        return self._state
+
+    def freeze(self):
+        return self
+
+    def thaw(self):
+        """Returns a mutable copy of this view and its subtree, in the
+        classes of the live nodes it was taken from."""
+        return _copy_tree(self, None)
+
+    pass
+
 #------------------------------------------------------------------------------#
 # Functions
 #------------------------------------------------------------------------------#
+def _is_glob_segment(segment):
+    return any(i in segment for i in "*?[")
+
+def _glob_segment_regex(segment):
+    """Translates one glob segment to a regex that never crosses KEY_SPLIT."""
+    not_split = "[^{0}]".format(re.escape(KEY_SPLIT))
+    regex = ""
+    i = 0
+    while i < len(segment):
+        char = segment[i]
+        i += 1
+        if char == '*':
+            regex += not_split + '*'
+        elif char == '?':
+            regex += not_split
+        elif char == '[' and ']' in segment[i + 1:]:
+            end = segment.index(']', i + 1)
+            chars = segment[i:end]
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            regex += "[{0}]".format(chars.replace('\\', "\\\\"))
+            i = end + 1
+        else:
+            regex += re.escape(char)
+        continue
+    return regex
+
+def _glob_regex(segments):
+    """Whole ref id regex equivalent to a GlobPattern, for full scans."""
+    if segments == [GLOB_ANY]:
+        return ".*"
+    split = re.escape(KEY_SPLIT)
+    not_split = "[^{0}]".format(split)
+    regex = ""
+    for i, segment in enumerate(segments):
+        if segment == GLOB_ANY:
+            if i == 0:
+                regex += "(?:{0}*{1})*".format(not_split, split)
+                continue
+            regex += "(?:{0}{1}*)*".format(split, not_split)
+            continue
+        if i > 1 or (i == 1 and segments[0] != GLOB_ANY):
+            regex += split
+        regex += _glob_segment_regex(segment)
+        continue
+    return regex
+
+def _compile_glob(pattern, ignore_case = True):
+    """GlobPattern compilation through the shared PATTERN_CACHE."""
+    key = ("glob", pattern, ignore_case)
+    glob = PATTERN_CACHE.get(key)
+    if glob is None:
+        glob = GlobPattern(pattern, ignore_case)
+        PATTERN_CACHE.put(key, glob)
+    return glob
+
+def _compile_regex(pattern, flags = 0):
+    """re.compile through the shared PATTERN_CACHE."""
+    key = ("regex", pattern, flags)
+    regex = PATTERN_CACHE.get(key)
+    if regex is None:
+        regex = re.compile(pattern, flags)
+        PATTERN_CACHE.put(key, regex)
+    return regex
+
+def _glob_escape(segment):
+    """Escapes a literal segment for use in a GlobPattern."""
+    return re.sub(r"([*?[])", r"[\1]", segment)
+
+def _combine_regexes(queries):
+    """Joins (index, regex) pairs into one alternation whose matching branch
+    is named "_q<index>". Returns None if they can't be combined safely."""
+    scoped_flags = {re.IGNORECASE: 'i', re.MULTILINE: 'm', re.DOTALL: 's'}
+    branches = []
+    for i, query in queries:
+        pattern = query.pattern
+        if not isinstance(pattern, str) or re.search(r"\\\d|\(\?P=", pattern):
+            return None
+        flags = query.flags & ~re.UNICODE
+        letters = "".join([v for k, v in scoped_flags.items() if flags & k])
+        if flags & ~sum(scoped_flags):
+            return None
+        if letters:
+            pattern = "(?{0}:{1})".format(letters, pattern)
+        branches.append("(?P<_q{0}>{1})".format(i, pattern))
+        continue
+    if not branches:
+        return None
+    try:
+        return re.compile("|".join(branches))
+    except re.error:
+        return None
+
+def _copy_node(source, container, memo):
+    """New node of <source>'s copy class attached to <container>, with its
+    metadata, state and still valid aggregates and digest."""
+    node = source._copy_class()._bulk_node(source._id_, container)
+    state = source._copy_state()
+    metadata = source._metadata
+    if memo is not None:
+        memo[id(source)] = node
+        state = copy.deepcopy(state, memo) if state else None
+        metadata = copy.deepcopy(metadata, memo) if metadata else None
+    if state:
+        node.__dict__.update(state)
+    node._metadata = dict(metadata) if metadata else None
+    if source._aggregates:
+        node._aggregates = dict(source._aggregates)
+    if source._digest is not None and source._digest[0] == source._generation:
+        node._digest = (0, source._digest[1])
+    return node
+
+def _copy_tree(source, memo = None):
+    """Copies <source> and every node beneath it in one pass, without the
+    per item bookkeeping of __setitem__. Values are shared, or deep copied
+    with <memo> if it is not None."""
+    set_ = collections.OrderedDict.__setitem__
+    with gc_paused():
+        root = _copy_node(source, None, memo)
+        stack = [(source, root)]
+        while stack:
+            node, node_copy = stack.pop()
+            for key, value in node._raw_items():
+                if isinstance(value, HierarchyDict):
+                    stack.append((value, _copy_node(value, node_copy, memo)))
+                    continue
+                if memo is not None:
+                    value = copy.deepcopy(value, memo)
+                set_(node_copy, key, value)
+                continue
+            continue
+    return root
+
+def _container_chain(node):
+    """<node>'s root, the containers in between, then <node>."""
+    chain = []
+    while node is not None:
+        chain.append(node)
+        node = node._container
+        continue
+    chain.reverse()
+    return chain
+
+def _node_record(node):
+    """What a node is rebuilt from, (class, id, metadata, state)."""
+    return (node._copy_class(), node._id_, node._metadata, node._copy_state())
+
+def _restore_node(record, container):
+    cls, id_, metadata, state = record
+    if type(id_) == str:
+        id_ = sys.intern(id_)
+    node = cls._bulk_node(id_, container)
+    node._metadata = metadata
+    if state:
+        node.__dict__.update(state)
+    return node
+
+def _tree_records(root):
+    """<root>'s subtree breadth first as (parent, key, value, record)
+    entries, record being a _node_record for nodes, None for values."""
+    records = [(-1, root._id_, None, _node_record(root))]
+    queue = collections.deque([(root, 0)])
+    nodes = 1
+    while queue:
+        node, index = queue.popleft()
+        for key, value in node._raw_items():
+            if isinstance(value, HierarchyDict):
+                records.append((index, key, None, _node_record(value)))
+                queue.append((value, nodes))
+                nodes += 1
+                continue
+            records.append((index, key, value, None))
+            continue
+        continue
+    return records
+
+def _unpickle_tree(records):
+    """Rebuilds a hierarchy pickled by HierarchyDict.__reduce__."""
+    set_ = collections.OrderedDict.__setitem__
+    nodes = []
+    with gc_paused():
+        for parent, key, value, record in records:
+            container = nodes[parent] if parent >= 0 else None
+            if record is not None:
+                nodes.append(_restore_node(record, container))
+                continue
+            if type(key) == str:
+                key = sys.intern(key)
+            set_(container, key, value)
+            continue
+    return nodes[0]
+
+def _rebuild_chain(records):
+    """Stand ins for a container chain from _node_record()s, returns the
+    last one, None for none."""
+    node = None
+    for record in records:
+        node = _restore_node(record, node)
+        continue
+    return node
+
+def _recurse_task(function, compress, prune, parts):
+    """Runs one task of HierarchyDict._iter_recurse_parallel, returning
+    its (ref_id, result) pairs in walk order."""
+    results = []
+    for chain, node, values, max_depth in parts:
+        container = _rebuild_chain(chain)
+        if node is not None:
+            if container is not None and node._container is None:
+                container[node._id_] = node
+            results.extend(node.iter_recurse(function, compress, prune, max_depth))
+            continue
+        for key, value in values:
+            container[key] = value
+            continue
+        for key, value in container.items():
+            result = function(key, value, container)
+            if compress and result is None:
+                continue
+            results.append((container.get_content_ref_id(key), result))
+            continue
+        continue
+    return results
+
+def _subtree_ref_ids(container, key, value):
+    """Ref_ids of <value> under <key> and, for a node, everything in it."""
+    if not isinstance(value, HierarchyDict):
+        return [container.get_content_ref_id(key)]
+    return [i[0] for i in value._iter_raw_walk()]
+
+def _detached(value):
+    """<value> ready to be stored in another hierarchy, a node as a mutable
+    copy of its subtree."""
+    if not isinstance(value, HierarchyDict):
+        return value
+    return value.copy()
+
+@contextlib.contextmanager
+def gc_paused():
+    """Suspends the cyclic garbage collector for bulk builds, which
+    allocate many long lived objects and would otherwise trigger repeated
+    full collections."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+    return
+
+def _blob_sections(records):
+    """Returns the (offsets, blob) sections for a list of byte strings."""
+    offsets = array.array('Q', [0])
+    total = 0
+    for record in records:
+        total += len(record)
+        offsets.append(total)
+        continue
+    return [offsets, b"".join(records)]
+
+def _decode_record(index, data):
+    if not data:
+        return None
+    return pickle.loads(data)
+
+def _regex_literal_prefix(query):
+    """Returns the whole ref id segments every match of regex <query> must
+    start with, or an empty list if the pattern can't be planned."""
+    pattern = query.pattern
+    if not isinstance(pattern, str) or query.flags & re.VERBOSE or '|' in pattern:
+        return []
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+
+    literal = ""
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            if i + 1 < len(pattern) and not pattern[i + 1].isalnum():
+                literal += pattern[i + 1]
+                i += 2
+                continue
+            break
+        if char in ".^$*+?{}[]()":
+            if char in "*+?{" and literal:
+                literal = literal[:-1]
+            break
+        literal += char
+        i += 1
+        continue
+    return literal.split(KEY_SPLIT)[:-1]
 
 #------------------------------------------------------------------------------#
 # Globals
 #------------------------------------------------------------------------------#
+PATTERN_CACHE = LRUCache(256)
+NODE = NodeMarker()
+COUNT = Rollup("count", lambda key, value: 1)                          #Values in a subtree
+MAX_DEPTH = Rollup("max_depth", lambda key, value: 1, kind = "max", step = 1) #Levels to the deepest entry
+EMPTY_METADATA = types.MappingProxyType({})
+_FREEZE_LOCK = threading.RLock() #Held while views are frozen or read shared
+PROFILE_TARGETS = [(HierarchyDict, i, "operation", None) for i in
+                   ("create_node", "remove_node", "add_node", "_ref_id", "recurse",
+                    "query", "search", "glob", "acquire", "batch", "find", "digest", "merge")]
+PROFILE_TARGETS += [(HierarchyDict, "iter_walk", "counter", "visited"),
+                    (HierarchyDict, "iter_glob", "stats", "visited"),
+                    (HierarchyDict, "iter_query", "stats", "regex"), #One match per visit
+                    (GlobPattern, "step", "counter", "regex")]
+_PROFILER = None #The enabled Profiler
+_PROFILER_LOCK = threading.Lock()
 
 #------------------------------------------------------------------------------#
 # Main
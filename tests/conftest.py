@@ -0,0 +1,113 @@
+#------------------------------------------------------------------------------#
+# Headers
+#------------------------------------------------------------------------------#
+
+__appname__ = "skeleton-app"         #App Name (the whole operation)
+__packagename__ = "skeleton-package" #Package Name (this package)
+__modulename__ = "conftest"          #Module Name (this file)
+__version__ = "0.0.1"                #Version (semver)
+__date__ = "20180625-2330"
+
+__authors__ = ["Kristoffer Law"]     #Primary Authors
+__credits__ = ["Kristoffer Law"]     #Bugfix submissions, minor authors
+__copyright__ = "Kristoffer Law"
+__license__ = "Apache 2.0"
+
+__maintainer__ = "Kristoffer Law"
+__email__ = "klaw@kslaw.me"
+__status__ = "Prototype"            #Prototype, Developer, Production
+
+#------------------------------------------------------------------------------#
+# Imports
+#------------------------------------------------------------------------------#
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fs
+import hierarchy
+#------------------------------------------------------------------------------#
+# Constants
+#------------------------------------------------------------------------------#
+FILE_NAMES = ["report - Draft Final (year 2018) - notes.txt", "image.png",
+              "data (v 2).csv", "script.py", "README"]
+LATENCY = 0.001 #Seconds each stat and scandir sleeps on the delayed filesystem
+
+#------------------------------------------------------------------------------#
+# Functions
+#------------------------------------------------------------------------------#
+def make_tree(path, folders = 30, files_per_folder = 5):
+    """Creates <folders> folders, three per parent breadth first, each
+    holding <files_per_folder> empty files."""
+    os.makedirs(path, exist_ok = True)
+    parents = [path]
+    made = 0
+    while made < folders:
+        parent = parents.pop(0)
+        for i in range(min(3, folders - made)):
+            folder = os.path.join(parent, "folder {0}".format(i))
+            os.mkdir(folder)
+            for j in range(files_per_folder):
+                name = "{0} {1}".format(j, FILE_NAMES[j % len(FILE_NAMES)])
+                open(os.path.join(folder, name), "wb").close()
+                continue
+            parents.append(folder)
+            made += 1
+            continue
+        continue
+    return path
+
+def shape(folder):
+    """Sorted (ref_id, kind) of everything under <folder>, stubs counted as
+    files so lazy and eager walks compare equal."""
+    results = []
+    for ref_id, key, value, container in folder.iter_walk():
+        kind = "folder" if isinstance(value, fs.Folder) else "file"
+        results.append((ref_id, kind))
+        continue
+    return sorted(results)
+
+def walked(path, **kwargs):
+    folder = fs.Folder(path)
+    folder.walk(**kwargs)
+    return folder
+
+def geographic():
+    """A small HierarchyDict with nodes, values and metadata at each level."""
+    root = hierarchy.HierarchyDict("world", kind = "planet")
+    for continent in ("Africa", "Asia", "Europe"):
+        node = root.create_node(continent, kind = "continent")
+        node["population"] = len(continent)
+        for i in range(3):
+            country = node.create_node("{0} {1}".format(continent[:2], i), kind = "country")
+            country["population"] = i
+            country["capital"] = "city {0}".format(i)
+            continue
+        continue
+    return root
+
+#------------------------------------------------------------------------------#
+# Fixtures
+#------------------------------------------------------------------------------#
+@pytest.fixture
+def tree(tmp_path):
+    return make_tree(str(tmp_path / "root"))
+
+@pytest.fixture
+def delayed_fs(monkeypatch):
+    """Stands in for a high latency mount: every fs stat and scandir call
+    sleeps LATENCY seconds first, so listings overlap in parallel walks."""
+    stat, scandir = fs._stat, fs._scandir
+    def stat_(path):
+        time.sleep(LATENCY)
+        return stat(path)
+    def scandir_(path):
+        time.sleep(LATENCY)
+        return scandir(path)
+    monkeypatch.setattr(fs, "_stat", stat_)
+    monkeypatch.setattr(fs, "_scandir", scandir_)
+    return LATENCY
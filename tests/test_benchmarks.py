@@ -0,0 +1,46 @@
+#------------------------------------------------------------------------------#
+# Headers
+#------------------------------------------------------------------------------#
+
+__appname__ = "skeleton-app"         #App Name (the whole operation)
+__packagename__ = "skeleton-package" #Package Name (this package)
+__modulename__ = "test_benchmarks"   #Module Name (this file)
+__version__ = "0.0.1"                #Version (semver)
+__date__ = "20180625-2330"
+
+__authors__ = ["Kristoffer Law"]     #Primary Authors
+__credits__ = ["Kristoffer Law"]     #Bugfix submissions, minor authors
+__copyright__ = "Kristoffer Law"
+__license__ = "Apache 2.0"
+
+__maintainer__ = "Kristoffer Law"
+__email__ = "klaw@kslaw.me"
+__status__ = "Prototype"            #Prototype, Developer, Production
+
+#------------------------------------------------------------------------------#
+# Imports
+#------------------------------------------------------------------------------#
+import os
+import subprocess
+import sys
+
+#------------------------------------------------------------------------------#
+# Constants
+#------------------------------------------------------------------------------#
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks.py")
+
+#------------------------------------------------------------------------------#
+# Tests
+#------------------------------------------------------------------------------#
+def test_profile_report(tmp_path):
+    results = str(tmp_path / "results.json")
+    output = subprocess.run([sys.executable, BENCHMARKS, "--only", "bench_compact", "--size", "20",
+                             "--leaves", "5", "--profile", "--save", results],
+                            check = True, capture_output = True, text = True).stdout
+    lines = output.splitlines()
+    assert lines[0] == "bench_compact"
+    profile = lines[lines.index("profile") + 1:]
+    assert profile[0].strip() == "total"
+    assert "HierarchyDict.recurse" in [i.strip() for i in profile]
+    assert os.path.exists(results)
+    return None
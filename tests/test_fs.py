@@ -0,0 +1,578 @@
+#------------------------------------------------------------------------------#
+# Headers
+#------------------------------------------------------------------------------#
+
+__appname__ = "skeleton-app"         #App Name (the whole operation)
+__packagename__ = "skeleton-package" #Package Name (this package)
+__modulename__ = "test_fs"           #Module Name (this file)
+__version__ = "0.0.1"                #Version (semver)
+__date__ = "20180625-2330"
+
+__authors__ = ["Kristoffer Law"]     #Primary Authors
+__credits__ = ["Kristoffer Law"]     #Bugfix submissions, minor authors
+__copyright__ = "Kristoffer Law"
+__license__ = "Apache 2.0"
+
+__maintainer__ = "Kristoffer Law"
+__email__ = "klaw@kslaw.me"
+__status__ = "Prototype"            #Prototype, Developer, Production
+
+#------------------------------------------------------------------------------#
+# Imports
+#------------------------------------------------------------------------------#
+import asyncio
+import collections
+import copy
+import os
+import pickle
+import random
+import re
+import shutil
+import threading
+import time
+
+import pytest
+
+import fs
+import hierarchy
+from conftest import shape, walked
+
+#------------------------------------------------------------------------------#
+# Functions
+#------------------------------------------------------------------------------#
+def async_walked(path, **kwargs):
+    folder = fs.Folder(path)
+    async def walk_():
+        async for i in folder.async_walk(**kwargs):
+            pass
+        return None
+    asyncio.run(walk_())
+    return folder
+
+def write(path, data, age = 10):
+    """Writes <data> to <path>, dated <age> seconds back so its digest can
+    be cached, see fs.RACY_MTIME_NS."""
+    with open(path, "wb") as file_:
+        file_.write(data)
+    when = os.stat(path).st_mtime - age
+    os.utime(path, (when, when))
+    return path
+
+def backdate(path, age = 10):
+    """Dates every file under <path> <age> seconds back."""
+    for folder, folders, files in os.walk(path):
+        for name in files:
+            file_path = os.path.join(folder, name)
+            when = os.stat(file_path).st_mtime - age
+            os.utime(file_path, (when, when))
+            continue
+        continue
+    return None
+
+def brute_find(folder, **terms):
+    results = set()
+    for ref_id, key, value, container in folder.iter_walk():
+        found = set(hierarchy.AttributeIndex._terms(value))
+        if all((k, v) in found for k, v in terms.items()):
+            results.add(ref_id)
+        continue
+    return results
+
+def stubs(folder):
+    return sum(isinstance(i[2], fs.FileStub) for i in folder._iter_raw_walk())
+
+def classify_images(path):
+    """A classifier written before DirEntry was passed, taking the path only."""
+    return Image if path.endswith(".png") else None
+
+def linear_rank(hooks, path):
+    """The first hook accepting <path>, probing the table in order."""
+    for rank, (hook, cls) in enumerate(hooks):
+        if hasattr(hook, "__call__"):
+            accepted = hook(path)
+        elif hasattr(hook, "match"):
+            accepted = hook.match(path)
+        else:
+            accepted = hook in path
+        if accepted:
+            return rank
+        continue
+    return None
+
+def assert_scanned_or_not(root):
+    """Every folder either holds what its fingerprint says was listed or has
+    no fingerprint, i.e. was never scanned. Returns the unscanned count."""
+    unscanned = 0
+    for folder in root.iter_folders():
+        if folder.fingerprint is None:
+            assert len(folder) == 0, folder.path
+            unscanned += 1
+        else:
+            assert folder.fingerprint.entries == len(folder), folder.path
+        continue
+    return unscanned
+
+def hooked(name, base, hooks):
+    """A <base> subclass named <name> with <hooks> as its __CLASS_HOOKS."""
+    return type(name, (base,), {"_{0}__CLASS_HOOKS".format(name): hooks})
+
+def looped(classifier, path):
+    """(hook, cls) for <path>, the first hook accepting it in table order,
+    the way WalkClassifier probed before its hooks were compiled."""
+    if os.path.isfile(path):
+        hooks = classifier.file_hooks
+    elif os.path.isdir(path):
+        hooks = classifier.folder_hooks
+    else:
+        return (None, None)
+    rank = linear_rank(list(hooks.items()), path)
+    if rank is None:
+        return (None, None)
+    return list(hooks.items())[rank]
+
+#------------------------------------------------------------------------------#
+# Classes
+#------------------------------------------------------------------------------#
+class Image(fs.File):
+    pass
+
+class Canceller(object):
+    """A walk_classifier setting <cancel> on its <after>th call, then
+    holding that listing back for <pause> seconds so the walk stops with
+    it still in flight."""
+    def __init__(self, cancel, after, pause = 0.3):
+        self.cancel = cancel
+        self.after = after
+        self.pause = pause
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, path, entry = None):
+        with self._lock:
+            self.calls += 1
+            if self.calls != self.after:
+                return None
+        self.cancel.set()
+        time.sleep(self.pause)
+        return None
+
+    pass
+
+class Matcher(object):
+    def __init__(self, text):
+        self.text = text
+
+    def match(self, path):
+        return path.endswith(self.text)
+
+    pass
+
+#------------------------------------------------------------------------------#
+# Tests
+#------------------------------------------------------------------------------#
+def test_parallel_walk_matches_serial(tree, delayed_fs):
+    expected = shape(walked(tree))
+    assert shape(walked(tree, workers = 4)) == expected
+    return None
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_async_walk_matches_serial(tree, delayed_fs, lazy):
+    expected = shape(walked(tree, lazy = lazy))
+    assert shape(async_walked(tree, concurrency = 4, lazy = lazy)) == expected
+    assert shape(async_walked(tree, max_depth = 1)) == shape(walked(tree, max_depth = 1))
+    return None
+
+def test_parallel_walk_keeps_order(tree, delayed_fs):
+    order = lambda folder: [i[0] for i in folder.iter_walk()]
+    assert order(walked(tree, workers = 4)) == order(walked(tree))
+    return None
+
+def test_parallel_walk_max_depth(tree, delayed_fs):
+    expected = shape(walked(tree, max_depth = 1))
+    assert shape(walked(tree, workers = 4, max_depth = 1)) == expected
+    assert all(i[0].count("/") <= 3 for i in expected)
+    return None
+
+def test_refresh_matches_fresh_walk(tree):
+    root = walked(tree)
+    shutil.rmtree(os.path.join(tree, "folder 1"))
+    os.remove(os.path.join(tree, "folder 0", "1 image.png"))
+    os.makedirs(os.path.join(tree, "folder 2", "new", "deeper"))
+    open(os.path.join(tree, "folder 2", "new", "deeper", "added.txt"), "w").close()
+    os.rename(os.path.join(tree, "folder 0", "folder 0"), os.path.join(tree, "folder 0", "moved"))
+    summary = root.refresh()
+    assert shape(root) == shape(walked(tree))
+    assert root.ref_id + "/folder 1" in summary["removed"]
+    assert root.ref_id + "/folder 2/new/deeper/added.txt" in summary["added"]
+    return None
+
+def test_refresh_survives_vanishing_folder(tree, monkeypatch):
+    root = walked(tree)
+    victim = os.path.join(tree, "folder 1")
+    stat = fs._stat
+    def stat_(path):
+        #The folder goes away between the root's stat and its own
+        if path == tree and os.path.isdir(victim):
+            result = stat(path)
+            shutil.rmtree(victim)
+            return result
+        return stat(path)
+    monkeypatch.setattr(fs, "_stat", stat_)
+    root.refresh()
+    monkeypatch.undo()
+    root.refresh()
+    assert shape(root) == shape(walked(tree))
+    return None
+
+def test_walk_classifier_pickles():
+    classifier = fs.WalkClassifier([fs.Folder], [fs.File])
+    result = pickle.loads(pickle.dumps(classifier))
+    assert result._hits_lock is not classifier._hits_lock
+    assert copy.deepcopy(classifier).compiled_file_hooks.hooks == classifier.compiled_file_hooks.hooks
+    return None
+
+@pytest.mark.parametrize("literals", [4, 64])
+def test_compiled_hooks_match_linear_probe(literals):
+    rng = random.Random(literals)
+    words = ["draft", "final", "notes", "image", "data", "v2", "report", "a", "old"]
+    exts = [".txt", ".png", ".csv", ".py", ".gz"]
+    hooks = []
+    for i in range(literals):
+        hook = rng.choice([rng.choice(words) + str(i % 5), rng.choice(exts), rng.choice(words)])
+        hooks.append((hook, i))
+        if i % 4 == 0:
+            hooks.append((re.compile(".*" + rng.choice(words)), i))
+        if i % 7 == 0:
+            hooks.append((Matcher(rng.choice(exts)), i))
+        if i % 9 == 0:
+            hooks.append((lambda path, word = rng.choice(words): path.startswith(word), i))
+        continue
+    compiled = fs.CompiledHooks(hooks)
+    for i in range(500):
+        name = " ".join(rng.choice(words) + rng.choice(["", "1", "3"]) for j in range(3))
+        path = os.path.join(rng.choice(["", "old", "data"]), name + rng.choice(exts + ["", ".txt.bak"]))
+        assert compiled.rank(path) == linear_rank(hooks, path), path
+        continue
+    return None
+
+@pytest.mark.parametrize("round_trip", [
+    lambda root, path: pickle.loads(pickle.dumps(root)),
+    lambda root, path: copy.deepcopy(root),
+    lambda root, path: root.compact().thaw(),
+    lambda root, path: root.freeze().thaw(),
+    lambda root, path: (root.save_snapshot(path), fs.Folder.from_snapshot(path))[-1],
+], ids = ["pickle", "deepcopy", "compact", "freeze", "snapshot"])
+def test_lazy_round_trip(tree, tmp_path, round_trip):
+    classifier = fs.WalkClassifier([fs.Folder], [fs.File])
+    root = walked(tree, walk_classifier = classifier, lazy = True)
+    count = stubs(root)
+    result = round_trip(root, str(tmp_path / "snapshot"))
+    assert stubs(root) == count
+    assert stubs(result) == count
+    assert sum(i._stubs for i in result.iter_folders()) == count
+    assert shape(result) == shape(root)
+    assert result.digest() == root.digest()
+    file = result["folder 1"]["1 image.png"]
+    assert isinstance(file, fs.File)
+    assert file.path == os.path.join(tree, "folder 1", "1 image.png")
+    return None
+
+def test_views_resolve_stubs(tree):
+    root = walked(tree, lazy = True)
+    count = stubs(root)
+    for view in (root.freeze(), root.compact()):
+        folder = view["folder 1"]
+        assert isinstance(folder["1 image.png"], fs.File)
+        assert folder["1 image.png"] is folder.get("1 image.png")
+        assert not any(isinstance(i, fs.FileStub) for i in folder.values())
+        assert not any(isinstance(i, fs.FileStub) for i in view.recurse(lambda k, v, c: v).values())
+        continue
+    assert stubs(root) == count
+    return None
+
+def test_lazy_acquire_materializes_one(tree):
+    root = walked(tree, lazy = True)
+    count = stubs(root)
+    file = root.acquire(root.ref_id + "/folder 1/1 image.png")
+    assert isinstance(file, fs.File)
+    assert stubs(root) == count - 1
+    assert root.check_path_index()
+    return None
+
+def test_total_size_needs_sizes(tree):
+    with open(os.path.join(tree, "big"), "wb") as file:
+        file.write(b"x" * 100)
+    assert walked(tree).total_size is None
+    assert walked(tree, sizes = True).total_size == 100
+    assert walked(tree, sizes = True, lazy = True).total_size == 100
+    root = walked(tree, sizes = True)
+    open(os.path.join(tree, "folder 1", "added"), "wb").close()
+    root.refresh(sizes = True)
+    assert root.total_size == 100
+    return None
+
+@pytest.mark.parametrize("kwargs", [{}, {"lazy": True}, {"workers": 2}],
+                         ids = ["serial", "lazy", "parallel"])
+def test_one_argument_classifier(tree, kwargs):
+    root = walked(tree, walk_classifier = classify_images, **kwargs)
+    assert type(root["folder 1"]["1 image.png"]) is Image
+    assert type(root["folder 1"]["0 report - Draft Final (year 2018) - notes.txt"]) is fs.File
+    assert fs.classify(lambda path, entry = None: entry, "x", "entry") == "entry"
+    return None
+
+def test_lazy_snapshot_stores_classifier_once(tree, tmp_path):
+    classifier = fs.WalkClassifier([fs.Folder], [fs.File])
+    classifier.file_hooks.update({"hook {0}".format(i):Image for i in range(45)})
+    classifier.compile()
+    sizes = {}
+    for lazy in (False, True):
+        path = str(tmp_path / "snapshot {0}".format(lazy))
+        walked(tree, walk_classifier = classifier, lazy = lazy).save_snapshot(path)
+        sizes[lazy] = os.path.getsize(path)
+        continue
+    assert sizes[True] < 2 * sizes[False]
+    result = fs.Folder.load_snapshot(path).thaw()
+    classifiers = {id(i[2].walk_classifier) for i in result._iter_raw_walk() if isinstance(i[2], fs.FileStub)}
+    assert len(classifiers) == 1
+    return None
+
+def test_find_duplicates(tree):
+    write(os.path.join(tree, "folder 0", "copy a"), b"same")
+    write(os.path.join(tree, "folder 2", "copy b"), b"same")
+    write(os.path.join(tree, "folder 1", "other"), b"diff")
+    write(os.path.join(tree, "folder 0", "big a"), b"x" * 1000)
+    write(os.path.join(tree, "folder 1", "big b"), b"x" * 1000)
+    root = walked(tree)
+    ref_id = root.ref_id
+    groups = [sorted(i) for i in root.find_duplicates(workers = 2)]
+    assert groups[0] == [ref_id + "/folder 0/big a", ref_id + "/folder 1/big b"]
+    assert groups[1] == [ref_id + "/folder 0/copy a", ref_id + "/folder 2/copy b"]
+    assert not any(ref_id + "/folder 1/other" in i for i in groups)
+    assert any(len(i) > 2 for i in groups) #The empty files made by make_tree
+    return None
+
+def test_digest_cache_hits_after_refresh(tree, tmp_path):
+    for folder in ("folder 0", "folder 1"):
+        write(os.path.join(tree, folder, "data"), folder.encode("utf-8"))
+        continue
+    backdate(tree)
+    root = walked(tree)
+    cache = fs.DigestCache(str(tmp_path / "digests"))
+    first = root.fingerprint_contents(workers = 2, cache = cache)
+    assert first["cached"] == 0 and len(cache) == first["files"]
+    summary = root.refresh()
+    assert not summary["added"] and not summary["removed"]
+    second = root.fingerprint_contents(workers = 2, cache = fs.DigestCache(cache.path))
+    assert second["hit_rate"] == 1.0 and second["bytes_read"] == 0
+    assert second["digests"] == first["digests"]
+    return None
+
+def test_digest_cache_invalidated_by_change(tree):
+    path = write(os.path.join(tree, "folder 0", "data"), b"before")
+    backdate(tree)
+    root = walked(tree)
+    cache = fs.DigestCache()
+    ref_id = root.ref_id + "/folder 0/data"
+    before = root.fingerprint_contents(cache = cache)["digests"][ref_id]
+    size = len(cache)
+    write(path, b"after, longer")
+    root.refresh()
+    summary = root.fingerprint_contents(cache = cache)
+    assert summary["digests"][ref_id] != before
+    assert summary["cached"] == summary["files"] - 1
+    assert len(cache) == size and cache.evictions == 1
+    return None
+
+def test_digest_cache_evicts_least_recently_used():
+    cache = fs.DigestCache(maxsize = 2)
+    cache.put((1, 1, 0, 0), "a")
+    cache.put((1, 2, 0, 0), "b")
+    assert cache.get((1, 1, 0, 0)) == "a"
+    cache.put((1, 3, 0, 0), "c")
+    assert len(cache) == 2 and cache.get((1, 2, 0, 0)) is None
+    assert cache.get((1, 1, 0, 0)) == "a" and cache.evictions == 1
+    return None
+
+def test_profiler_counts_and_restores(tree):
+    originals = [(owner, attribute, vars(owner)[attribute])
+                 for owner, attribute, kind, counter in fs.PROFILE_TARGETS]
+    with hierarchy.Profiler(fs.PROFILE_TARGETS) as profiler:
+        root = walked(tree)
+        root.acquire(root.ref_id + "/folder 1/1 image.png")
+        root.search("*.png")
+        list(root.iter_glob(root.ref_id + "/*/*.png"))
+        assert all(vars(owner)[attribute] is not original for owner, attribute, original in originals)
+    report = profiler.report()
+    assert list(report)[0] == "total"
+    assert report["Folder.walk"]["calls"] == 1
+    assert report["Folder.walk"]["scandir"] == report["total"]["scandir"] == 31
+    assert report["Folder.walk"]["listed"] == 31
+    assert report["HierarchyDict.acquire"]["calls"] == 1
+    assert report["HierarchyDict.search"]["calls"] == 1
+    assert report["total"]["visited"] > 0
+    assert not profiler.enabled
+    assert all(vars(owner)[attribute] is original for owner, attribute, original in originals)
+    with hierarchy.Profiler() as profiler:
+        hierarchy.HierarchyDict("root").create_node("node")
+    assert profiler.report()["HierarchyDict.create_node"]["calls"] == 1
+    return None
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_attribute_index_follows_mutation(tree, lazy):
+    root = walked(tree, lazy = lazy)
+    root.build_attribute_index()
+    del root["folder 1"]["1 image.png"]
+    root["folder 2"].clear()
+    path = write(os.path.join(tree, "folder 0", "added - Draft Draft (v 3).png"), b"")
+    root["folder 0"]["added - Draft Draft (v 3).png"] = fs.File(path)
+    assert root.check_attribute_index()
+    del root["folder 0"]["added - Draft Draft (v 3).png"]
+    root["folder 0"]["added - Draft Draft (v 3).png"] = fs.File(path)
+    root["folder 0"]["folder 0"] = fs.Folder(os.path.join(tree, "folder 0", "folder 0"))
+    assert root.check_attribute_index()
+    for terms in ({"file_ext": "png"}, {"file_ext": "txt", "keyword": "Draft"},
+                  {"key_value": ("v", "3")}, {"key_value": ("v", "2")}):
+        assert set(root.find(**terms)) == brute_find(root, **terms)
+        assert set(root["folder 0"].find(**terms)) == brute_find(root["folder 0"], **terms)
+        continue
+    exts = root.gather_file_exts()
+    root.drop_attribute_index()
+    assert sorted(exts) == sorted(root.gather_file_exts())
+    return None
+
+def test_indexed_purge_matches_scan(tree):
+    indexed = walked(tree)
+    indexed.build_attribute_index()
+    scanned = walked(tree)
+    for file_types in (["py", "txt"], ["py"], []):
+        assert sorted(indexed.purge(file_types)) == sorted(scanned.purge(file_types))
+        assert shape(indexed) == shape(scanned)
+        assert indexed.check_attribute_index()
+        continue
+    return None
+
+def test_rollups_follow_refresh(tree):
+    root = walked(tree, sizes = True)
+    counts = (root.file_count, root["folder 1"].file_count, root.total_size)
+    write(os.path.join(tree, "folder 1", "added"), b"x" * 10)
+    os.remove(os.path.join(tree, "folder 0", "1 image.png"))
+    shutil.rmtree(os.path.join(tree, "folder 2"))
+    root.refresh(sizes = True)
+    fresh = walked(tree, sizes = True)
+    assert root.file_count == fresh.file_count != counts[0]
+    assert root["folder 1"].file_count == fresh["folder 1"].file_count == counts[1] + 1
+    assert root.total_size == fresh.total_size == counts[2] + 10
+    del root["folder 1"]["added"]
+    assert root.total_size == counts[2] and root.rollup("unsized") == 0
+    root["folder 1"]["unsized"] = fs.File(os.path.join(tree, "folder 1", "0 report - Draft Final (year 2018) - notes.txt"))
+    assert root.total_size is None
+    return None
+
+def test_parsed_fields_are_lazy(tmp_path):
+    name = "report - Draft Final (year 2018) (by me) - the notes.txt"
+    write(str(tmp_path / name), b"")
+    file_ = fs.File(str(tmp_path / name))
+    assert not "core_name" in file_.__dict__ and not "file_ext" in file_.__dict__
+    assert file_.key_words == ["Draft", "Final"]
+    assert file_.__dict__["key_values"] == {"year": "2018", "by": "me"}
+    assert (file_.core_name, file_.description, file_.ext) == ("report", "the notes", ".txt")
+    assert (file_.file_name, file_.file_ext) == ("report", "txt")
+    assert isinstance(fs.File.key_words, fs.ParsedField) and "key_words" in file_.__dict__
+    other = fs.File(str(tmp_path / name))
+    other.key_words = ["Kept"]
+    assert other.key_words == ["Kept"] and other.core_name == "report"
+    assert fs.File(str(tmp_path / name)).index_terms() == file_.index_terms()
+    return None
+
+def test_parse_names():
+    names = ["parse {0} - Kw (k {0}).txt".format(i) for i in range(3)]
+    assert not any(i in fs.NAME_CACHE for i in names)
+    stats = fs.NAME_CACHE.stats()
+    assert fs.parse_names(names + names[:1]) == 3
+    assert fs.NAME_CACHE.stats()["hits"] == stats["hits"]
+    assert all(i in fs.NAME_CACHE for i in names)
+    assert fs.parse_names(names) == 0
+    assert fs._parse_name(names[1]) == ("parse 1", ("Kw",), (("k", "1"),), "", ".txt")
+    return None
+
+@pytest.mark.parametrize("literals", [4, 40], ids = ["probe", "aho_corasick"])
+def test_classify_many_matches_hook_loop(tmp_path, literals):
+    rng = random.Random(literals)
+    words = ["draft", "final", "notes", "image", "data", "report", "old"]
+    exts = [".txt", ".png", ".csv", ".py", ".gz"]
+    literal_hooks = list(dict.fromkeys([rng.choice(words) + str(i) for i in range(literals)] + exts))
+    file_classes = [hooked("Literal{0}".format(i), fs.File, literal_hooks[i::3]) for i in range(3)]
+    file_classes.insert(1, hooked("Pattern", fs.File, (re.compile(".*final"), re.compile(r".*\d\.csv$"))))
+    file_classes.append(hooked("Other", fs.File, (Matcher("README"), lambda path: "old" in path)))
+    folder_classes = [hooked("Archive", fs.Folder, (re.compile(".*old"), "data")), fs.Folder]
+    classifier = fs.WalkClassifier(folder_classes, file_classes)
+    assert (classifier.compiled_file_hooks.literal_matcher is not None) == (literals >= 32)
+    assert classifier.compiled_file_hooks.combined is not None
+
+    for i in range(4):
+        folder = tmp_path / rng.choice(["old", "data", "plain"]) / str(i)
+        folder.mkdir(parents = True)
+        for j in range(30):
+            name = " ".join(rng.choice(words) + rng.choice(["", "1", "3", "17"]) for k in range(2))
+            (folder / (name + rng.choice(exts + ["", ".bak"]))).write_bytes(b"")
+            continue
+        (folder / "README").write_bytes(b"")
+        continue
+    paths = [i[0] for i in os.walk(str(tmp_path))]
+    paths.extend(os.path.join(i[0], j) for i in os.walk(str(tmp_path)) for j in i[2])
+    paths.append(str(tmp_path / "missing.txt"))
+    expected = [looped(classifier, i) for i in paths]
+    entries_ = [entry for folder in paths[:-1] if os.path.isdir(folder) for entry in os.scandir(folder)]
+
+    assert classifier.classify_many(paths) == [i[1] for i in expected]
+    assert classifier.hits == collections.Counter(i[0] for i in expected if i[0] is not None)
+    assert classifier.classify_many(entries_) == [looped(classifier, i.path)[1] for i in entries_]
+    assert set(i[1] for i in expected) > {None}
+    return None
+
+def test_cancelled_parallel_walk(tree, delayed_fs):
+    cancel = threading.Event()
+    root = fs.Folder(tree)
+    root.walk(Canceller(cancel, 20), workers = 4, cancel = cancel)
+    assert cancel.is_set()
+    assert 0 < assert_scanned_or_not(root) < 30
+    root.walk(workers = 4)
+    assert shape(root) == shape(walked(tree))
+    return None
+
+def test_cancelled_async_walk(tree, delayed_fs):
+    root = fs.Folder(tree)
+    async def first_(limit):
+        folders = []
+        async for folder in root.async_walk(concurrency = 4):
+            folders.append(folder)
+            if len(folders) >= limit:
+                break
+            continue
+        return folders
+    assert asyncio.run(first_(3))[0] is root
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline and \
+          any(i.fingerprint is not None and i.fingerprint.entries != len(i) for i in root.iter_folders()):
+        time.sleep(0.01) #Running listings finish in the background
+        continue
+    assert 0 < assert_scanned_or_not(root) < 30
+    return None
+
+@pytest.mark.parametrize("kwargs", [{}, {"lazy": True}, {"workers": 4}, {"sizes": True}],
+                         ids = ["serial", "lazy", "parallel", "sizes"])
+def test_walk_stats_folders_only(tree, monkeypatch, kwargs):
+    root = fs.Folder(tree)
+    classifier = fs.WalkClassifier([fs.Folder], [Image, fs.File])
+    monkeypatch.setattr(os.path, "isfile", None) #Any per entry probe fails
+    monkeypatch.setattr(os.path, "isdir", None)
+    fs.reset_syscalls()
+    root.walk(classifier, **kwargs)
+    monkeypatch.undo()
+    folders = len(list(root.iter_folders()))
+    files = len(list(root.iter_files()))
+    assert (folders, files) == (31, 150)
+    #One stat for walk's existence check, then one per folder listed
+    expected = 1 + folders + (files if kwargs.get("sizes") else 0)
+    assert dict(fs.SYSCALLS) == {"stat": expected, "scandir": folders}
+    return None
@@ -0,0 +1,105 @@
+#------------------------------------------------------------------------------#
+# Headers
+#------------------------------------------------------------------------------#
+
+__appname__ = "skeleton-app"         #App Name (the whole operation)
+__packagename__ = "skeleton-package" #Package Name (this package)
+__modulename__ = "test_fswatch"      #Module Name (this file)
+__version__ = "0.0.1"                #Version (semver)
+__date__ = "20180625-2330"
+
+__authors__ = ["Kristoffer Law"]     #Primary Authors
+__credits__ = ["Kristoffer Law"]     #Bugfix submissions, minor authors
+__copyright__ = "Kristoffer Law"
+__license__ = "Apache 2.0"
+
+__maintainer__ = "Kristoffer Law"
+__email__ = "klaw@kslaw.me"
+__status__ = "Prototype"            #Prototype, Developer, Production
+
+#------------------------------------------------------------------------------#
+# Imports
+#------------------------------------------------------------------------------#
+import os
+import shutil
+import sys
+
+import pytest
+
+import fs
+import fswatch
+from conftest import shape, walked
+
+#------------------------------------------------------------------------------#
+# Constants
+#------------------------------------------------------------------------------#
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason = "inotify is Linux only")
+
+#------------------------------------------------------------------------------#
+# Functions
+#------------------------------------------------------------------------------#
+def settle(watcher, polls = 5):
+    """Polls until a poll brings no changes."""
+    for i in range(polls):
+        summary = watcher.poll(0.05)
+        if not any(summary.values()):
+            break
+        continue
+    return None
+
+def assert_matches_disk(watcher):
+    root = watcher.root
+    assert shape(root) == shape(walked(root.path))
+    watched = sorted(i.path for i in watcher.folders.values())
+    assert watched == sorted(i.path for i in root.iter_folders())
+    assert len(watcher.paths) == len(watcher.folders) == len(watcher.watches)
+    return None
+
+#------------------------------------------------------------------------------#
+# Tests
+#------------------------------------------------------------------------------#
+def test_watcher_matches_fresh_walk(tree):
+    with fswatch.FolderWatcher(walked(tree)) as watcher:
+        open(os.path.join(tree, "folder 0", "added.txt"), "w").close()
+        os.remove(os.path.join(tree, "folder 1", "1 image.png"))
+        os.makedirs(os.path.join(tree, "folder 2", "new", "deeper"))
+        open(os.path.join(tree, "folder 2", "new", "deeper", "deep.txt"), "w").close()
+        shutil.rmtree(os.path.join(tree, "folder 0", "folder 1"))
+        os.rename(os.path.join(tree, "folder 1"), os.path.join(tree, "renamed"))
+        settle(watcher)
+        assert_matches_disk(watcher)
+    return None
+
+def test_watcher_recovers_from_vanished_dirty_folder(tree):
+    with fswatch.FolderWatcher(walked(tree), max_pending = 3) as watcher:
+        for i in range(10):
+            open(os.path.join(tree, "folder 1", "new {0}".format(i)), "w").close()
+            continue
+        watcher._queue(watcher.inotify.read()) #Overflows folder 1 into dirty
+        assert watcher.dirty
+        shutil.rmtree(os.path.join(tree, "folder 1"))
+        settle(watcher)
+        assert not watcher.dirty and not watcher.pending
+        assert_matches_disk(watcher)
+        os.makedirs(os.path.join(tree, "folder 2", "later"))
+        settle(watcher)
+        assert_matches_disk(watcher)
+    return None
+
+def test_watcher_one_argument_classifier(tree):
+    classify = lambda path: fs.File if path.endswith(".png") else None
+    with fswatch.FolderWatcher(walked(tree), walk_classifier = classify) as watcher:
+        open(os.path.join(tree, "folder 0", "added.png"), "w").close()
+        settle(watcher)
+        assert type(watcher.root["folder 0"]["added.png"]) is fs.File
+    return None
+
+def test_watcher_follows_bursts(tree):
+    with fswatch.FolderWatcher(walked(tree), max_pending = 3) as watcher:
+        for i in range(10):
+            os.makedirs(os.path.join(tree, "folder 0", "burst {0}".format(i), "inner"))
+            continue
+        shutil.rmtree(os.path.join(tree, "folder 2"))
+        settle(watcher)
+        assert_matches_disk(watcher)
+    return None
@@ -0,0 +1,410 @@
+#------------------------------------------------------------------------------#
+# Headers
+#------------------------------------------------------------------------------#
+
+__appname__ = "skeleton-app"         #App Name (the whole operation)
+__packagename__ = "skeleton-package" #Package Name (this package)
+__modulename__ = "test_hierarchy"    #Module Name (this file)
+__version__ = "0.0.1"                #Version (semver)
+__date__ = "20180625-2330"
+
+__authors__ = ["Kristoffer Law"]     #Primary Authors
+__credits__ = ["Kristoffer Law"]     #Bugfix submissions, minor authors
+__copyright__ = "Kristoffer Law"
+__license__ = "Apache 2.0"
+
+__maintainer__ = "Kristoffer Law"
+__email__ = "klaw@kslaw.me"
+__status__ = "Prototype"            #Prototype, Developer, Production
+
+#------------------------------------------------------------------------------#
+# Imports
+#------------------------------------------------------------------------------#
+import copy
+import pickle
+import random
+import re
+
+import hierarchy
+from conftest import geographic
+
+#------------------------------------------------------------------------------#
+# Classes
+#------------------------------------------------------------------------------#
+class Counted(hierarchy.HierarchyDict):
+    rollups = (hierarchy.COUNT, hierarchy.MAX_DEPTH)
+    pass
+
+#------------------------------------------------------------------------------#
+# Functions
+#------------------------------------------------------------------------------#
+def entries(node):
+    return [(ref_id, value if not isinstance(value, hierarchy.HierarchyDict) else None)
+            for ref_id, key, value, container in node.iter_walk()]
+
+def assert_same(result, root):
+    assert entries(result) == entries(root)
+    assert result.digest() == root.digest()
+    return None
+
+def wide(size = 1000):
+    root = hierarchy.HierarchyDict("root")
+    node = root.create_node("wide")
+    for i in range(size):
+        node["key {0}".format(i)] = i
+        continue
+    node.create_node("key node")["leaf"] = "leaf"
+    return root
+
+def assert_lookups(view, root):
+    node = view["wide"]
+    for i in range(0, len(node) - 1, 7):
+        key = "key {0}".format(i)
+        assert key in node and node[key] == i and node.get(key) == i
+        continue
+    assert "missing" not in node and node.get("missing", "default") == "default"
+    assert "key" not in node and "key 1000" not in node
+    assert node["key node"]["leaf"] == "leaf"
+    assert view.acquire("root/wide/key 500") == 500
+    assert view.acquire("root/wide/key node/leaf") == "leaf"
+    assert view.acquire("root/wide/key -1") is None
+    assert view.acquire("ROOT/Wide/KEY 7") == 7
+    assert view.acquire("ROOT/Wide/KEY 7", ignore_case = False) is None
+    return None
+
+def brute_find(root, **terms):
+    """HierarchyDict.find by scanning every entry's terms."""
+    results = set()
+    for ref_id, key, value, container in root.iter_walk():
+        found = set(hierarchy.AttributeIndex._terms(value))
+        if all((k, v) in found for k, v in terms.items()):
+            results.add(ref_id)
+        continue
+    return results
+
+def recomputed(root, name):
+    """Every node's <name> rollup computed from scratch."""
+    nodes = [i[2] for i in root.iter_walk() if isinstance(i[2], hierarchy.HierarchyDict)]
+    kept = [(i, i._aggregates) for i in nodes]
+    for node in nodes:
+        node._aggregates = None
+        continue
+    results = {i.ref_id:i.rollup(name) for i in nodes}
+    for node, aggregates in kept:
+        node._aggregates = aggregates
+        continue
+    return results
+
+def mutate(root, rng, step):
+    """One random mutation somewhere in <root>."""
+    nodes = [value for ref_id, key, value, container in root.iter_walk()
+             if isinstance(value, hierarchy.HierarchyDict)]
+    node = rng.choice(nodes)
+    action = rng.randrange(7)
+    if action == 0:
+        node["value {0}".format(step)] = step
+    elif action == 1:
+        node.create_node("node {0}".format(step), kind = "new", step = step)
+    elif action == 2 and node is not root:
+        node.container.remove_node(node._id)
+    elif action == 3 and len(node):
+        node[rng.choice(list(node.keys()))] = step #Replaces a value or a sub node
+    elif action == 4 and node is not root:
+        node.clear()
+    elif action == 5:
+        node.update_metadata(kind = "updated", step = step)
+    elif action == 6:
+        moved = rng.choice(nodes)
+        if moved is not root and not _above(moved, node):
+            del moved.container[moved._id]
+            node.add_node(moved)
+    return None
+
+def value_of(key, value, container):
+    return value
+
+def _above(node, other):
+    """True if <node> is <other> or contains it."""
+    while other is not None:
+        if other is node:
+            return True
+        other = other.container
+        continue
+    return False
+
+#------------------------------------------------------------------------------#
+# Tests
+#------------------------------------------------------------------------------#
+def test_path_index_consistent_under_mutation():
+    rng = random.Random(7)
+    root = geographic()
+    root.build_path_index()
+    for step in range(300):
+        mutate(root, rng, step)
+        assert root.check_path_index(), step
+        continue
+    return None
+
+def test_overwritten_node_is_detached():
+    root = geographic()
+    root.build_path_index()
+    asia = root["Asia"]
+    root["Asia"] = 5
+    asia["late"] = 1
+    assert asia.container is None
+    assert root.check_path_index()
+    assert root.acquire("world/Asia") == 5
+    return None
+
+def test_query_matches_keys_and_full_ref_ids():
+    root = geographic()
+    assert set(root.query(re.compile("^capital$"))) == \
+           {"world/{0}/{1} {2}/capital".format(c, c[:2], i)
+            for c in ("Africa", "Asia", "Europe") for i in range(3)}
+    assert list(root.query(re.compile("^world/Asia/As 1/capital$"), full_ref_ids = True).values()) == ["city 1"]
+    assert root.acquire("WORLD/asia/AS 1/capital") == "city 1"
+    assert root.acquire("world/asia/as 1/capital", ignore_case = False) is None
+    return None
+
+def test_search_and_glob():
+    root = geographic()
+    assert len(root.search("CAP*")) == 9
+    assert list(root.search("world/asia/as 1")) == ["world/Asia/As 1"]
+    assert list(root.glob("world/*/As 2/capital").values()) == ["city 2"]
+    assert list(root.glob("WORLD/**/capital")) == list(root.query(re.compile("^capital$")))
+    return None
+
+def test_query_cache_invalidated_by_mutation():
+    root = geographic()
+    query = re.compile("^population$")
+    before = root.query(query)
+    assert root.query(query) == before
+    assert root.cache_stats()["results"]["hits"] >= 1
+    root["Asia"]["As 0"]["population"] = 100
+    assert root.query(query)["world/Asia/As 0/population"] == 100
+    root["Asia"].create_node("As 9")["population"] = 9
+    assert "world/Asia/As 9/population" in root.query(query)
+    asia = root["Asia"]
+    cached = asia.query(query)
+    asia._id = "Asia Minor"
+    assert set(asia.query(query)) == {i.replace("Asia", "Asia Minor", 1) for i in cached}
+    return None
+
+def test_compact_round_trip():
+    root = geographic()
+    view = root.compact()
+    assert_same(view, root)
+    assert_same(view.thaw(), root)
+    assert view.thaw()["Asia"]["As 1"].metadata == root["Asia"]["As 1"].metadata
+    return None
+
+def test_items_round_trip():
+    root = geographic()
+    assert_same(hierarchy.HierarchyDict.from_items(root.to_items()), root)
+    assert list(hierarchy.HierarchyDict.from_paths(["a/b/c", "a/d"]).to_items()) == \
+           [("a/b/c", hierarchy.NODE), ("a/d", hierarchy.NODE)]
+    return None
+
+def test_snapshot_round_trip(tmp_path):
+    root = geographic()
+    path = str(tmp_path / "snapshot")
+    root.save_snapshot(path)
+    view = hierarchy.HierarchyDict.load_snapshot(path)
+    assert_same(view, root)
+    assert_same(view.thaw(), root)
+    return None
+
+def test_copy_round_trip():
+    root = geographic()
+    for result in (copy.deepcopy(root), root.freeze(), root.freeze().thaw()):
+        assert_same(result, root)
+        assert result["Asia"]["As 1"].metadata == root["Asia"]["As 1"].metadata
+        continue
+    return None
+
+def test_frozen_view_keeps_point_in_time():
+    root = geographic()
+    view = root.freeze()
+    expected = entries(view)
+    root["Asia"]["As 0"]["population"] = 100
+    del root["Europe"]
+    root.create_node("Oceania")
+    assert entries(view) == expected
+    assert view["Asia"]["As 0"]["population"] == 0
+    return None
+
+def test_pickle_round_trip():
+    root = geographic()
+    result = pickle.loads(pickle.dumps(root))
+    assert_same(result, root)
+    assert result["Asia"]["As 1"].metadata == root["Asia"]["As 1"].metadata
+    return None
+
+def test_parallel_recurse_matches_serial():
+    root = geographic()
+    assert root.recurse(value_of, workers = 2) == root.recurse(value_of)
+    return None
+
+def test_compact_lookups():
+    root = wide()
+    view = root.compact()
+    assert_lookups(view, root)
+    assert view["wide"]._node_id in view._store._key_indexes
+    return None
+
+def test_snapshot_lookups(tmp_path):
+    root = wide()
+    root["wide"]["KEY 3"] = "upper"
+    path = str(tmp_path / "snapshot")
+    root.save_snapshot(path)
+    view = hierarchy.HierarchyDict.load_snapshot(path)
+    assert view._store.string_ids is None
+    assert_lookups(view, root)
+    assert view.acquire("root/wide/key 3") == [3, "upper"]
+    assert view.acquire("root/wide/KEY 3", ignore_case = False) == "upper"
+    return None
+
+def test_digest_follows_deep_changes():
+    root = geographic()
+    before = root.digest()
+    asia = root["Asia"].digest()
+    africa = root["Africa"].digest()
+    root["Asia"]["As 2"]["capital"] = "moved"
+    assert root.digest() != before and root["Asia"].digest() != asia
+    assert root["Africa"].digest() == africa
+    root["Asia"]["As 2"]["capital"] = "city 2"
+    assert root.digest() == before
+    assert geographic().digest() == before
+    return None
+
+def test_diff_empty_after_merge():
+    ours = geographic()
+    theirs = geographic()
+    theirs["Asia"]["As 2"]["capital"] = "moved"
+    theirs["Europe"].create_node("Eu 9")["population"] = 9
+    del theirs["Africa"]["Af 0"]
+    theirs["Africa"]["population"] = 0
+    theirs.create_node("Oceania")
+    assert sorted(ours.diff(theirs)) == [
+        ("added", "world/Europe/Eu 9"), ("added", "world/Europe/Eu 9/population"),
+        ("added", "world/Oceania"), ("changed", "world/Africa/population"),
+        ("changed", "world/Asia/As 2/capital"), ("removed", "world/Africa/Af 0"),
+        ("removed", "world/Africa/Af 0/capital"), ("removed", "world/Africa/Af 0/population")]
+    kept = geographic()
+    kept.merge(theirs, policy = "theirs")
+    assert [i for i in kept.diff(theirs) if i[0] != "removed"] == []
+    ours.merge(theirs, policy = "mirror")
+    assert list(ours.diff(theirs)) == []
+    assert ours.digest() == theirs.digest()
+    ours["Europe"]["Eu 9"]["population"] = 10
+    assert theirs["Europe"]["Eu 9"]["population"] == 9
+    return None
+
+def test_attribute_index_consistent_under_mutation():
+    rng = random.Random(11)
+    root = geographic()
+    root.build_attribute_index()
+    for step in range(300):
+        mutate(root, rng, step)
+        assert root.check_attribute_index(), step
+        if step % 10 == 0:
+            for kind in ("continent", "country", "new", "updated"):
+                assert set(root.find(metadata = ("kind", kind))) == brute_find(root, metadata = ("kind", kind))
+                continue
+        continue
+    return None
+
+def test_rollups_follow_mutation():
+    rng = random.Random(5)
+    root = Counted("root")
+    nodes = [root]
+    for step in range(400):
+        node = rng.choice(nodes)
+        action = rng.randrange(6)
+        if action == 0 or len(node) < 1:
+            node["value {0}".format(step)] = step
+        elif action == 1:
+            nodes.append(Counted("node {0}".format(step), container = node))
+        elif action == 2:
+            key = rng.choice(list(node.keys()))
+            if isinstance(node[key], hierarchy.HierarchyDict):
+                nodes = [i for i in nodes if not _above(node[key], i)]
+            del node[key]
+        elif action == 3 and node is not root:
+            nodes = [i for i in nodes if i is node or not _above(node, i)]
+            node.clear()
+        elif action == 4:
+            key = rng.choice(list(node.keys()))
+            if not isinstance(node[key], hierarchy.HierarchyDict):
+                nodes.append(Counted(key, container = node))
+        else:
+            root.rollup("count")
+            root.rollup("max_depth")
+        if step % 20 == 0:
+            assert {i.ref_id:i.rollup("count") for i in nodes} == recomputed(root, "count"), step
+            assert {i.ref_id:i.rollup("max_depth") for i in nodes} == recomputed(root, "max_depth"), step
+            assert root.rollup("count") == sum(1 for i in root.iter_walk()
+                                               if not isinstance(i[2], hierarchy.HierarchyDict))
+        continue
+    return None
+
+def test_batch_matches_single_queries():
+    root = geographic()
+    queries = ["world/*/*/capital", "WORLD/Asia/**", re.compile("^world/Europe/Eu [12]/.*"),
+               re.compile(".*/population$"), "world/Oceania/*"]
+    def single_(query):
+        if type(query) == str:
+            return root.glob(query)
+        return root.query(query, full_ref_ids = True)
+    assert root.batch(queries) == {i:single_(i) for i in queries}
+    return None
+
+def test_batch_after_mixed_sets_and_deletes(monkeypatch):
+    root = geographic()
+    queries = ["world/*/*/capital", re.compile(".*/population$")]
+    before = root.batch(queries)
+    touched = []
+    touch = hierarchy.HierarchyDict._touch
+    def touch_(node):
+        touched.append(node.ref_id)
+        return touch(node)
+    monkeypatch.setattr(hierarchy.HierarchyDict, "_touch", touch_)
+    generation = root.generation
+    root["Asia"]["As 0"]["capital"] = "moved"
+    del root["Europe"]["Eu 1"]
+    root["Africa"]["Af 2"]["population"] = 50
+    del root["Asia"]["As 2"]["capital"]
+    assert touched == ["world/Asia/As 0", "world/Europe", "world/Africa/Af 2", "world/Asia/As 2"]
+    assert root.generation == generation + 4
+    after = root.batch(queries)
+    assert after != before
+    assert after[queries[0]]["world/Asia/As 0/capital"] == "moved"
+    assert "world/Asia/As 2/capital" not in after[queries[0]]
+    assert not any(i.startswith("world/Europe/Eu 1/") for i in after[queries[1]])
+    assert after[queries[1]]["world/Africa/Af 2/population"] == 50
+    assert after == {queries[0]:root.glob(queries[0]), queries[1]:root.query(queries[1], full_ref_ids = True)}
+    return None
+
+def test_explain():
+    root = geographic()
+    stats = root.explain("world/asia/*/capital")
+    assert list(stats) == ["visited", "matched", "total", "pruned"]
+    assert stats["matched"] == 3 and stats["total"] == 34
+    assert stats["visited"] < stats["total"] and stats["pruned"] == stats["total"] - stats["visited"]
+    assert root._path_index is None
+    stats = root.explain(re.compile("^world/Asia/As 1/.*"))
+    assert stats["matched"] == 2 and stats["visited"] == 2
+    stats = root.explain("**/capital")
+    assert stats["matched"] == 9 and stats["pruned"] == 0
+    assert root.explain("nowhere/*")["visited"] == 0
+    return None
+
+def test_case_insensitive_glob_with_and_without_index():
+    root = geographic()
+    root["Asia"]["AS 1"] = "upper"
+    walked = root.glob("world/asia/as 1")
+    assert set(walked) == {"world/Asia/As 1", "world/Asia/AS 1"}
+    assert root._path_index is None
+    root.build_path_index()
+    assert root.glob("world/asia/as 1") == walked
+    return None